@@ -0,0 +1,98 @@
+#!/usr/bin/python
+
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import unittest
+import zlib
+
+sys.path.insert(0, "../../")
+
+#Importing csbuild runs a build unless it thinks it's being imported by sphinx.
+sys.runningSphinx = True
+import csbuild
+from csbuild import _distributed
+from csbuild import _distributed_worker as protocol
+sys.exit = csbuild.sysExit
+
+_TOKEN = "secret"
+
+
+class TestRefusedFlags( unittest.TestCase ):
+	def testCompileFlagsAllowed( self ):
+		flags = [ "-m64", "-pass-exit-codes", "-Winvalid-pch", "-c", "-g", "-O2", "-fPIC", "-std=c++11", "-Wall",
+			"-Werror=format", "-fvisibility=hidden", "-x", "c++", "-fsanitize=address,undefined" ]
+		self.assertIsNone( protocol.FindRefusedFlag( flags ) )
+
+	def testPluginsAndOtherProgramsRefused( self ):
+		for flag in ( "-fplugin=evil.so", "-fpass-plugin=evil.so", "-wrapper", "-Bdir", "-specs=evil.specs",
+				"-Wl,-rpath", "-Wa,-o,evil", "-Wp,-MD,evil", "-mllvm", "-Xclang", "@args" ):
+			self.assertEqual( protocol.FindRefusedFlag( [ "-O2", flag ] ), flag )
+
+	def testFilesOutsideDirectoryRefused( self ):
+		for flag in ( "-fprofile-use=/etc/passwd", "-fprofile-generate=../up", "-fdump-tree-all=C:\\x", "/abs/path.c" ):
+			self.assertEqual( protocol.FindRefusedFlag( [ flag ] ), flag )
+		self.assertEqual( protocol.FindRefusedFlag( [ "-o", "/tmp/evil.o" ] ), "-o" )
+		self.assertIsNone( protocol.FindRefusedFlag( [ "-fprofile-generate=profile" ] ) )
+
+	def testSeparateValues( self ):
+		self.assertEqual( protocol.FindRefusedFlag( [ "-x", "/bin/sh" ] ), "/bin/sh" )
+		self.assertEqual( protocol.FindRefusedFlag( [ "-O2", "-x" ] ), "-x" )
+
+	def testJobLeavesOutPreprocessorFlags( self ):
+		job = _distributed.GetJob(
+			'"gcc" -m64 -c -DA_VALUE=1 -D B -UC -O2 -Wall -I"/usr/include" -isystem /opt/include -MMD -MF"a.o.d" -o"a.o" '
+				'"source.i"',
+			"source.i", "a.o"
+		)
+		self.assertEqual( job, { "compiler": "gcc", "flags": [ "-m64", "-c", "-O2", "-Wall" ], "input": "source.i",
+			"output": "a.o" } )
+		self.assertIsNone( _distributed.GetJob( 'gcc -c -fplugin=evil.so -o"a.o" "source.i"', "source.i", "a.o" ) )
+
+
+class TestWorker( unittest.TestCase ):
+	def setUp( self ):
+		self.directory = tempfile.mkdtemp( )
+		self.sock, workerSock = socket.socketpair( )
+		self.worker = threading.Thread( target = protocol._serveConnection,
+			args = ( workerSock, ( "test", 0 ), threading.BoundedSemaphore( 1 ), 1, self.directory, _TOKEN, { "gcc" } ) )
+		self.worker.start( )
+		challenge = protocol.RecvJson( self.sock, protocol.HELLO )["challenge"]
+		protocol.SendJson( self.sock, protocol.AUTH, { "response": protocol.GetAuthResponse( _TOKEN, challenge ) } )
+		protocol.RecvJson( self.sock, protocol.WELCOME )
+
+	def tearDown( self ):
+		self.sock.close( )
+		self.worker.join( )
+		shutil.rmtree( self.directory )
+
+	def Compile( self, compiler, flags, output = "a.o" ):
+		job = { "compiler": compiler, "flags": flags, "input": "source.i", "output": output }
+		protocol.SendJson( self.sock, protocol.JOB, job )
+		protocol.SendFrame( self.sock, protocol.SOURCE, zlib.compress( b"int a( void ) { return 1; }\n" ) )
+		result = protocol.RecvJson( self.sock, protocol.RESULT )
+		protocol.RecvFrame( self.sock, protocol.STDOUT )
+		protocol.RecvFrame( self.sock, protocol.STDERR )
+		obj = zlib.decompress( protocol.RecvFrame( self.sock, protocol.OBJECT ) )
+		return result, obj
+
+	def testCompile( self ):
+		result, obj = self.Compile( "gcc", [ "-O2" ] )
+		self.assertIsNone( result["rejected"] )
+		self.assertEqual( result["returncode"], 0 )
+		self.assertTrue( obj )
+
+	def testRefused( self ):
+		self.assertIn( "is not a compiler", self.Compile( "sh", [ ] )[0]["rejected"] )
+		self.assertIn( "-fplugin=evil.so", self.Compile( "gcc", [ "-fplugin=evil.so" ] )[0]["rejected"] )
+		self.assertIn( "not plain file names", self.Compile( "gcc", [ ], output = "/tmp/evil.o" )[0]["rejected"] )
+		#The connection is still usable after a refusal.
+		self.assertEqual( self.Compile( "gcc", [ ] )[0]["returncode"], 0 )
+		self.assertEqual( os.listdir( self.directory ), [ ] )
+
+
+if __name__ == "__main__":
+	unittest.main( argv = sys.argv[:1] )
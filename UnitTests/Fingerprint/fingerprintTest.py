@@ -0,0 +1,71 @@
+#!/usr/bin/python
+
+import sys
+import unittest
+
+sys.path.insert(0, "../../")
+
+#Importing csbuild runs a build unless it thinks it's being imported by sphinx.
+sys.runningSphinx = True
+import csbuild
+from csbuild import _utils
+sys.exit = csbuild.sysExit
+
+
+def Fingerprint( text ):
+	return _utils._fingerprintBuffer( text )
+
+
+class TestFingerprint( unittest.TestCase ):
+	def assertSame( self, a, b ):
+		self.assertEqual( Fingerprint( a ), Fingerprint( b ) )
+
+	def assertDifferent( self, a, b ):
+		self.assertNotEqual( Fingerprint( a ), Fingerprint( b ) )
+
+	def testLineCommentEdit( self ):
+		self.assertSame( b"int a; // one\nint b;\n", b"int a; // two\nint b;\n" )
+
+	def testBlockCommentEdit( self ):
+		self.assertSame( b"int a; /* one\n two */ int b;\n", b"int a; /* three */ int b;\n" )
+
+	def testRemovedComment( self ):
+		self.assertSame( b"int a; // one\n", b"int a;\n" )
+
+	def testWhitespaceEdit( self ):
+		self.assertSame( b"int  a ;\n\n\nint b;\n", b"int a ;\nint b;   \n" )
+		self.assertSame( b"  int a;\n", b"int a;" )
+
+	def testCommentSeparatesTokens( self ):
+		self.assertDifferent( b"int/**/a;", b"inta;" )
+
+	def testCodeEdit( self ):
+		self.assertDifferent( b"int a;\n", b"int b;\n" )
+
+	def testNewlineIsKept( self ):
+		#Preprocessor directives end at the end of the line.
+		self.assertDifferent( b"#define A\nint a;\n", b"#define A int a;\n" )
+
+	def testStringEdit( self ):
+		self.assertDifferent( b'const char* s = "a // b";\n', b'const char* s = "a // c";\n' )
+		self.assertDifferent( b'const char* s = "a  b";\n', b'const char* s = "a b";\n' )
+
+	def testCharacterEdit( self ):
+		self.assertDifferent( b"char c = '/';\n", b"char c = '*';\n" )
+
+	def testRawStringEdit( self ):
+		self.assertDifferent( b'const char* s = R"(\nfoo // bar\n)";\n', b'const char* s = R"(\nfoo // baz\n)";\n' )
+		self.assertDifferent( b'const char* s = R"(\n/* a */\n)";\n', b'const char* s = R"(\n/* b */\n)";\n' )
+		self.assertDifferent( b'const char* s = R"(a   b)";\n', b'const char* s = R"(a b)";\n' )
+
+	def testRawStringDelimiter( self ):
+		#")" followed by a quote only ends the string if the delimiter matches.
+		self.assertDifferent( b'auto s = R"x(a)" // b)x";\n', b'auto s = R"x(a)" // c)x";\n' )
+		self.assertDifferent( b'auto s = u8R"(a // b)";\n', b'auto s = u8R"(a // c)";\n' )
+
+	def testCommentAfterRawString( self ):
+		self.assertSame( b'auto s = R"(a)"; // one\n', b'auto s = R"(a)"; // two\n' )
+
+
+if __name__ == "__main__":
+	unittest.main( argv = sys.argv[:1] )
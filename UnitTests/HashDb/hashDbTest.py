@@ -0,0 +1,92 @@
+#!/usr/bin/python
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, "../../")
+
+#Importing csbuild runs a build unless it thinks it's being imported by sphinx.
+sys.runningSphinx = True
+import csbuild
+from csbuild import _hash_db
+from csbuild import _shared_globals
+sys.exit = csbuild.sysExit
+
+#Warnings about damaged databases go to the build log, which isn't opened without a build.
+_shared_globals.logFile = open( os.devnull, "w" )
+
+
+class TestHashDatabase( unittest.TestCase ):
+	def setUp( self ):
+		self.directory = tempfile.mkdtemp( )
+		self.previousCacheDirectory = _shared_globals.cacheDirectory
+		_shared_globals.cacheDirectory = self.directory
+		_hash_db.Load( )
+
+	def tearDown( self ):
+		_shared_globals.cacheDirectory = self.previousCacheDirectory
+		shutil.rmtree( self.directory )
+
+	def WriteTwoBatches( self ):
+		_hash_db.Set( ( "md5", "a" ), b"1" )
+		_hash_db.Save( )
+		_hash_db.Set( ( "md5", "b" ), b"2" )
+		_hash_db.Save( )
+
+	def testRoundTrip( self ):
+		self.WriteTwoBatches( )
+		_hash_db.Set( ( "md5", "a" ), None )
+		_hash_db.Save( )
+		_hash_db.Load( )
+		self.assertIsNone( _hash_db.Get( ( "md5", "a" ) ) )
+		self.assertEqual( _hash_db.Get( ( "md5", "b" ) ), b"2" )
+
+	def testTruncatedTail( self ):
+		self.WriteTwoBatches( )
+		dbFile = _hash_db._getDatabaseFile( )
+		with open( dbFile, "r+b" ) as f:
+			f.truncate( os.path.getsize( dbFile ) - 3 )
+
+		_hash_db.Load( )
+		self.assertEqual( _hash_db.Get( ( "md5", "a" ) ), b"1" )
+		self.assertIsNone( _hash_db.Get( ( "md5", "b" ) ) )
+
+		#The damaged batch is dropped from the file the next time anything is saved.
+		_hash_db.Set( ( "md5", "c" ), b"3" )
+		_hash_db.Save( )
+		_hash_db.Load( )
+		self.assertFalse( _hash_db._needsCompaction )
+		self.assertEqual( _hash_db._logRecordCount, 2 )
+		self.assertEqual( _hash_db.Get( ( "md5", "a" ) ), b"1" )
+		self.assertEqual( _hash_db.Get( ( "md5", "c" ) ), b"3" )
+
+	def testCorruptTail( self ):
+		self.WriteTwoBatches( )
+		dbFile = _hash_db._getDatabaseFile( )
+		with open( dbFile, "r+b" ) as f:
+			f.seek( -1, os.SEEK_END )
+			last = f.read( 1 )
+			f.seek( -1, os.SEEK_END )
+			f.write( bytearray( [ ord( last ) ^ 0xff ] ) )
+
+		_hash_db.Load( )
+		self.assertTrue( _hash_db._needsCompaction )
+		self.assertEqual( _hash_db.Get( ( "md5", "a" ) ), b"1" )
+		self.assertIsNone( _hash_db.Get( ( "md5", "b" ) ) )
+
+	def testUnrecognizedFile( self ):
+		with open( _hash_db._getDatabaseFile( ), "wb" ) as f:
+			f.write( b"not a hash database" )
+		_hash_db.Load( )
+		self.assertIsNone( _hash_db.Get( ( "md5", "a" ) ) )
+		_hash_db.Set( ( "md5", "a" ), b"1" )
+		_hash_db.Save( )
+		_hash_db.Load( )
+		self.assertEqual( _hash_db.Get( ( "md5", "a" ) ), b"1" )
+
+
+if __name__ == "__main__":
+	unittest.main( argv = sys.argv[:1] )
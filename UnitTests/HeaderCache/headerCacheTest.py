@@ -0,0 +1,104 @@
+#!/usr/bin/python
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, "../../")
+
+#Importing csbuild runs a build unless it thinks it's being imported by sphinx.
+sys.runningSphinx = True
+import csbuild
+from csbuild import _header_cache
+from csbuild import _shared_globals
+from csbuild import _stat_cache
+sys.exit = csbuild.sysExit
+
+_shared_globals.logFile = open( os.devnull, "w" )
+
+
+class TestHeaderCache( unittest.TestCase ):
+	def setUp( self ):
+		self.directory = tempfile.mkdtemp( )
+		self.previousCacheDirectory = _shared_globals.cacheDirectory
+		_shared_globals.cacheDirectory = self.directory
+		self.scanned = [ ]
+		self.Reload( )
+
+	def tearDown( self ):
+		_shared_globals.cacheDirectory = self.previousCacheDirectory
+		_stat_cache.Clear( )
+		shutil.rmtree( self.directory )
+
+	def Write( self, name, text, age = 100 ):
+		path = os.path.join( self.directory, name )
+		with open( path, "w" ) as f:
+			f.write( text )
+		#Old enough that its timestamp can be trusted.
+		then = time.time( ) - age
+		os.utime( path, ( then, then ) )
+		return path
+
+	def Scanner( self, path ):
+		self.scanned.append( os.path.basename( path ) )
+		with open( path ) as f:
+			return [ line.split( '"' )[1] for line in f if line.startswith( "#include" ) ]
+
+	def Reload( self ):
+		_header_cache.Save( )
+		_stat_cache.Clear( )
+		_header_cache.Load( [ ] )
+
+	def testHeaderEditInvalidatesIncluders( self ):
+		header = self.Write( "a.h", "int a;\n" )
+		other = self.Write( "b.h", "int b;\n" )
+		source = self.Write( "main.c", '#include "a.h"\n' )
+		unrelated = self.Write( "other.c", '#include "b.h"\n' )
+		for path in ( source, header, unrelated, other ):
+			_header_cache.GetIncludedFiles( path, self.Scanner )
+		_shared_globals.allheaders[source] = set( [ header ] )
+		_shared_globals.allheaders[unrelated] = set( [ other ] )
+
+		self.Reload( )
+		self.scanned = [ ]
+		self.assertIn( source, _shared_globals.allheaders )
+		self.assertEqual( _header_cache.GetIncludedFiles( source, self.Scanner ), [ "a.h" ] )
+		self.assertEqual( self.scanned, [ ] )
+
+		self.Write( "a.h", "int a;\nint c;\n", age = 50 )
+		self.Reload( )
+		self.assertNotIn( source, _shared_globals.allheaders )
+		self.assertIn( unrelated, _shared_globals.allheaders )
+
+		#Only the edited header has to be scanned again.
+		for path in ( source, header, unrelated, other ):
+			_header_cache.GetIncludedFiles( path, self.Scanner )
+		self.assertEqual( self.scanned, [ "a.h" ] )
+
+	def testHeaderEditReportsChangedDependency( self ):
+		header = self.Write( "a.h", "int a;\n" )
+		other = self.Write( "b.h", "int b;\n" )
+		source = self.Write( "main.c", '#include "a.h"\n#include "b.h"\n' )
+		obj = self.Write( "main.o", "object" )
+		_header_cache.SetObjectDependencies( obj, [ source, header, other ], "project", source, 1.0 )
+
+		self.Reload( )
+		self.assertEqual( _header_cache.GetObjectDependencies( obj ), [ source, header, other ] )
+		self.assertEqual( _header_cache.GetChangedDependencies( obj ), [ ] )
+
+		self.Write( "a.h", "int a;\nint c;\n", age = 50 )
+		self.Reload( )
+		self.assertEqual( _header_cache.GetChangedDependencies( obj ), [ header ] )
+		self.assertEqual( [ dependent[0] for dependent in _header_cache.GetDependents( header ) ], [ obj ] )
+
+		#Once the object has been checked, the edit isn't reported again.
+		_header_cache.MarkObjectUpToDate( obj )
+		self.Reload( )
+		self.assertEqual( _header_cache.GetChangedDependencies( obj ), [ ] )
+
+
+if __name__ == "__main__":
+	unittest.main( argv = sys.argv[:1] )
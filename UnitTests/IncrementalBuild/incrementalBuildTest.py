@@ -0,0 +1,142 @@
+#!/usr/bin/python
+
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+_MAKEFILE = """
+import os
+import sys
+sys.path.insert(0, os.environ["CSBUILD_PATH"])
+
+import csbuild
+
+csbuild.Toolchain("gcc").SetCcCommand("gcc")
+csbuild.DisableChunkedBuild()
+
+@csbuild.project(name="app", workingDirectory="src")
+def app():
+	csbuild.SetOutput("app", csbuild.ProjectType.Application)
+	csbuild.AddDefines("A_VALUE={}".format(os.environ.get("A_VALUE", "1")))
+
+#Shares its output directory with app.
+@csbuild.project(name="other", workingDirectory="other")
+def other():
+	csbuild.SetOutput("other", csbuild.ProjectType.Application)
+	csbuild.AddDefines("O_VALUE=1")
+"""
+
+_SOURCES = {
+	"src/a.c": "int a( void ) { return A_VALUE; }\n",
+	"src/b.c": "int b( void ) { return 2; }\n",
+	"src/main.c": "int a( void );\nint b( void );\nint main( void ) { return a( ) + b( ) == 3 ? 0 : 1; }\n",
+	"other/o.c": "int main( void ) { return O_VALUE - 1; }\n",
+}
+
+_ansiEscape = re.compile( r"\x1b[^m]*m" )
+_compilingRegex = re.compile( r"Compiling (\S+?)_release\.o" )
+
+
+class IncrementalBuildTest( unittest.TestCase ):
+	"""
+	Builds a small C project in a temporary directory, changing it between builds.
+	"""
+	def setUp( self ):
+		self.directory = tempfile.mkdtemp( )
+		os.mkdir( os.path.join( self.directory, "src" ) )
+		os.mkdir( os.path.join( self.directory, "other" ) )
+		with open( os.path.join( self.directory, "make.py" ), "w" ) as f:
+			f.write( _MAKEFILE )
+		for name, text in _SOURCES.items( ):
+			self.Write( name, text )
+
+	def tearDown( self ):
+		shutil.rmtree( self.directory )
+
+	def Write( self, name, text ):
+		path = os.path.join( self.directory, name )
+		with open( path, "w" ) as f:
+			f.write( text )
+		#Make sure the edit is newer than anything built from the file before it.
+		then = time.time( ) + 1
+		os.utime( path, ( then, then ) )
+
+	def Settle( self ):
+		"""
+		Move everything in the build back in time, so nothing looks like it could have changed while it was being built
+		and the next successful build writes a manifest.
+		"""
+		then = time.time( ) - 60
+		for root, dirnames, filenames in os.walk( self.directory ):
+			for name in dirnames + filenames:
+				os.utime( os.path.join( root, name ), ( then, then ) )
+		os.utime( self.directory, ( then, then ) )
+
+	def Build( self, **environment ):
+		env = dict( os.environ )
+		env["CSBUILD_PATH"] = os.path.abspath( "../../" )
+		env.update( environment )
+		fd = subprocess.Popen( [ sys.executable, "make.py", "-v" ], stdout = subprocess.PIPE, stderr = subprocess.STDOUT,
+			cwd = self.directory, env = env )
+		output, _ = fd.communicate( )
+		if sys.version_info >= (3, 0):
+			output = output.decode( "utf-8", "replace" )
+		output = _ansiEscape.sub( "", output ).replace( "\r", "\n" )
+		self.assertEqual( fd.returncode, 0, output )
+		return output
+
+	def Compiled( self, output ):
+		return sorted( _compilingRegex.findall( output ) )
+
+	def testChangedCommandOnlyRecompilesAffectedObjects( self ):
+		self.assertEqual( self.Compiled( self.Build( ) ), [ "a", "b", "main", "o" ] )
+		self.assertEqual( self.Compiled( self.Build( ) ), [ ] )
+
+		output = self.Build( A_VALUE = "2" )
+		self.assertEqual( self.Compiled( output ), [ "a", "b", "main" ] )
+		self.assertIn( "because the command used to compile it has changed", output )
+		self.assertEqual( self.Compiled( self.Build( A_VALUE = "2" ) ), [ ] )
+
+	def testIdenticalObjectSkipsRelink( self ):
+		self.Build( )
+		output = os.path.join( self.directory, "gcc-x64-release", "app" )
+		linked = os.stat( output ).st_mtime
+
+		#Recompiled, but into exactly the same object as before.
+		self.Write( "src/b.c", "#define UNUSED 1\nint b( void ) { return 2; }\n" )
+		self.assertEqual( self.Compiled( self.Build( ) ), [ "b" ] )
+		self.assertEqual( os.stat( output ).st_mtime, linked )
+
+		self.Write( "src/b.c", "int b( void ) { return 1 + 1; }\nint c( void ) { return 3; }\n" )
+		self.assertEqual( self.Compiled( self.Build( ) ), [ "b" ] )
+		self.assertNotEqual( os.stat( output ).st_mtime, linked )
+
+	def testManifestSkipsUnchangedBuild( self ):
+		#Everything was only just written, so it could still be changing.
+		self.assertIn( "Not writing a build manifest", self.Build( ) )
+		self.Settle( )
+		self.assertNotIn( "Not writing a build manifest", self.Build( ) )
+
+		output = self.Build( )
+		self.assertIn( "Nothing has changed since the last successful build", output )
+		self.assertEqual( self.Compiled( output ), [ ] )
+
+	def testManifestNotUsedWhenMakefileEnvironmentChanges( self ):
+		self.Build( )
+		self.Settle( )
+		self.Build( )
+		self.assertIn( "Nothing has changed since the last successful build", self.Build( ) )
+
+		#The makefile reads A_VALUE, so changing it changes what gets built.
+		output = self.Build( A_VALUE = "2" )
+		self.assertNotIn( "Nothing has changed since the last successful build", output )
+		self.assertEqual( self.Compiled( output ), [ "a", "b", "main" ] )
+
+
+if __name__ == "__main__":
+	unittest.main( argv = sys.argv[:1] )
@@ -0,0 +1,95 @@
+#!/usr/bin/python
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, "../../")
+
+#Importing csbuild runs a build unless it thinks it's being imported by sphinx.
+sys.runningSphinx = True
+import csbuild
+from csbuild import _object_cache
+from csbuild import _shared_globals
+sys.exit = csbuild.sysExit
+
+#Cache reports go to the build log, which isn't opened without a build.
+_shared_globals.logFile = open( os.devnull, "w" )
+
+_OBJECT_SIZE = 1000
+_ENTRY_SIZE = _object_cache._ENTRY_HEADER.size + _OBJECT_SIZE
+
+
+class TestObjectCache( unittest.TestCase ):
+	def setUp( self ):
+		self.directory = tempfile.mkdtemp( )
+		self.cacheDirectory = os.path.join( self.directory, "cache" )
+		self.obj = os.path.join( self.directory, "file.o" )
+
+	def tearDown( self ):
+		_object_cache.Stop( )
+		shutil.rmtree( self.directory )
+
+	def StoreEntries( self, count ):
+		"""
+		Store count entries, each last used a minute after the one before.
+
+		:return: Their keys, oldest first
+		:rtype: list[str]
+		"""
+		keys = [ ]
+		now = time.time( )
+		for i in range( count ):
+			key = _object_cache.GetKey( "compiler", "cc {}", self.directory, str( i ).encode( "utf-8" ) )
+			with open( self.obj, "wb" ) as f:
+				f.write( b"x" * _OBJECT_SIZE )
+			_object_cache.Store( key, self.obj, b"", b"" )
+			lastUsed = now - 60 * ( count - i )
+			os.utime( _object_cache._getPath( key ), ( lastUsed, lastUsed ) )
+			keys.append( key )
+		return keys
+
+	def IsCached( self, key ):
+		#Checked after the cache is stopped, when it no longer knows its directory.
+		return os.path.exists( os.path.join( self.cacheDirectory, key[:2], key[2:] ) )
+
+	def testRoundTrip( self ):
+		_object_cache.Start( self.cacheDirectory, None )
+		key = self.StoreEntries( 1 )[0]
+		os.remove( self.obj )
+		self.assertEqual( _object_cache.Fetch( key, self.obj ), ( b"", b"" ) )
+		with open( self.obj, "rb" ) as f:
+			self.assertEqual( f.read( ), b"x" * _OBJECT_SIZE )
+
+	def testLeastRecentlyUsedEvicted( self ):
+		_object_cache.Start( self.cacheDirectory, int( _ENTRY_SIZE * 3.5 ) )
+		keys = self.StoreEntries( 4 )
+		#Using the oldest entry makes the second oldest the least recently used.
+		self.assertIsNotNone( _object_cache.Fetch( keys[0], self.obj ) )
+		_object_cache.Stop( )
+
+		self.assertFalse( self.IsCached( keys[1] ) )
+		for key in ( keys[0], keys[2], keys[3] ):
+			self.assertTrue( self.IsCached( key ) )
+
+	def testNoEvictionWithinMaxSize( self ):
+		_object_cache.Start( self.cacheDirectory, _ENTRY_SIZE * 4 )
+		keys = self.StoreEntries( 4 )
+		_object_cache.Stop( )
+
+		for key in keys:
+			self.assertTrue( self.IsCached( key ) )
+
+	def testTrimmedBelowMaxSize( self ):
+		_object_cache.Start( self.cacheDirectory, _ENTRY_SIZE * 4 )
+		keys = self.StoreEntries( 5 )
+		_object_cache.Stop( )
+
+		#Trimming goes below the maximum size, so the next few stores don't trim again.
+		self.assertEqual( [ self.IsCached( key ) for key in keys ], [ False, False, True, True, True ] )
+
+if __name__ == "__main__":
+	unittest.main( argv = sys.argv[:1] )
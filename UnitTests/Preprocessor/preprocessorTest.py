@@ -0,0 +1,201 @@
+#!/usr/bin/python
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, "../../")
+
+#Importing csbuild runs a build unless it thinks it's being imported by sphinx.
+sys.runningSphinx = True
+import csbuild
+from csbuild import _preprocessor
+sys.exit = csbuild.sysExit
+
+
+def Evaluate( expression, macros = None, complete = True ):
+	scanner = _preprocessor._Scanner( None, _preprocessor._MacroState( macros or { }, ( ), complete ) )
+	return scanner._evaluate( "if", expression )
+
+
+class TestExpressions( unittest.TestCase ):
+	def testArithmetic( self ):
+		self.assertIs( Evaluate( "1 + 2 * 3 == 7" ), True )
+		self.assertIs( Evaluate( "(1 + 2) * 3 == 9" ), True )
+		self.assertIs( Evaluate( "10 - 4 - 3 == 3" ), True )
+		self.assertIs( Evaluate( "0x10 == 16 && 010 == 8" ), True )
+		self.assertIs( Evaluate( "1 << 4 == 16 && 256 >> 4 == 16" ), True )
+		self.assertIs( Evaluate( "'a' == 97 && '\\n' == 10" ), True )
+		self.assertIs( Evaluate( "0" ), False )
+
+	def testDivisionTruncatesTowardsZero( self ):
+		self.assertIs( Evaluate( "-7 / 2 == -3" ), True )
+		self.assertIs( Evaluate( "-7 % 2 == -1" ), True )
+		self.assertIs( Evaluate( "7 % -2 == 1" ), True )
+
+	def testDivisionByZeroIsUnknown( self ):
+		self.assertIsNone( Evaluate( "1 / 0" ) )
+		self.assertIsNone( Evaluate( "1 % 0" ) )
+
+	def testSignedArithmetic( self ):
+		self.assertIs( Evaluate( "-1 > 0" ), False )
+		self.assertIs( Evaluate( "~0 < 0" ), True )
+		self.assertIs( Evaluate( "-1 >> 1 == -1" ), True )
+
+	def testUnsignedArithmetic( self ):
+		self.assertIs( Evaluate( "~0U > 0" ), True )
+		self.assertIs( Evaluate( "-1 > 0u" ), True )
+		self.assertIs( Evaluate( "0u - 1 == 18446744073709551615u" ), True )
+		self.assertIs( Evaluate( "-1 == 0xFFFFFFFFFFFFFFFFull" ), True )
+		self.assertIs( Evaluate( "(0u - 1) >> 63 == 1" ), True )
+		self.assertIs( Evaluate( "-1 / 2u > 0" ), True )
+
+	def testLargeConstantsAreUnsigned( self ):
+		self.assertIs( Evaluate( "0xFFFFFFFFFFFFFFFF > 0" ), True )
+		self.assertIs( Evaluate( "18446744073709551615 > 0" ), True )
+
+	def testComparisonsAreSigned( self ):
+		self.assertIs( Evaluate( "(1u > 0) - 2 < 0" ), True )
+
+	def testShiftKeepsTypeOfLeftOperand( self ):
+		self.assertIs( Evaluate( "(-1 << 1u) < 0" ), True )
+		self.assertIs( Evaluate( "(1u << 63) > 0" ), True )
+
+	def testUndefinedShiftIsUnknown( self ):
+		self.assertIsNone( Evaluate( "1 << 64" ) )
+		self.assertIsNone( Evaluate( "1 >> -1" ) )
+
+	def testConditionalOperator( self ):
+		self.assertIs( Evaluate( "1 ? 2 : 0" ), True )
+		self.assertIs( Evaluate( "0 ? 2 : 0" ), False )
+		self.assertIs( Evaluate( "(1 ? -1 : 0u) > 0" ), True )
+		self.assertIs( Evaluate( "UNKNOWN ? 1 : 1", complete = False ), True )
+		self.assertIsNone( Evaluate( "UNKNOWN ? 1 : 0", complete = False ) )
+
+	def testDefined( self ):
+		macros = { "FOO": ( None, "1" ) }
+		self.assertIs( Evaluate( "defined(FOO)", macros ), True )
+		self.assertIs( Evaluate( "defined FOO && !defined(BAR)", macros ), True )
+		self.assertIsNone( Evaluate( "defined(BAR)", macros, complete = False ) )
+
+	def testMacroExpansion( self ):
+		macros = { "VERSION": ( None, "0x1000u" ), "NEWER": ( None, "(VERSION + 1)" ), "EMPTY": ( None, "" ) }
+		self.assertIs( Evaluate( "NEWER > VERSION", macros ), True )
+		self.assertIs( Evaluate( "VERSION >= 4096", macros ), True )
+		self.assertIs( Evaluate( "EMPTY", macros ), False )
+		self.assertIs( Evaluate( "UNDEFINED_NAME == 0", macros ), True )
+
+	def testFunctionLikeMacroIsUnknown( self ):
+		self.assertIsNone( Evaluate( "CHECK(1)", { "CHECK": ( "(x)", "x" ) } ) )
+
+	def testUnknownOperands( self ):
+		self.assertIs( Evaluate( "0 && UNKNOWN", complete = False ), False )
+		self.assertIs( Evaluate( "1 || UNKNOWN", complete = False ), True )
+		self.assertIsNone( Evaluate( "1 && UNKNOWN", complete = False ) )
+		self.assertIsNone( Evaluate( "UNKNOWN + 1", complete = False ) )
+
+	def testMalformedIsUnknown( self ):
+		self.assertIsNone( Evaluate( "1 +" ) )
+		self.assertIsNone( Evaluate( "(1" ) )
+		self.assertIsNone( Evaluate( "1 $ 2" ) )
+
+
+class _Project( object ):
+	def __init__( self, directory ):
+		self.workingDirectory = directory
+		self.ignoreExternalHeaders = False
+		self.headerRecursionDepth = 0
+
+	def get_full_path( self, header, relativeDir ):
+		path = os.path.join( relativeDir, header )
+		return path if os.path.exists( path ) else ""
+
+
+class TestScanner( unittest.TestCase ):
+	def setUp( self ):
+		self.directory = tempfile.mkdtemp( )
+
+	def tearDown( self ):
+		shutil.rmtree( self.directory )
+
+	def Write( self, name, text ):
+		with open( os.path.join( self.directory, name ), "w" ) as f:
+			f.write( text )
+		return os.path.join( self.directory, name )
+
+	def Scan( self, source, macros = None, complete = True ):
+		for name in ( "a.h", "b.h", "c.h", "d.h" ):
+			self.Write( name, "" )
+		path = self.Write( "main.c", source )
+		macroState = _preprocessor._MacroState( macros or { }, ( ), complete )
+		headers = _preprocessor._Scanner( _Project( self.directory ), macroState ).Scan( path )
+		if headers is None:
+			return None
+		return sorted( os.path.basename( header ) for header in headers )
+
+	def testElifChain( self ):
+		source = "#if VALUE == 1\n#include \"a.h\"\n#elif VALUE == 2\n#include \"b.h\"\n#elif VALUE == 3\n#include \"c.h\"\n#else\n#include \"d.h\"\n#endif\n"
+		self.assertEqual( self.Scan( source, { "VALUE": ( None, "2" ) } ), [ "b.h" ] )
+		self.assertEqual( self.Scan( source, { "VALUE": ( None, "4" ) } ), [ "d.h" ] )
+
+	def testElifAfterUnknownBranch( self ):
+		source = "#ifdef UNKNOWN\n#include \"a.h\"\n#elif 1\n#include \"b.h\"\n#else\n#include \"c.h\"\n#endif\n"
+		self.assertEqual( self.Scan( source, complete = False ), [ "a.h", "b.h" ] )
+
+	def testElifdef( self ):
+		source = "#ifdef FOO\n#include \"a.h\"\n#elifdef BAR\n#include \"b.h\"\n#elifndef BAZ\n#include \"c.h\"\n#endif\n"
+		self.assertEqual( self.Scan( source, { "BAR": ( None, "" ) } ), [ "b.h" ] )
+		self.assertEqual( self.Scan( source ), [ "c.h" ] )
+
+	def testNestedInactiveBlock( self ):
+		source = "#if 0\n#if 1\n#include \"a.h\"\n#else\n#include \"b.h\"\n#endif\n#else\n#include \"c.h\"\n#endif\n"
+		self.assertEqual( self.Scan( source ), [ "c.h" ] )
+
+	def testUnsignedConditionKeepsBranch( self ):
+		source = "#if -1 > 0u\n#include \"a.h\"\n#else\n#include \"b.h\"\n#endif\n"
+		self.assertEqual( self.Scan( source ), [ "a.h" ] )
+
+	def testDefineInsideFile( self ):
+		source = "#define FOO 1\n#if FOO\n#include \"a.h\"\n#endif\n#undef FOO\n#ifdef FOO\n#include \"b.h\"\n#endif\n"
+		self.assertEqual( self.Scan( source ), [ "a.h" ] )
+
+	def testIncludeGuard( self ):
+		self.Write( "guarded.h", "#ifndef GUARDED_H\n#define GUARDED_H\n#define SEEN\n#endif\n" )
+		source = "#include \"guarded.h\"\n#undef SEEN\n#include \"guarded.h\"\n#ifdef SEEN\n#include \"a.h\"\n#endif\n"
+		self.assertEqual( self.Scan( source ), [ "guarded.h" ] )
+		guard, _ = _preprocessor.ScanDirectives( os.path.join( self.directory, "guarded.h" ) )
+		self.assertEqual( guard, "GUARDED_H" )
+
+	def testNotAnIncludeGuard( self ):
+		path = self.Write( "unguarded.h", "#ifndef FOO\n#define FOO\n#endif\n#include \"a.h\"\n" )
+		guard, _ = _preprocessor.ScanDirectives( path )
+		self.assertIsNone( guard )
+
+	def testPragmaOnce( self ):
+		self.Write( "once.h", "#pragma once\n#define SEEN\n" )
+		source = "#include \"once.h\"\n#undef SEEN\n#include \"once.h\"\n#ifdef SEEN\n#include \"a.h\"\n#endif\n"
+		self.assertEqual( self.Scan( source ), [ "once.h" ] )
+
+	def testComputedInclude( self ):
+		source = "#define HEADER \"b.h\"\n#include HEADER\n"
+		self.assertEqual( self.Scan( source ), [ "b.h" ] )
+
+	def testUnexpandableComputedIncludeIsUnknown( self ):
+		source = "#include \"a.h\"\n#include HEADER\n"
+		self.assertIsNone( self.Scan( source, complete = False ) )
+		self.assertIsNone( self.Scan( source, { "HEADER": ( "(x)", "#x" ) } ) )
+
+	def testDefineInConditionallyIncludedHeader( self ):
+		self.Write( "x.h", "#define FOO\n" )
+		source = "#ifdef UNKNOWN\n#include \"x.h\"\n#endif\n#ifdef FOO\n#include \"a.h\"\n#else\n#include \"b.h\"\n#endif\n"
+		self.assertEqual( self.Scan( source, complete = False ), [ "a.h", "b.h", "x.h" ] )
+
+	def testCommentedOutInclude( self ):
+		source = "/*\n#include \"a.h\"\n*/\n// #include \"b.h\"\n#include \"c.h\"\n"
+		self.assertEqual( self.Scan( source ), [ "c.h" ] )
+
+
+if __name__ == "__main__":
+	unittest.main( argv = sys.argv[:1] )
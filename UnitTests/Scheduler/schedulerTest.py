@@ -0,0 +1,206 @@
+#!/usr/bin/python
+
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, "../../")
+
+#Importing csbuild runs a build unless it thinks it's being imported by sphinx.
+sys.runningSphinx = True
+import csbuild
+from csbuild import _scheduler
+from csbuild import _shared_globals
+from csbuild import _worker_pool
+sys.exit = csbuild.sysExit
+
+#Nodes that raise are reported to the build log, which isn't opened without a build.
+_shared_globals.logFile = open( os.devnull, "w" )
+
+NodeType = _scheduler.NodeType
+NodeState = _scheduler.NodeState
+
+
+class TestWorkerPool( unittest.TestCase ):
+	def setUp( self ):
+		self.pool = _worker_pool.WorkerPool( 1, "test" )
+		self.release = threading.Event( )
+		self.ran = [ ]
+
+	def tearDown( self ):
+		self.release.set( )
+		self.pool.Stop( )
+
+	def Block( self ):
+		"""
+		Keep the pool's only worker busy until self.release is set, so everything submitted after this queues up.
+		"""
+		started = threading.Event( )
+		def Blocker( ):
+			started.set( )
+			self.release.wait( )
+		job = self.pool.Submit( Blocker, notify = False )
+		started.wait( )
+		return job
+
+	def testPriorityOrder( self ):
+		self.Block( )
+		jobs = [ self.pool.Submit( lambda name = name: self.ran.append( name ), priority, notify = False )
+			for name, priority in ( ( "c", 3 ), ( "a1", 1 ), ( "b", 2 ), ( "a2", 1 ) ) ]
+		self.release.set( )
+		for job in jobs:
+			job.Wait( )
+		#Equal priorities run in the order they were submitted.
+		self.assertEqual( self.ran, [ "a1", "a2", "b", "c" ] )
+
+	def testCancelPending( self ):
+		blocker = self.Block( )
+		jobs = [ self.pool.Submit( lambda: self.ran.append( i ), i ) for i in range( 2 ) ]
+		self.assertEqual( self.pool.CancelPending( ), jobs )
+		self.assertTrue( all( job.cancelled and job.done for job in jobs ) )
+
+		self.release.set( )
+		blocker.Wait( )
+		self.assertFalse( blocker.cancelled )
+		self.assertEqual( self.ran, [ ] )
+		#Cancelled jobs aren't reported as finished.
+		self.assertIsNone( self.pool.GetCompleted( 0.1 ) )
+
+	def testException( self ):
+		def Raise( ):
+			raise ValueError( "expected" )
+		job = self.pool.Submit( Raise )
+		self.assertIs( self.pool.GetCompleted( ), job )
+		self.assertIsInstance( job.exception, ValueError )
+
+
+class TestScheduler( unittest.TestCase ):
+	def setUp( self ):
+		self.scheduler = _scheduler.Scheduler( )
+		self.lock = threading.Lock( )
+		self.started = [ ]
+		self.finished = [ ]
+		self.skipped = [ ]
+
+	def tearDown( self ):
+		_shared_globals.build_success = True
+		_shared_globals.stopOnError = False
+
+	def Work( self, name, result = True ):
+		def Run( ):
+			with self.lock:
+				self.started.append( name )
+			#Long enough for anything started too early to show up as running alongside it.
+			time.sleep( 0.01 )
+			with self.lock:
+				self.finished.append( name )
+			return result
+		return Run
+
+	def Add( self, name, inputs = ( ), nodeType = NodeType.COMPILE, result = True ):
+		return self.scheduler.AddNode( nodeType, name, self.Work( name, result ), inputs = inputs,
+			onSkip = lambda node: self.skipped.append( node.name ) )
+
+	def testDependencyOrder( self ):
+		self.scheduler.AddPool( ( NodeType.COMPILE, ), 4, "test-compile" )
+		a = self.Add( "a" )
+		b = self.Add( "b", [ a ] )
+		c = self.Add( "c", [ a ] )
+		link = self.Add( "link", [ b, c ], NodeType.LINK )
+		step = self.Add( "step", [ link ], NodeType.STEP )
+
+		self.assertEqual( self.scheduler.Run( ), [ ] )
+		for node in ( a, b, c, link, step ):
+			self.assertEqual( node.state, NodeState.SUCCEEDED )
+			for inputNode in node.inputs:
+				self.assertLess( self.finished.index( inputNode.name ), self.started.index( node.name ) )
+		#Independent nodes run alongside each other.
+		self.assertEqual( sorted( self.started[1:3] ), [ "b", "c" ] )
+		self.assertTrue( _shared_globals.build_success )
+
+	def testFailureSkipsDependents( self ):
+		self.scheduler.AddPool( ( NodeType.COMPILE, ), 2, "test-compile" )
+		failed = self.Add( "failed", result = False )
+		dependent = self.Add( "dependent", [ failed ] )
+		indirect = self.Add( "indirect", [ dependent ], NodeType.LINK )
+		independent = self.Add( "independent" )
+
+		self.assertEqual( self.scheduler.Run( ), [ ] )
+		self.assertEqual( failed.state, NodeState.FAILED )
+		self.assertEqual( ( dependent.state, indirect.state ), ( NodeState.SKIPPED, NodeState.SKIPPED ) )
+		self.assertEqual( sorted( self.skipped ), [ "dependent", "indirect" ] )
+		self.assertEqual( independent.state, NodeState.SUCCEEDED )
+		self.assertEqual( sorted( self.started ), [ "failed", "independent" ] )
+		self.assertFalse( _shared_globals.build_success )
+
+	def testExceptionFailsNode( self ):
+		def Raise( ):
+			raise ValueError( "expected" )
+		raised = self.scheduler.AddNode( NodeType.STEP, "raised", Raise )
+		dependent = self.Add( "dependent", [ raised ], NodeType.STEP )
+
+		self.scheduler.Run( )
+		self.assertEqual( ( raised.state, dependent.state ), ( NodeState.FAILED, NodeState.SKIPPED ) )
+
+	def testStopOnError( self ):
+		_shared_globals.stopOnError = True
+		self.scheduler.AddPool( ( NodeType.COMPILE, ), 1, "test-compile" )
+		failed = self.Add( "failed", result = False )
+		others = [ self.Add( name ) for name in ( "x", "y" ) ]
+		step = self.Add( "step", nodeType = NodeType.STEP, inputs = [ failed ] )
+
+		self.scheduler.Run( )
+		self.assertEqual( self.started, [ "failed" ] )
+		for node in others + [ step ]:
+			self.assertEqual( node.state, NodeState.SKIPPED )
+		self.assertEqual( sorted( self.skipped ), [ "step", "x", "y" ] )
+
+	def testLongestChainFirst( self ):
+		self.scheduler.AddPool( ( NodeType.COMPILE, ), 1, "test-compile" )
+		short = self.Add( "short" )
+		long1 = self.Add( "long1" )
+		long2 = self.Add( "long2", [ long1 ] )
+		for node, estimate in ( ( short, 1 ), ( long1, 1 ), ( long2, 10 ) ):
+			node.estimate = estimate
+		self.scheduler.Prioritize( )
+
+		self.assertEqual( long1.criticalPath, 11 )
+		self.scheduler.Run( )
+		self.assertEqual( self.started, [ "long1", "long2", "short" ] )
+		self.assertEqual( self.scheduler.GetCriticalPath( lambda node: node.estimate ), [ long1, long2 ] )
+
+	def testAddedOrderWithoutPriorities( self ):
+		self.scheduler.AddPool( ( NodeType.COMPILE, ), 1, "test-compile" )
+		for name in ( "c", "a", "b" ):
+			self.Add( name )
+		self.scheduler.Run( )
+		self.assertEqual( self.started, [ "c", "a", "b" ] )
+
+	def testLimit( self ):
+		self.scheduler.AddPool( ( NodeType.COMPILE, ), 4, "test-compile" )
+		self.scheduler.SetLimit( NodeType.COMPILE, lambda: 1 )
+		for name in ( "a", "b", "c" ):
+			self.Add( name )
+		self.scheduler.Run( )
+		#With one at a time, each finishes before the next starts.
+		self.assertEqual( self.started, self.finished )
+
+	def testCycleReturnsStuckNodes( self ):
+		a = self.Add( "a", nodeType = NodeType.STEP )
+		b = self.Add( "b", [ a ], NodeType.STEP )
+		self.scheduler.AddInput( a, b )
+		dependent = self.Add( "dependent", [ b ], NodeType.STEP )
+		independent = self.Add( "independent", nodeType = NodeType.STEP )
+
+		stuck = self.scheduler.Run( )
+		self.assertEqual( stuck, [ a, b, dependent ] )
+		for node in stuck:
+			self.assertEqual( node.state, NodeState.SKIPPED )
+		self.assertEqual( self.started, [ "independent" ] )
+		self.assertEqual( independent.state, NodeState.SUCCEEDED )
+
+
+if __name__ == "__main__":
+	unittest.main( argv = sys.argv[:1] )
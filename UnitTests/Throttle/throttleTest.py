@@ -0,0 +1,98 @@
+#!/usr/bin/python
+
+import os
+import subprocess
+import sys
+import unittest
+
+sys.path.insert(0, "../../")
+
+#Importing csbuild runs a build unless it thinks it's being imported by sphinx.
+sys.runningSphinx = True
+import csbuild
+from csbuild import _throttle
+sys.exit = csbuild.sysExit
+
+_MB = 1024 * 1024
+
+
+class FakeNode( object ):
+	def __init__( self, memory ):
+		self.memory = memory
+
+
+class TestParseSize( unittest.TestCase ):
+	def testSizes( self ):
+		self.assertEqual( _throttle.ParseSize( "512" ), 512 * _MB )
+		self.assertEqual( _throttle.ParseSize( "512M" ), 512 * _MB )
+		self.assertEqual( _throttle.ParseSize( "64k" ), 64 * 1024 )
+		self.assertEqual( _throttle.ParseSize( "1.5G" ), 1536 * _MB )
+		self.assertEqual( _throttle.ParseSize( " 2 gb " ), 2048 * _MB )
+		self.assertEqual( _throttle.ParseSize( "1T" ), 1024 * 1024 * _MB )
+
+	def testInvalid( self ):
+		for value in ( "", "G", "-1G", "12X", "1.G", "one" ):
+			self.assertRaises( ValueError, _throttle.ParseSize, value )
+
+
+class TestThrottle( unittest.TestCase ):
+	def setUp( self ):
+		self.load = 0.0
+		self.available = 1024 * _MB
+		self.previous = ( _throttle.GetLoadAverage, _throttle.GetAvailableMemory )
+		_throttle.GetLoadAverage = lambda: self.load
+		_throttle.GetAvailableMemory = lambda: self.available
+
+	def tearDown( self ):
+		_throttle.GetLoadAverage, _throttle.GetAvailableMemory = self.previous
+
+	def testBudget( self ):
+		throttle = _throttle.Throttle( 1000 * _MB, None )
+		running = [ FakeNode( 400 * _MB ), FakeNode( 300 * _MB ) ]
+		self.assertTrue( throttle( FakeNode( 300 * _MB ), running ) )
+		self.assertFalse( throttle( FakeNode( 301 * _MB ), running ) )
+		#Nodes that have never run don't have an estimate, and aren't held back by the budget.
+		self.assertTrue( throttle( FakeNode( 0 ), running ) )
+		self.assertTrue( _throttle.Throttle( None, None )( FakeNode( 900 * _MB ), running ) )
+
+	def testAvailableMemory( self ):
+		throttle = _throttle.Throttle( None, None )
+		running = [ FakeNode( 100 * _MB ) ]
+		self.available = 200 * _MB
+		self.assertTrue( throttle( FakeNode( 200 * _MB ), running ) )
+		self.assertFalse( throttle( FakeNode( 201 * _MB ), running ) )
+		self.available = None
+		self.assertTrue( throttle( FakeNode( 201 * _MB ), running ) )
+
+	def testLoad( self ):
+		throttle = _throttle.Throttle( None, 4.0 )
+		running = [ FakeNode( 0 ) ]
+		self.load = 4.0
+		self.assertTrue( throttle( FakeNode( 0 ), running ) )
+		self.load = 4.5
+		self.assertFalse( throttle( FakeNode( 0 ), running ) )
+		self.load = None
+		self.assertTrue( throttle( FakeNode( 0 ), running ) )
+
+	def testAlwaysAdmitsWhenNothingIsRunning( self ):
+		self.load = 100.0
+		self.available = 0
+		throttle = _throttle.Throttle( 100 * _MB, 1.0 )
+		self.assertTrue( throttle( FakeNode( 200 * _MB ), [ ] ) )
+		self.assertFalse( throttle( FakeNode( 200 * _MB ), [ FakeNode( 0 ) ] ) )
+
+
+class TestPeakMemory( unittest.TestCase ):
+	def testCommunicate( self ):
+		fd = subprocess.Popen( [ sys.executable, "-c", "import sys; sys.stdout.write( 'out' ); sys.exit( 3 )" ],
+			stdout = subprocess.PIPE, stderr = subprocess.PIPE )
+		out, errors, peakMemory = _throttle.Communicate( fd )
+		self.assertEqual( ( out, errors, fd.returncode ), ( b"out", b"", 3 ) )
+		if hasattr( os, "wait4" ):
+			self.assertGreater( peakMemory, _MB )
+		else:
+			self.assertIsNone( peakMemory )
+
+
+if __name__ == "__main__":
+	unittest.main( argv = sys.argv[:1] )
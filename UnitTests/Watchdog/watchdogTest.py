@@ -0,0 +1,106 @@
+#!/usr/bin/python
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, "../../")
+
+#Importing csbuild runs a build unless it thinks it's being imported by sphinx.
+sys.runningSphinx = True
+import csbuild
+from csbuild import _hash_db
+from csbuild import _shared_globals
+from csbuild import _watchdog
+sys.exit = csbuild.sysExit
+
+#Killed processes are reported to the build log, which isn't opened without a build.
+_shared_globals.logFile = open( os.devnull, "w" )
+
+
+class TestWatchdog( unittest.TestCase ):
+	def setUp( self ):
+		self.directory = tempfile.mkdtemp( )
+		self.previousCacheDirectory = _shared_globals.cacheDirectory
+		self.previousInterval = _watchdog._CHECK_INTERVAL_SECONDS
+		_shared_globals.cacheDirectory = self.directory
+		_hash_db.Load( )
+		#Checked more often than in a build, so the test doesn't have to wait as long.
+		_watchdog._CHECK_INTERVAL_SECONDS = 0.05
+
+	def tearDown( self ):
+		_watchdog.Stop( )
+		_watchdog._CHECK_INTERVAL_SECONDS = self.previousInterval
+		_shared_globals.cacheDirectory = self.previousCacheDirectory
+		shutil.rmtree( self.directory )
+
+	def Restart( self, timeout, retries ):
+		_watchdog.Stop( )
+		_watchdog.Start( timeout, retries )
+
+	def testAdaptiveTimeout( self ):
+		_hash_db.Set( ( "duration", "quick.o" ), 2.0 )
+		_hash_db.Set( ( "duration", "slow.o" ), 60.0 )
+		self.Restart( None, 0 )
+		self.assertEqual( _watchdog.GetTimeout( "quick.o" ), _watchdog._MIN_ADAPTIVE_TIMEOUT )
+		self.assertEqual( _watchdog.GetTimeout( "slow.o" ), 60.0 * _watchdog._ADAPTIVE_TIMEOUT_FACTOR )
+		self.assertIsNone( _watchdog.GetTimeout( "new.o" ) )
+
+	def testExplicitTimeout( self ):
+		_hash_db.Set( ( "duration", "slow.o" ), 60.0 )
+		self.Restart( 5, 0 )
+		self.assertEqual( _watchdog.GetTimeout( "slow.o" ), 5 )
+		self.assertEqual( _watchdog.GetTimeout( "new.o" ), 5 )
+		self.Restart( 0, 0 )
+		self.assertIsNone( _watchdog.GetTimeout( "slow.o" ) )
+
+	def Run( self, key ):
+		"""
+		Run a process that hangs, retrying it the way compiles and links are.
+
+		:return: How many times it was run, and the return code of each run
+		:rtype: list[int]
+		"""
+		returncodes = [ ]
+		attempt = 0
+		while True:
+			#The shell's sleep holds stdout open too, so communicate() only returns once both have been killed.
+			fd = subprocess.Popen( [ "sh", "-c", "sleep 30; :" ], stdout = subprocess.PIPE )
+			with _shared_globals.spmutex:
+				_shared_globals.subprocesses[key] = fd
+			fd.communicate( )
+			with _shared_globals.spmutex:
+				del _shared_globals.subprocesses[key]
+			returncodes.append( fd.returncode )
+
+			if not _watchdog.ShouldRetry( key, attempt ):
+				break
+			attempt += 1
+		return returncodes
+
+	@unittest.skipIf( not os.path.isdir( "/proc" ), "Processes started by a hung one can only be found through /proc" )
+	def testKillAndRetry( self ):
+		self.Restart( 0.2, 2 )
+		start = time.time( )
+		returncodes = self.Run( "hung.o" )
+		self.assertEqual( len( returncodes ), 3 )
+		self.assertTrue( all( returncode < 0 for returncode in returncodes ) )
+		self.assertLess( time.time( ) - start, 15 )
+
+	def testNoRetryWhenNotKilled( self ):
+		self.Restart( 5, 2 )
+		fd = subprocess.Popen( [ "sh", "-c", "exit 1" ] )
+		with _shared_globals.spmutex:
+			_shared_globals.subprocesses["failed.o"] = fd
+		fd.wait( )
+		with _shared_globals.spmutex:
+			del _shared_globals.subprocesses["failed.o"]
+		self.assertFalse( _watchdog.ShouldRetry( "failed.o", 0 ) )
+
+
+if __name__ == "__main__":
+	unittest.main( argv = sys.argv[:1] )
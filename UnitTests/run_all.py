@@ -11,7 +11,17 @@ exitCode = 0
 tests = [
 	"Android/unit_test_android.py",
 	"DependencyOrder/dependencyOrderTest.py",
+	"DistributedWorker/distributedWorkerTest.py",
+	"Fingerprint/fingerprintTest.py",
+	"HashDb/hashDbTest.py",
+	"HeaderCache/headerCacheTest.py",
+	"IncrementalBuild/incrementalBuildTest.py",
+	"ObjectCache/objectCacheTest.py",
+	"Preprocessor/preprocessorTest.py",
+	"Scheduler/schedulerTest.py",
 	"Scope/scopeTest.py",
+	"Throttle/throttleTest.py",
+	"Watchdog/watchdogTest.py",
 ]
 
 if platform.system() == "Darwin":
@@ -95,6 +95,25 @@ class StaticLinkMode( object ):
 	LinkIntermediateObjects = 1
 
 from . import _utils
+from . import _header_cache
+from . import _hash_db
+from . import _stat_cache
+from . import _server
+from . import _watcher
+from . import _manifest
+from . import _include_resolver
+from . import _scheduler
+from . import _jobserver
+from . import _throttle
+from . import _watchdog
+from . import _distributed
+from . import _distributed_worker
+from . import _object_cache
+
+try:
+	from . import _process_loop
+except ImportError:
+	_process_loop = None
 from . import toolchain
 from . import toolchain_msvc
 from . import toolchain_gcc
@@ -762,6 +781,20 @@ def IgnoreExternalHeaders( ):
 	projectSettings.currentProject.SetValue("ignoreExternalHeaders", True)
 
 
+def EnablePreprocessorHeaderScanning( ):
+	"""
+	If this option is set, #if, #ifdef, #ifndef, #elif and #else blocks are evaluated when working out which headers a
+	file includes, using the project's defines and undefines and (with toolchains that can report them) the macros
+	the compiler predefines for the target and architecture. Headers that are only included in inactive blocks, such as
+	the ones for other platforms, are then no longer treated as dependencies. #pragma once, include guards and computed
+	includes (#include MACRO) are honored as well.
+
+	This is only used for files that haven't been built yet, or when the dependencies reported by the compiler for the
+	last build of a file can't be used.
+	"""
+	projectSettings.currentProject.SetValue("preprocessorHeaderScanning", True)
+
+
 def DisableWarnings( ):
 	"""
 	Disables all warnings.
@@ -1562,321 +1595,585 @@ class _LinkStatus(object):
 	Success = 1
 	UpToDate = 2
 
-def _build( ):
+#Seconds a compile or link is assumed to take when nothing like it has been built before.
+_DEFAULT_DURATION_ESTIMATE = 1.0
+
+def _logCompileProgress( obj, chunkFileStr ):
+	totaltime = (time.time( ) - _shared_globals.starttime)
+	minutes = math.floor( totaltime / 60 )
+	seconds = math.floor( totaltime % 60 )
+	if _shared_globals.times:
+		_shared_globals.lastupdate = totaltime
+		avgtime = sum( _shared_globals.times ) / (len( _shared_globals.times ))
+		esttime = totaltime + ((avgtime * (
+			_shared_globals.total_compiles - len(
+				_shared_globals.times ))) / _shared_globals.max_threads)
+		if esttime < totaltime:
+			esttime = totaltime
+			_shared_globals.esttime = esttime
+		estmin = math.floor( esttime / 60 )
+		estsec = math.floor( esttime % 60 )
+		log.LOG_BUILD(
+			"Compiling {0}{7}... ({1}/{2}) - {3}:{4:02}/{5}:{6:02}".format( os.path.basename( obj ),
+				_shared_globals.current_compile, _shared_globals.total_compiles, int( minutes ),
+				int( seconds ), int( estmin ),
+				int( estsec ), chunkFileStr ) )
+	else:
+		log.LOG_BUILD(
+			"Compiling {0}{5}... ({1}/{2}) - {3}:{4:02}".format( os.path.basename( obj ),
+				_shared_globals.current_compile,
+				_shared_globals.total_compiles, int( minutes ), int( seconds ), chunkFileStr ) )
+
+
+def _canCompileRemotely( node ):
 	"""
-	Build the project.
-	This step handles:
-	Checking library dependencies.
-	Checking which files need to be built.
-	And spawning a build thread for each one that does.
+	:param node: Node that's about to be started on the compile pool
+	:type node: csbuild._scheduler.Node
+
+	:return: Whether it can be sent to a compile worker: only compiles, and not those that use a precompiled header,
+		which only exists on this machine, or flags workers refuse to run
+	:rtype: bool
 	"""
+	if node.nodeType != _scheduler.NodeType.COMPILE or _shared_globals.profile:
+		return False
+	if not node.project.activeToolchain.Compiler().SupportsDistributedCompile():
+		return False
+	if _utils.GetCompileSettings( node.project, node.name, False )[3]:
+		return False
+	return _utils.GetRemoteCompileJob( node.project, node.name, node.key ) is not None
 
-	if _guiModule:
-		_guiModule.run()
 
-	built = False
-	global _building
-	_building = True
+def _compileJob( chunk, obj, project, chunkFileStr ):
+	"""
+	Make the function run by the compile worker pool to build a single chunk or source file.
 
-	for project in _shared_globals.sortedProjects:
-		for chunk in project.chunks:
-			if project.activeToolchain.Compiler().SupportsDummyObjects():
-				objs = []
-				for source in chunk:
-					obj = _utils.GetSourceObjPath(project, source)
-					if not os.access(obj, os.F_OK):
-						objs.append(obj)
-				project.activeToolchain.Compiler().MakeDummyObjects(objs)
+	:param chunk: Chunk or source file to compile
+	:type chunk: str
 
-	linker_threads_blocked = _shared_globals.max_linker_threads - 1
-	for i in range( linker_threads_blocked ):
-		_shared_globals.link_semaphore.acquire(True)
+	:param obj: Object file to compile it to
+	:type obj: str
 
-	for project in _shared_globals.sortedProjects:
-		_shared_globals.total_compiles += len( project._finalChunkSet )
+	:param project: Project it belongs to
+	:type project: csbuild.projectSettings.projectSettings
+
+	:param chunkFileStr: Description of the files in the chunk, for the progress message
+	:type chunkFileStr: str
+
+	:rtype: callable
+	"""
+	def Run( ):
+		#A worker may have picked this up in the time it took the scheduler to hear about an earlier failure.
+		if not _shared_globals.build_success and _shared_globals.stopOnError:
+			with project.mutex:
+				project.fileStatus[os.path.normcase(chunk)] = _shared_globals.ProjectState.ABORTED
+				project.updated = True
+			return False
+
+		with _shared_globals.sgmutex:
+			_logCompileProgress( obj, chunkFileStr )
+			_shared_globals.current_compile += 1
 
-	_shared_globals.total_compiles += _shared_globals.total_precompiles
-	_shared_globals.current_compile = 1
+		_utils.ThreadedBuild( chunk, obj, project ).run( )
+		return project.fileStatus.get( os.path.normcase( chunk ) ) != _shared_globals.ProjectState.FAILED
+	return Run
 
-	projects_in_flight = set()
-	projects_done = set()
-	pending_links = set()
-	pending_builds = _shared_globals.sortedProjects
-	#projects_needing_links = set()
 
-	for project in pending_builds:
+def _preBuildJob( project ):
+	def Run( ):
+		projectSettings.currentProject = project
+
+		project.starttime = time.time( )
+
 		for plugin in project.plugins:
-			_utils.CheckRunBuildStep(project, plugin.preMakeStep, "plugin pre-make")
-			_shared_globals.globalPreMakeSteps.add(plugin.globalPreMakeStep)
+			_utils.CheckRunBuildStep(project, plugin.preBuildStep, "plugin pre-build")
+			plugin.preBuildStep(project)
+		_utils.CheckRunBuildStep(project, project.activeToolchain.preBuildStep, "toolchain pre-build")
+		for buildStep in project.preBuildSteps:
+			_utils.CheckRunBuildStep(project, buildStep, "project pre-build")
 
-		_utils.CheckRunBuildStep(project, project.activeToolchain.preMakeStep, "toolchain pre-make")
-		_shared_globals.globalPreMakeSteps |= project.activeToolchain.GetGlobalPreMakeSteps()
-		for buildStep in project.preMakeSteps:
-			_utils.CheckRunBuildStep(project, buildStep, "project pre-make")
+		log.LOG_BUILD( "Building {} ({} {}/{})".format( project.outputName, project.targetName, project.outputArchitecture, project.activeToolchainName ) )
+		project.state = _shared_globals.ProjectState.BUILDING
+		project.startTime = time.time()
+	return Run
 
-	for buildStep in _shared_globals.globalPreMakeSteps:
-		if _utils.FuncIsEmpty(buildStep):
-			continue
 
-		log.LOG_BUILD( "Running global pre-make step {}".format(_utils.GetFuncName(buildStep)))
-		buildStep()
-
-	_shared_globals.starttime = time.time( )
-
-	_linkThread.start()
-
-	def ReconcilePostBuild():
-		LinkedSomething = True
-		while LinkedSomething:
-			LinkedSomething = False
-			for otherProj in list( projects_in_flight ):
-				with otherProj.mutex:
-					complete = otherProj.compilationCompleted
-
-				if complete >= len( otherProj._finalChunkSet ) + int(
-						otherProj.needsPrecompileC ) + int(
-						otherProj.needsPrecompileCpp ):
-					totaltime = (time.time( ) - otherProj.starttime)
-					minutes = math.floor( totaltime / 60 )
-					seconds = math.floor( totaltime % 60 )
-
-					log.LOG_BUILD(
-						"Compile of {0} ({3} {4}) took {1}:{2:02}".format( otherProj.outputName, int( minutes ),
-							int( seconds ), otherProj.targetName, otherProj.outputArchitecture ) )
-					otherProj.buildEnd = time.time()
-					projects_in_flight.remove( otherProj )
-					if otherProj.compilationFailed:
-						log.LOG_ERROR( "Build of {} ({} {}/{}) failed! Finishing up non-dependent build tasks...".format(
-							otherProj.outputName, otherProj.targetName, otherProj.outputArchitecture, otherProj.activeToolchainName ) )
-						otherProj.state = _shared_globals.ProjectState.FAILED
-						otherProj.linkQueueStart = time.time()
-						otherProj.linkStart = otherProj.linkQueueStart
-						otherProj.endTime = otherProj.linkQueueStart
-						continue
+def _precompileJob( project, isPlainC ):
+	def Run( ):
+		return project.precompile_header( isPlainC )
+	return Run
 
-					okToLink = True
-					if otherProj.reconciledLinkDepends:
-						for depend in otherProj.reconciledLinkDepends:
-							if depend not in projects_done:
-								dependProj = _shared_globals.projects[depend]
-								if not dependProj.shell and not dependProj.prebuilt:
-									okToLink = False
-									break
-					if okToLink:
-						_link( otherProj )
-						LinkedSomething = True
-						projects_done.add( otherProj.key )
-					else:
-						log.LOG_LINKER(
-							"Linking for {} ({} {}/{}) deferred until all dependencies have finished building...".format(
-								otherProj.outputName, otherProj.targetName, otherProj.outputArchitecture, otherProj.activeToolchainName ) )
-						otherProj.state = _shared_globals.ProjectState.WAITING_FOR_LINK
-						pending_links.add( otherProj )
-
-			for otherProj in list( pending_links ):
-				okToLink = True
-				for depend in otherProj.reconciledLinkDepends:
-					if depend not in projects_done:
-						dependProj = _shared_globals.projects[depend]
-						if not dependProj.shell and not dependProj.prebuilt:
-							okToLink = False
-							break
-				if okToLink:
-					_link( otherProj )
-					LinkedSomething = True
-					projects_done.add( otherProj.key )
-					pending_links.remove( otherProj )
-
-	while pending_builds:
-		theseBuilds = pending_builds
-		pending_builds = []
-		for project in theseBuilds:
-			for depend in project.srcDepends:
-				if depend not in projects_done:
-					pending_builds.append( project )
-					continue
-			projects_in_flight.add( project )
 
-			projectSettings.currentProject = project
+def _compiledJob( project, linkDepends ):
+	def Run( ):
+		totaltime = (time.time( ) - project.starttime)
+		minutes = math.floor( totaltime / 60 )
+		seconds = math.floor( totaltime % 60 )
+
+		log.LOG_BUILD(
+			"Compile of {0} ({3} {4}) took {1}:{2:02}".format( project.outputName, int( minutes ),
+				int( seconds ), project.targetName, project.outputArchitecture ) )
+		project.buildEnd = time.time()
+
+		if [ node for node in linkDepends if node.state != _scheduler.NodeState.SUCCEEDED ]:
+			log.LOG_LINKER(
+				"Linking for {} ({} {}/{}) deferred until all dependencies have finished building...".format(
+					project.outputName, project.targetName, project.outputArchitecture, project.activeToolchainName ) )
+			project.state = _shared_globals.ProjectState.WAITING_FOR_LINK
+	return Run
+
+
+def _scrapeJob( project, chunks, chunkObj ):
+	"""
+	Make the function run by the compile worker pool to remove the symbols from a chunk's object file that are also
+	defined by the objects of sources that were split out of the chunk and compiled on their own.
+
+	:param project: Project the chunks belong to
+	:type project: csbuild.projectSettings.projectSettings
+
+	:param chunks: Chunks compiled into the object file
+	:type chunks: list[list[str]]
+
+	:param chunkObj: The chunk's object file
+	:type chunkObj: str
+
+	:rtype: callable
+	"""
+	def Run( ):
+		if not _stat_cache.Exists( chunkObj ):
+			return
+
+		objsToScrape = []
+		for chunk in chunks:
+			for source in chunk:
+				if source in project._finalChunkSet:
+					obj = _utils.GetSourceObjPath(project, source)
+					if _stat_cache.Exists( obj ):
+						objsToScrape.append( obj )
 
-			project.starttime = time.time( )
+		if objsToScrape:
+			project.activeToolchain.Compiler().GetObjectScraper().RemoveSharedSymbols(objsToScrape, chunkObj)
+			for obj in objsToScrape + [chunkObj]:
+				_stat_cache.Invalidate( obj )
+	return Run
 
+
+def _linkJob( project ):
+	def Run( ):
+		project.state = _shared_globals.ProjectState.LINKING
+		ret = _performLink(project, [])
+
+		if ret == _LinkStatus.Fail:
+			_shared_globals.build_success = False
+			project.state = _shared_globals.ProjectState.LINK_FAILED
+		elif ret == _LinkStatus.Success:
 			for plugin in project.plugins:
-				_utils.CheckRunBuildStep(project, plugin.preBuildStep, "plugin pre-build")
-				plugin.preBuildStep(project)
-			_utils.CheckRunBuildStep(project, project.activeToolchain.preBuildStep, "toolchain pre-build")
-			for buildStep in project.preBuildSteps:
-				_utils.CheckRunBuildStep(project, buildStep, "project pre-build")
-
-			log.LOG_BUILD( "Building {} ({} {}/{})".format( project.outputName, project.targetName, project.outputArchitecture, project.activeToolchainName ) )
-			project.state = _shared_globals.ProjectState.BUILDING
-			project.startTime = time.time()
-
-			if project.precompile_headers( ):
-				for chunk in projectSettings.currentProject._finalChunkSet:
-					#not set until here because _finalChunkSet may be empty.
-					project._builtSomething = True
+				_utils.CheckRunBuildStep(project, plugin.postBuildStep, "plugin post-build")
+			_utils.CheckRunBuildStep(project, project.activeToolchain.postBuildStep, "toolchain post-build")
 
-					chunkFileStr = ""
-					if chunk in project.chunksByFile:
-						chunkFileStr = " {}".format( [ os.path.basename(piece) for piece in project.chunksByFile[chunk] ] )
-					elif chunk in project.splitChunks:
-						chunkFileStr = " [Split from {}_{}{}]".format(
-							project.splitChunks[chunk],
-							project.targetName,
-							project.activeToolchain.Compiler().GetObjExt()
-						)
-
-					built = True
-					obj = _utils.GetSourceObjPath(projectSettings.currentProject, chunk, sourceIsChunkPath=projectSettings.currentProject.ContainsChunk(chunk))
-					if not _shared_globals.semaphore.acquire( False ):
-						if _shared_globals.max_threads != 1:
-							log.LOG_INFO( "Waiting for a build thread to become available..." )
-						_shared_globals.semaphore.acquire( True )
-
-					ReconcilePostBuild()
-
-					if _shared_globals.interrupted:
-						Exit( 2 )
-					if not _shared_globals.build_success and _shared_globals.stopOnError:
-						log.LOG_ERROR("Errors encountered during build, finishing current tasks and exiting...")
-						_shared_globals.semaphore.release()
-						break
-					if _shared_globals.times:
-						totaltime = (time.time( ) - _shared_globals.starttime)
-						_shared_globals.lastupdate = totaltime
-						minutes = math.floor( totaltime / 60 )
-						seconds = math.floor( totaltime % 60 )
-						avgtime = sum( _shared_globals.times ) / (len( _shared_globals.times ))
-						esttime = totaltime + ((avgtime * (
-							_shared_globals.total_compiles - len(
-								_shared_globals.times ))) / _shared_globals.max_threads)
-						if esttime < totaltime:
-							esttime = totaltime
-							_shared_globals.esttime = esttime
-						estmin = math.floor( esttime / 60 )
-						estsec = math.floor( esttime % 60 )
-						log.LOG_BUILD(
-							"Compiling {0}{7}... ({1}/{2}) - {3}:{4:02}/{5}:{6:02}".format( os.path.basename( obj ),
-								_shared_globals.current_compile, _shared_globals.total_compiles, int( minutes ),
-								int( seconds ), int( estmin ),
-								int( estsec ), chunkFileStr ) )
-					else:
-						totaltime = (time.time( ) - _shared_globals.starttime)
-						minutes = math.floor( totaltime / 60 )
-						seconds = math.floor( totaltime % 60 )
-						log.LOG_BUILD(
-							"Compiling {0}{5}... ({1}/{2}) - {3}:{4:02}".format( os.path.basename( obj ),
-								_shared_globals.current_compile,
-								_shared_globals.total_compiles, int( minutes ), int( seconds ), chunkFileStr ) )
-					_utils.ThreadedBuild( chunk, obj, project ).start( )
-					_shared_globals.current_compile += 1
+			for buildStep in project.postBuildSteps:
+				_utils.CheckRunBuildStep(project, buildStep, "project post-build")
+			project.state = _shared_globals.ProjectState.FINISHED
+		elif ret == _LinkStatus.UpToDate:
+			project.state = _shared_globals.ProjectState.UP_TO_DATE
+		project.endTime = time.time()
+		log.LOG_BUILD( "Finished {} ({} {}/{})".format( project.outputName, project.targetName, project.outputArchitecture, project.activeToolchainName ) )
+
+		return ret != _LinkStatus.Fail
+	return Run
+
+
+def _linkQueued( node ):
+	node.project.state = _shared_globals.ProjectState.LINK_QUEUED
+	node.project.linkQueueStart = time.time()
+
+
+def _fileSkipped( node ):
+	project = node.project
+	with project.mutex:
+		project.fileStatus[os.path.normcase( node.name )] = _shared_globals.ProjectState.ABORTED
+		project.updated = True
+	with _shared_globals.sgmutex:
+		_shared_globals.total_compiles -= 1
+
+
+def _projectSkipped( node ):
+	project = node.project
+	if project.state in ( _shared_globals.ProjectState.FAILED, _shared_globals.ProjectState.ABORTED ):
+		return
+
+	if project.compilationFailed:
+		log.LOG_ERROR( "Build of {} ({} {}/{}) failed! Finishing up non-dependent build tasks...".format(
+			project.outputName, project.targetName, project.outputArchitecture, project.activeToolchainName ) )
+		project.state = _shared_globals.ProjectState.FAILED
+	else:
+		if not _shared_globals.stopOnError:
+			log.LOG_ERROR( "Build of {} ({} {}/{}) aborted because a project it depends on failed.".format(
+				project.outputName, project.targetName, project.outputArchitecture, project.activeToolchainName ) )
+		project.state = _shared_globals.ProjectState.ABORTED
+
+	project.linkQueueStart = time.time()
+	project.linkStart = project.linkQueueStart
+	project.endTime = project.linkQueueStart
+
+
+def _addProjectNodes( scheduler, project, linkNodes ):
+	"""
+	Add everything it takes to build a project to the build graph: its pre-build steps, then its precompiled headers,
+	then every file it needs to compile, then the scraping of its chunks' objects, then its link. Files that don't use
+	a precompiled header start as soon as the pre-build steps are done, and the others as soon as the header for their
+	language is, so a failed C header doesn't hold up the C++ files, or the other way round.
+
+	:param scheduler: Scheduler running the build graph
+	:type scheduler: csbuild._scheduler.Scheduler
+
+	:param project: Project to add
+	:type project: csbuild.projectSettings.projectSettings
+
+	:param linkNodes: Project key -> link node for every project that's already been added. The new project's link node
+		is added to it.
+	:type linkNodes: dict
+
+	:return: Whether the project has anything to compile
+	:rtype: bool
+	"""
+	NodeType = _scheduler.NodeType
+
+	preBuild = scheduler.AddNode(
+		NodeType.STEP,
+		"pre-build {}".format( project.key ),
+		_preBuildJob( project ),
+		project,
+		[ linkNodes[depend] for depend in project.srcDepends if depend in linkNodes ],
+		onSkip = _projectSkipped
+	)
+
+	precompiles = { }
+	for isPlainC, needsPrecompile, headerFile in (
+		( False, project.needsPrecompileCpp, project.cppHeaderFile ),
+		( True, project.needsPrecompileC, project.cHeaderFile ),
+	):
+		if needsPrecompile:
+			precompiles[isPlainC] = scheduler.AddNode(
+				NodeType.PCH, headerFile, _precompileJob( project, isPlainC ), project, [ preBuild ], onSkip = _fileSkipped,
+				key = project.activeToolchain.Compiler().GetPchFile( headerFile )
+			)
+
+	compiles = [ ]
+	for chunk in project._finalChunkSet:
+		chunkFileStr = ""
+		if chunk in project.chunksByFile:
+			chunkFileStr = " {}".format( [ os.path.basename(piece) for piece in project.chunksByFile[chunk] ] )
+		elif chunk in project.splitChunks:
+			chunkFileStr = " [Split from {}_{}{}]".format(
+				project.splitChunks[chunk],
+				project.targetName,
+				project.activeToolchain.Compiler().GetObjExt()
+			)
+
+		#Each file only waits for the precompiled header it actually uses, if that's being built.
+		_, _, isPlainC, usesPrecompiledHeader = _utils.GetCompileSettings( project, chunk, False )
+		inputs = [ preBuild ]
+		if usesPrecompiledHeader and isPlainC in precompiles:
+			inputs.append( precompiles[isPlainC] )
+
+		obj = _utils.GetSourceObjPath(project, chunk, sourceIsChunkPath=project.ContainsChunk(chunk))
+		compiles.append(
+			scheduler.AddNode(
+				NodeType.COMPILE, chunk, _compileJob( chunk, obj, project, chunkFileStr ), project, inputs,
+				onSkip = _fileSkipped, key = obj
+			)
+		)
+
+	linkDepends = [ linkNodes[depend] for depend in project.reconciledLinkDepends if depend in linkNodes ]
+
+	compiled = scheduler.AddNode(
+		NodeType.STEP,
+		"compiled {}".format( project.key ),
+		_compiledJob( project, linkDepends ),
+		project,
+		[ preBuild ] + list( precompiles.values( ) ) + compiles,
+		onSkip = _projectSkipped
+	)
+
+	#Chunks that share an object file, as every chunk in a unity build does, are scraped together.
+	scrapes = [ ]
+	if project.useChunks and not _shared_globals.disable_chunks and \
+			project.activeToolchain.Compiler().SupportsObjectScraping():
+		chunksByObj = { }
+		for chunk in project.chunks:
+			if type( chunk ) != list:
+				continue
+			if not project.unity:
+				chunkObj = _utils.GetChunkedObjPath(project, chunk)
 			else:
-				projects_in_flight.remove( project )
-				log.LOG_ERROR( "Build of {} ({} {}/{}) failed! Finishing up non-dependent build tasks...".format(
-					project.outputName, project.targetName, project.outputArchitecture, project.activeToolchainName  ) )
-
-				with project.mutex:
-					for chunk in project._finalChunkSet:
-						project.fileStatus[os.path.normcase(chunk)] = _shared_globals.ProjectState.ABORTED
-
-				_shared_globals.total_compiles -= len(project._finalChunkSet)
-
-				project.linkQueueStart = time.time()
-				project.linkStart = project.linkQueueStart
-				project.endTime = project.linkQueueStart
-				project.state = _shared_globals.ProjectState.FAILED
-
-			if not _shared_globals.build_success and _shared_globals.stopOnError:
-				break
-
-		#Wait until all threads are finished. Simple way to do this is acquire the semaphore until it's out of
-		# resources.
-		for j in range( _shared_globals.max_threads ):
-			if not _shared_globals.semaphore.acquire( False ):
-				if _shared_globals.max_threads != 1:
-					if _shared_globals.times:
-						totaltime = (time.time( ) - _shared_globals.starttime)
-						_shared_globals.lastupdate = totaltime
-						minutes = math.floor( totaltime / 60 )
-						seconds = math.floor( totaltime % 60 )
-						avgtime = sum( _shared_globals.times ) / (len( _shared_globals.times ))
-						esttime = totaltime + ((avgtime * (_shared_globals.total_compiles - len(
-							_shared_globals.times ))) / _shared_globals.max_threads)
-						if esttime < totaltime:
-							esttime = totaltime
-						estmin = math.floor( esttime / 60 )
-						estsec = math.floor( esttime % 60 )
-						_shared_globals.esttime = esttime
-						log.LOG_THREAD(
-							"Waiting on {0} more build thread{1} to finish... ({2}:{3:02}/{4}:{5:02})".format(
-								_shared_globals.max_threads - j,
-								"s" if _shared_globals.max_threads - j != 1 else "", int( minutes ),
-								int( seconds ), int( estmin ), int( estsec ) ) )
-					else:
-						log.LOG_THREAD(
-							"Waiting on {0} more build thread{1} to finish...".format(
-								_shared_globals.max_threads - j,
-								"s" if _shared_globals.max_threads - j != 1 else "" ) )
-
-				ReconcilePostBuild()
-				_shared_globals.semaphore.acquire( True )
-
-				if linker_threads_blocked > 0:
-					_shared_globals.link_semaphore.release()
-					linker_threads_blocked -= 1
-
-				if _shared_globals.interrupted:
-					Exit( 2 )
-
-		#Then immediately release all the semaphores once we've reclaimed them.
-		#We're not using any more threads so we don't need them now.
-		for j in range( _shared_globals.max_threads ):
-			if _shared_globals.stopOnError:
-				projects_in_flight = set()
-			_shared_globals.semaphore.release( )
-
-		ReconcilePostBuild()
-
-	if projects_in_flight:
-		log.LOG_ERROR( "Could not complete all projects. This is probably very bad and should never happen."
-					   " Remaining projects: {0}".format( [p.key for p in projects_in_flight] ) )
-	if pending_links:
-		log.LOG_ERROR( "Could not link all projects. Do you have unmet dependencies in your makefile?"
-					   " Remaining projects: {0}".format( [p.key for p in pending_links] ) )
-		for p in pending_links:
-			p.state = _shared_globals.ProjectState.ABORTED
-		_shared_globals.build_success = False
-	for proj in _shared_globals.sortedProjects:
-		proj.save_md5s( proj.allsources, proj.allheaders )
+				chunkObj = _utils.GetUnityChunkObjPath(project)
+			chunksByObj.setdefault( chunkObj, [ ] ).append( chunk )
+
+		for chunkObj, chunks in sorted( chunksByObj.items( ) ):
+			scrapes.append(
+				scheduler.AddNode(
+					NodeType.SCRAPE, "scrape {}".format( chunkObj ), _scrapeJob( project, chunks, chunkObj ), project,
+					[ compiled ], key = "{}:scrape".format( chunkObj )
+				)
+			)
+
+	linkNodes[project.key] = scheduler.AddNode(
+		NodeType.LINK,
+		project.key,
+		_linkJob( project ),
+		project,
+		[ compiled ] + scrapes + linkDepends,
+		onReady = _linkQueued,
+		onSkip = _projectSkipped,
+		key = os.path.join( project.outputDir, project.outputName )
+	)
+
+	return bool( compiles )
+
+
+def _estimateNodes( scheduler ):
+	"""
+	Fill in how long each node in the build graph is expected to take, and how much memory it's expected to need, from
+	the last time it ran. Nodes that haven't run before are assumed to be the average of those of the same kind that have.
+
+	:param scheduler: Scheduler running the build graph
+	:type scheduler: csbuild._scheduler.Scheduler
+	"""
+	nodes = [ node for node in scheduler.GetNodes( ) if node.nodeType != _scheduler.NodeType.STEP ]
+
+	for recordType, attribute, default in (
+		( "duration", "estimate", _DEFAULT_DURATION_ESTIMATE ),
+		( "memory", "memory", 0 ),
+	):
+		recorded = { }
+		known = { }
+		for node in nodes:
+			if node.key is not None:
+				value = _hash_db.Get( ( recordType, node.key ) )
+				if value is not None:
+					recorded[node] = value
+					known.setdefault( node.nodeType, [ ] ).append( value )
+
+		for node in nodes:
+			if node in recorded:
+				setattr( node, attribute, recorded[node] )
+			elif node.nodeType in known:
+				setattr( node, attribute, sum( known[node.nodeType] ) / len( known[node.nodeType] ) )
+			else:
+				setattr( node, attribute, default )
+
+
+def _recordDurations( scheduler ):
+	"""
+	Remember how long each compile and link in the build graph took, for the next build's estimates.
+
+	:param scheduler: Scheduler that ran the build graph
+	:type scheduler: csbuild._scheduler.Scheduler
+	"""
+	for node in scheduler.GetNodes( ):
+		if node.key is None or node.state != _scheduler.NodeState.SUCCEEDED:
+			continue
+		#A link that was up to date says nothing about how long linking takes.
+		if node.nodeType == _scheduler.NodeType.LINK and node.project.state != _shared_globals.ProjectState.FINISHED:
+			continue
+		_hash_db.Set( ( "duration", node.key ), node.endTime - node.startTime )
+
+
+def _reportCriticalPath( scheduler ):
+	"""
+	Compare how long the build graph took to run against the longest chain of work in it, which is how long it would
+	have taken with unlimited threads. With --critical-path, also list the nodes along that chain and along the chain
+	that actually finished last, with how long each of those waited for a thread.
+
+	:param scheduler: Scheduler that ran the build graph
+	:type scheduler: csbuild._scheduler.Scheduler
+	"""
+	ran = [ node for node in scheduler.GetNodes( ) if node.endTime ]
+	if not [ node for node in ran if node.nodeType != _scheduler.NodeType.STEP ]:
+		return
+
+	def Duration( node ):
+		return node.endTime - node.startTime if node.endTime else 0
+
+	wallTime = max( node.endTime for node in ran ) - min( node.startTime for node in ran )
+	criticalPath = scheduler.GetCriticalPath( Duration )
+	criticalTime = sum( Duration( node ) for node in criticalPath )
+	compileTime = sum( Duration( node ) for node in ran if node.nodeType in ( _scheduler.NodeType.PCH, _scheduler.NodeType.COMPILE ) )
+
+	summary = "Critical path: {:.2f}s of {:.2f}s spent building ({:.0f}%). " \
+		"{:.2f}s of compiling on {} threads needs at least {:.2f}s.".format(
+		criticalTime, wallTime, 100 * criticalTime / wallTime if wallTime else 100,
+		compileTime, _shared_globals.max_threads, compileTime / _shared_globals.max_threads
+	)
+	if not _shared_globals.criticalPathReport:
+		log.LOG_INFO( summary )
+		return
+
+	log.LOG_BUILD( summary )
+
+	def Waited( node ):
+		ready = max( [ inputNode.endTime for inputNode in node.inputs if inputNode.endTime ] or [ node.startTime ] )
+		return max( 0, node.startTime - ready )
+
+	log.LOG_BUILD( "Longest chain of work:" )
+	for node in criticalPath:
+		if node.nodeType != _scheduler.NodeType.STEP:
+			log.LOG_BUILD( "  {:>8.2f}s (waited {:.2f}s, estimated {:.2f}s)  {}".format(
+				Duration( node ), Waited( node ), node.estimate, node.name ) )
+
+	log.LOG_BUILD( "Chain that finished last:" )
+	for node in scheduler.GetFinishingPath( ):
+		if node.nodeType != _scheduler.NodeType.STEP:
+			log.LOG_BUILD( "  {:>8.2f}s (waited {:.2f}s, estimated {:.2f}s)  {}".format(
+				Duration( node ), Waited( node ), node.estimate, node.name ) )
+
+
+def _stopBuildServices( ):
+	"""
+	Stop everything _build() starts for the duration of a build. Does nothing for whatever isn't running.
+	"""
+	_watchdog.Stop( )
+	_distributed.Stop( )
+	_object_cache.Stop( )
+	_jobserver.Stop( )
+	if _process_loop is not None:
+		_process_loop.Stop( )
+
+
+def _build( ):
+	"""
+	Build the project.
+	This step handles:
+	Checking library dependencies.
+	Checking which files need to be built.
+	And building the graph of everything that has to be done to compile and link them, then running it.
+	"""
+
+	if _guiModule:
+		_guiModule.run()
+
+	built = False
+	global _building
+	_building = True
+
+	jobServer = None
+	#Whatever happens to the build, none of what's started here can be left behind, especially when the process
+	#carries on afterwards, as it does with --server and --watch.
+	try:
+		if _shared_globals.useJobServer:
+			jobServer = _jobserver.Start( _shared_globals.max_threads )
+		if _process_loop is not None and _shared_globals.processBackend == "asyncio":
+			_process_loop.Start( )
+		_watchdog.Start( _shared_globals.processTimeout, _shared_globals.timeoutRetries )
+		remoteWorkers = None
+		if _shared_globals.distributedWorkers:
+			remoteWorkers = _distributed.Start( _shared_globals.distributedWorkers, _canCompileRemotely )
+		if _shared_globals.objectCacheDir:
+			_object_cache.Start( _shared_globals.objectCacheDir, _shared_globals.objectCacheSize )
+
+		for project in _shared_globals.sortedProjects:
+			for chunk in project.chunks:
+				if project.activeToolchain.Compiler().SupportsDummyObjects():
+					objs = []
+					for source in chunk:
+						obj = _utils.GetSourceObjPath(project, source)
+						if not _stat_cache.Exists( obj ):
+							objs.append(obj)
+					project.activeToolchain.Compiler().MakeDummyObjects(objs)
+					for obj in objs:
+						_stat_cache.Invalidate( obj )
+
+		for project in _shared_globals.sortedProjects:
+			_shared_globals.total_compiles += len( project._finalChunkSet )
+
+		_shared_globals.total_compiles += _shared_globals.total_precompiles
+		_shared_globals.current_compile = 1
 
-	if not built:
-		log.LOG_BUILD( "Nothing to build." )
-	_building = False
-	global _linkCond
-	global _linkMutex
-	with _linkMutex:
-		_linkCond.notify()
-	log.LOG_THREAD("Waiting for linker tasks to finish.")
-	_linkThread.join()
-
-	if not projects_in_flight and not pending_links:
 		for project in _shared_globals.sortedProjects:
 			for plugin in project.plugins:
-				_utils.CheckRunBuildStep(project, plugin.postMakeStep, "plugin post-make")
-				_shared_globals.globalPostMakeSteps.add(plugin.globalPostMakeStep)
+				_utils.CheckRunBuildStep(project, plugin.preMakeStep, "plugin pre-make")
+				_shared_globals.globalPreMakeSteps.add(plugin.globalPreMakeStep)
 
-			_utils.CheckRunBuildStep(project, project.activeToolchain.postMakeStep, "toolchain post-make")
-			_shared_globals.globalPostMakeSteps |= project.activeToolchain.GetGlobalPostMakeSteps()
-			for buildStep in project.postMakeSteps:
-				_utils.CheckRunBuildStep(project, buildStep, "project post-make")
+			_utils.CheckRunBuildStep(project, project.activeToolchain.preMakeStep, "toolchain pre-make")
+			_shared_globals.globalPreMakeSteps |= project.activeToolchain.GetGlobalPreMakeSteps()
+			for buildStep in project.preMakeSteps:
+				_utils.CheckRunBuildStep(project, buildStep, "project pre-make")
 
-		for buildStep in _shared_globals.globalPostMakeSteps:
+		for buildStep in _shared_globals.globalPreMakeSteps:
 			if _utils.FuncIsEmpty(buildStep):
 				continue
 
-			log.LOG_BUILD( "Running global post-make step {}".format(_utils.GetFuncName(buildStep)))
+			log.LOG_BUILD( "Running global pre-make step {}".format(_utils.GetFuncName(buildStep)))
 			buildStep()
+			_stat_cache.Clear( )
+
+		_shared_globals.starttime = time.time( )
+
+		scheduler = _scheduler.Scheduler( )
+		compilePool = scheduler.AddPool(
+			( _scheduler.NodeType.PCH, _scheduler.NodeType.COMPILE, _scheduler.NodeType.SCRAPE ),
+			_shared_globals.max_threads, "csbuild-compile", jobServer, remoteWorkers
+		)
+		scheduler.AddPool( ( _scheduler.NodeType.LINK, ), _shared_globals.max_linker_threads, "csbuild-link", jobServer )
+		#Linking only gets one thread while there's compiling to be done, plus one for each compile thread with nothing to do.
+		scheduler.SetLimit(
+			_scheduler.NodeType.LINK,
+			lambda: max( 1, _shared_globals.max_linker_threads - compilePool.pending - compilePool.running )
+		)
+		memoryBudget = _shared_globals.memoryBudget
+		if memoryBudget is None:
+			memoryBudget = _throttle.GetAvailableMemory( )
+		scheduler.SetAdmission( _throttle.Throttle( memoryBudget, _shared_globals.maxLoad ) )
+		_shared_globals.compilePool = compilePool
+
+		linkNodes = { }
+		for project in _shared_globals.sortedProjects:
+			if _addProjectNodes( scheduler, project, linkNodes ):
+				built = True
+
+		_estimateNodes( scheduler )
+		scheduler.Prioritize( )
+
+		stuck = scheduler.Run( )
+		_shared_globals.compilePool = None
+
+		_recordDurations( scheduler )
+		_reportCriticalPath( scheduler )
+
+		if stuck:
+			log.LOG_ERROR( "Could not build all projects. Do you have unmet dependencies in your makefile?"
+						   " Remaining projects: {0}".format( sorted( set( node.project.key for node in stuck ) ) ) )
+			_shared_globals.build_success = False
+		for proj in _shared_globals.sortedProjects:
+			proj.save_md5s( proj.allsources, proj.allheaders )
+		_header_cache.Save( )
+		_hash_db.Save( )
+		_include_resolver.Save( )
+
+		if not built:
+			log.LOG_BUILD( "Nothing to build." )
+		_building = False
+
+		if not [ proj for proj in _shared_globals.sortedProjects if proj.state == _shared_globals.ProjectState.ABORTED ]:
+			for project in _shared_globals.sortedProjects:
+				for plugin in project.plugins:
+					_utils.CheckRunBuildStep(project, plugin.postMakeStep, "plugin post-make")
+					_shared_globals.globalPostMakeSteps.add(plugin.globalPostMakeStep)
+
+				_utils.CheckRunBuildStep(project, project.activeToolchain.postMakeStep, "toolchain post-make")
+				_shared_globals.globalPostMakeSteps |= project.activeToolchain.GetGlobalPostMakeSteps()
+				for buildStep in project.postMakeSteps:
+					_utils.CheckRunBuildStep(project, buildStep, "project post-make")
+
+			for buildStep in _shared_globals.globalPostMakeSteps:
+				if _utils.FuncIsEmpty(buildStep):
+					continue
+
+				log.LOG_BUILD( "Running global post-make step {}".format(_utils.GetFuncName(buildStep)))
+				buildStep()
+				_stat_cache.Clear( )
+	finally:
+		_stopBuildServices( )
 
 	compiletime = time.time( ) - _shared_globals.starttime
 	totalmin = math.floor( compiletime / 60 )
@@ -1887,33 +2184,6 @@ def _build( ):
 
 	return _shared_globals.build_success
 
-_linkMutex = threading.Lock()
-_linkCond = threading.Condition(_linkMutex)
-_linkQueue = []
-_currentLinkThreads = set()
-_linkThreadMutex = threading.Lock()
-_recheckDeferredLinkTasks = False
-
-def _link( project, *objs ):
-	"""
-	Linker:
-	Links all the built files.
-	Accepts an optional list of object files to link; if this list is not provided it will use the auto-generated
-	list created by build()
-	This function also checks (if nothing was built) the modified times of all the required libraries, to see if we need
-	to relink anyway, even though nothing was compiled.
-	"""
-	global _linkQueue
-	global _linkMutex
-	global _linkCond
-
-	project.state = _shared_globals.ProjectState.LINK_QUEUED
-	project.linkQueueStart = time.time()
-	with _linkMutex:
-		_linkQueue.append( (project, list(objs)) )
-		_linkCond.notify()
-
-
 def _performLink(project, objs):
 	project.linkStart = time.time()
 
@@ -1940,50 +2210,43 @@ def _performLink(project, objs):
 				chunkObj = _utils.GetChunkedObjPath(project, chunk)
 			else:
 				chunkObj = _utils.GetUnityChunkObjPath(project)
-			if project.useChunks and not _shared_globals.disable_chunks and os.access(chunkObj , os.F_OK):
+			if project.useChunks and not _shared_globals.disable_chunks and _stat_cache.Exists( chunkObj ):
 				objs.append( chunkObj )
 				hasChunk = True
 
+			#Objects for sources split out of a chunk have already had their symbols scraped out of the chunk's object.
 			if not hasChunk or project.activeToolchain.Compiler().SupportsObjectScraping():
-				objsToScrape = []
 				if type( chunk ) == list:
 					for source in chunk:
 						obj = _utils.GetSourceObjPath(project, source)
-						if os.access(obj , os.F_OK):
+						if _stat_cache.Exists( obj ):
 							objs.append( obj )
-							if source in project._finalChunkSet:
-								objsToScrape.append( obj )
 						elif not hasChunk or project.activeToolchain.Compiler().SupportsDummyObjects():
 							log.LOG_ERROR( "Could not find {} for linking. Something went wrong here.".format(obj) )
 							return _LinkStatus.Fail
 				else:
 					obj = _utils.GetSourceObjPath(project, chunk)
-					if os.access(obj , os.F_OK):
+					if _stat_cache.Exists( obj ):
 						objs.append( obj )
-						if source in project._finalChunkSet:
-							objsToScrape.append( obj )
 					elif not hasChunk or project.activeToolchain.Compiler().SupportsDummyObjects():
 						log.LOG_ERROR( "Could not find {} for linking. Something went wrong here.".format(obj) )
 						return _LinkStatus.Fail
 
-				if hasChunk and objsToScrape:
-					project.activeToolchain.Compiler().GetObjectScraper().RemoveSharedSymbols(objsToScrape, chunkObj)
-
 	if not objs:
 		return _LinkStatus.UpToDate
 
 	for obj in project.extraObjs:
 		log.LOG_INFO("Adding extra link object {} to link queue".format(obj))
-		if not os.access(obj, os.F_OK):
+		if not _stat_cache.Exists( obj ):
 			log.LOG_ERROR("Could not find extra object {}".format(obj))
 
 	objs += project.extraObjs
 
 	if not project._builtSomething:
-		if os.access(output , os.F_OK):
-			mtime = os.path.getmtime( output )
+		if _stat_cache.Exists( output ):
+			mtime = _stat_cache.GetModificationTime( output )
 			for obj in objs:
-				if os.path.getmtime( obj ) > mtime:
+				if _stat_cache.GetModificationTime( obj ) > mtime:
 					#If the obj time is later, something got built in another run but never got linked...
 					#Maybe the linker failed last time.
 					#We should count that as having built something, because we do need to link.
@@ -1995,7 +2258,7 @@ def _performLink(project, objs):
 			#Even though we didn't build anything, we should verify all our libraries are up to date too.
 			#If they're not, we need to relink.
 			for i in range( len( project.libraryLocations ) ):
-				if os.path.getmtime(project.libraryLocations[i]) > mtime:
+				if _stat_cache.GetModificationTime( project.libraryLocations[i] ) > mtime:
 					log.LOG_LINKER(
 						"Library {0} has been modified since the last successful build. Relinking to new library."
 						.format(
@@ -2022,8 +2285,9 @@ def _performLink(project, objs):
 	#If it gets clobbered while running it could cause BAD THINGS (tm)
 	#On windows, however, we want to leave it there so that incremental link can work.
 	if platform.system() != "Windows":
-		if os.access(output , os.F_OK):
+		if _stat_cache.Exists( output ):
 			os.remove( output )
+			_stat_cache.Invalidate( output )
 
 	for dep in project.reconciledLinkDepends:
 		proj = _shared_globals.projects[dep]
@@ -2034,7 +2298,7 @@ def _performLink(project, objs):
 					chunkObj = _utils.GetChunkedObjPath(proj, chunk)
 				else:
 					chunkObj = _utils.GetUnityChunkObjPath(proj)
-				if proj.useChunks and not _shared_globals.disable_chunks and os.access(chunkObj , os.F_OK):
+				if proj.useChunks and not _shared_globals.disable_chunks and _stat_cache.Exists( chunkObj ):
 					objs.append( chunkObj )
 					hasChunk = True
 
@@ -2042,14 +2306,14 @@ def _performLink(project, objs):
 					if type( chunk ) == list:
 						for source in chunk:
 							obj = _utils.GetSourceObjPath(proj, source)
-							if os.access(obj , os.F_OK):
+							if _stat_cache.Exists( obj ):
 								objs.append( obj )
 							elif not hasChunk or proj.activeToolchain.Compiler().SupportsDummyObjects():
 								log.LOG_ERROR( "Could not find {} for linking. Something went wrong here.".format(obj) )
 								return _LinkStatus.Fail
 					else:
 						obj = _utils.GetSourceObjPath(proj, chunk)
-						if os.access(obj , os.F_OK):
+						if _stat_cache.Exists( obj ):
 							objs.append( obj )
 						elif not hasChunk or proj.activeToolchain.Compiler().SupportsDummyObjects():
 							log.LOG_ERROR( "Could not find {} for linking. Something went wrong here.".format(obj) )
@@ -2064,19 +2328,35 @@ def _performLink(project, objs):
 		cmd = shlex.split(cmd)
 
 	toolchainEnv = _utils.GetToolchainEnvironment( project.activeToolchain.Linker() )
-	fd = subprocess.Popen( cmd, stdout = subprocess.PIPE, stderr = subprocess.PIPE, cwd = project.objDir, env = toolchainEnv )
+	attempt = 0
+	while True:
+		if _process_loop is not None and _process_loop.IsRunning( ):
+			ret, out, errors, peakMemory = _process_loop.RunProcess( cmd, output, project.objDir, toolchainEnv )
+		else:
+			fd = subprocess.Popen( cmd, stdout = subprocess.PIPE, stderr = subprocess.PIPE, cwd = project.objDir, env = toolchainEnv )
 
-	with _shared_globals.spmutex:
-		_shared_globals.subprocesses[output] = fd
+			with _shared_globals.spmutex:
+				_shared_globals.subprocesses[output] = fd
 
-	(out, errors) = fd.communicate( )
+			out, errors, peakMemory = _throttle.Communicate( fd )
+
+			with _shared_globals.spmutex:
+				del _shared_globals.subprocesses[output]
+
+			ret = fd.returncode
+
+		if not _watchdog.ShouldRetry( output, attempt ):
+			break
+		attempt += 1
+		log.LOG_WARN( "Retrying link of {} ({}/{})...".format( os.path.basename( output ), attempt, _watchdog.GetRetries( ) ) )
+
+	_stat_cache.Invalidate( output )
+	if peakMemory is not None:
+		_hash_db.Set( ( "memory", output ), peakMemory )
 
 	with _shared_globals.spmutex:
-		del _shared_globals.subprocesses[output]
 		if _shared_globals.exiting:
 			return
-
-	ret = fd.returncode
 	sys.stdout.flush( )
 	sys.stderr.flush( )
 
@@ -2127,117 +2407,23 @@ def _performLink(project, objs):
 
 	return _LinkStatus.Success
 
-class _LinkThread(threading.Thread):
-	def __init__(self, project, objs):
-		threading.Thread.__init__( self )
-		self._project = project
-		self._objs = objs
-		#Prevent certain versions of python from choking on dummy threads.
-		if not hasattr( threading.Thread, "_Thread__block" ):
-			threading.Thread._Thread__block = _shared_globals.dummy_block( )
-
-
-	def run( self ):
-		global _linkThreadMutex
-		global _currentLinkThreads
-		global _linkCond
-		global _recheckDeferredLinkTasks
-		try:
-			project = self._project
-			project.state = _shared_globals.ProjectState.LINKING
-			ret = _performLink(project, self._objs)
-
-			if ret == _LinkStatus.Fail:
-				_shared_globals.build_success = False
-				project.state = _shared_globals.ProjectState.LINK_FAILED
-			elif ret == _LinkStatus.Success:
-				for plugin in project.plugins:
-					_utils.CheckRunBuildStep(project, plugin.postBuildStep, "plugin post-build")
-				_utils.CheckRunBuildStep(project, project.activeToolchain.postBuildStep, "toolchain post-build")
-
-				for buildStep in project.postBuildSteps:
-					_utils.CheckRunBuildStep(project, buildStep, "project post-build")
-				project.state = _shared_globals.ProjectState.FINISHED
-			elif ret == _LinkStatus.UpToDate:
-				project.state = _shared_globals.ProjectState.UP_TO_DATE
-			project.endTime = time.time()
-			log.LOG_BUILD( "Finished {} ({} {}/{})".format( project.outputName, project.targetName, project.outputArchitecture, project.activeToolchainName ) )
-
-			_shared_globals.link_semaphore.release()
-
-			with _linkThreadMutex:
-				_currentLinkThreads.remove(project.key)
-			with _linkMutex:
-				_recheckDeferredLinkTasks = True
-				_linkCond.notify()
-		except Exception:
-			traceback.print_exc()
-
-
-def _linkThreadLoop():
-	global _linkQueue
-	global _linkMutex
-	global _linkCond
-	global _currentLinkThreads
-	global _linkThreadMutex
-	global _recheckDeferredLinkTasks
-
-	try:
-		global _building
-		deferredLinks = []
-		while True:
-			projectsToLink = []
-			with _linkMutex:
-				if _recheckDeferredLinkTasks:
-					if _linkQueue:
-						_linkQueue += deferredLinks
-					else:
-						_linkQueue = deferredLinks
-					deferredLinks = []
-					_recheckDeferredLinkTasks = False
-				if not _linkQueue:
-					if not _building and not deferredLinks and not _currentLinkThreads:
-						return
-					_linkQueue = deferredLinks
-					deferredLinks = []
-					_linkCond.wait()
-				projectsToLink = _linkQueue
-				_linkQueue = []
-
-
-			for ( project, objs ) in projectsToLink:
-				okToLink = True
-				with _linkThreadMutex:
-					for depend in project.reconciledLinkDepends:
-						if depend in _currentLinkThreads:
-							okToLink = False
-							break
-
-						for ( otherProj, otherObjs ) in projectsToLink:
-							if otherProj.key == depend:
-								okToLink = False
-								break
-						if not okToLink:
-							break
-
-				if okToLink:
-					with _linkThreadMutex:
-						_currentLinkThreads.add(project.key)
-					_shared_globals.link_semaphore.acquire(True)
-					_LinkThread(project, objs).start()
-				else:
-					deferredLinks.append( ( project, objs ) )
-	except Exception:
-		traceback.print_exc()
-
-_linkThread = threading.Thread(target=_linkThreadLoop)
-
 def _clean( silent = False ):
 	"""
 	Cleans the project.
 	Invoked with --clean or --rebuild.
 	Deletes all of the object files to make sure they're rebuilt cleanly next run.
 	"""
+	def DeleteFile( path ):
+		if path and os.access( path, os.F_OK ):
+			if not silent:
+				log.LOG_INFO( "Deleting {0}".format( path ) )
+			os.remove( path )
+
+	def DeleteObject( project, obj ):
+		DeleteFile( obj )
+		#Along with the dependency file the compiler wrote beside it.
+		DeleteFile( project.activeToolchain.Compiler().GetDependencyFile( obj ) )
+
 	for project in _shared_globals.sortedProjects:
 
 		if not silent:
@@ -2249,45 +2435,33 @@ def _clean( silent = False ):
 				obj = _utils.GetChunkedObjPath(project, chunk)
 			else:
 				obj = _utils.GetUnityChunkObjPath(project)
-			if os.access(obj , os.F_OK):
-				if not silent:
-					log.LOG_INFO( "Deleting {0}".format( obj ) )
-				os.remove( obj )
+			DeleteObject( project, obj )
 
 		# Individual source files may not be in the chunks list, so we're gonna play it safe and delete any single source file objects that may exist.
 		for source in project.sources:
 			obj = _utils.GetSourceObjPath(project, source)
-			if os.access(obj , os.F_OK):
-				if not silent:
-					log.LOG_INFO( "Deleting {0}".format( obj ) )
-				os.remove( obj )
+			DeleteObject( project, obj )
 
 		# Delete the project's C++ precompiled header.
 		headerfile = os.path.join(project.csbuildDir, "{}_cpp_precompiled_headers_{}.hpp".format(
 			project.outputName.split( '.' )[0],
 			project.targetName ) )
 		obj = project.activeToolchain.Compiler().GetPchFile( headerfile )
-		if os.access(obj , os.F_OK):
-			if not silent:
-				log.LOG_INFO( "Deleting {0}".format( obj ) )
-			os.remove( obj )
+		DeleteObject( project, obj )
 
 		# Delete the project's C precompiled header.
 		headerfile = os.path.join(project.csbuildDir, "{}_c_precompiled_headers_{}.h".format(
 			project.outputName.split( '.' )[0],
 			project.targetName ))
 		obj = project.activeToolchain.Compiler().GetPchFile( headerfile )
-		if os.access(obj , os.F_OK):
-			if not silent:
-				log.LOG_INFO( "Deleting {0}".format( obj ) )
-			os.remove( obj )
+		DeleteObject( project, obj )
 
 		# Delete the project's output directory.
 		outpath = os.path.join( project.outputDir, project.outputName )
-		if os.access(outpath , os.F_OK):
-			if not silent:
-				log.LOG_INFO( "Deleting {}".format( outpath ) )
-			os.remove( outpath )
+		DeleteFile( outpath )
+
+	#Drop anything the stat cache knew about the files removed above.
+	_stat_cache.Clear( )
 
 
 def _installHeaders( ):
@@ -2513,6 +2687,9 @@ def Exit( code = 0, killGui = True ):
 	global _building
 	_building = False
 
+	#Exiting skips every finally block, _build()'s included.
+	_stopBuildServices( )
+
 	if not imp.lock_held():
 		imp.acquire_lock()
 
@@ -2637,13 +2814,161 @@ class _dummy( object ):
 
 
 def _execfile( file, glob, loc ):
+	_shared_globals.makefileScripts.add( os.path.abspath( file ) )
 	with open( file, "r" ) as f:
 		exec(compile(f.read( ), file, "exec"), glob, loc)
 
 
+#Options that only change how a build is carried out, not what gets built, so requests to a build server may set them
+#differently from the command line the server was started with.
+_PER_BUILD_OPTIONS = frozenset( (
+	"clean",
+	"install",
+	"install_headers",
+	"install_output",
+	"rebuild",
+	"quiet",
+	"show_commands",
+	"jobs",
+	"linker_jobs",
+	"force_color",
+	"force_progress_bar",
+	"stop_on_error",
+	"critical_path",
+	"no_jobserver",
+	"process_backend",
+	"process_timeout",
+	"timeout_retries",
+	"distribute",
+	"object_cache",
+	"object_cache_size",
+	"memory_budget",
+	"max_load",
+	"server",
+	"use_server",
+	"watch",
+) )
+
+
+def _applyPerBuildOptions( buildArgs ):
+	_shared_globals.CleanBuild = buildArgs.clean
+	_shared_globals.do_install = buildArgs.install or buildArgs.install_headers or buildArgs.install_output
+	_shared_globals.quiet = buildArgs.quiet
+	_shared_globals.show_commands = buildArgs.show_commands
+	_shared_globals.rebuild = buildArgs.rebuild or buildArgs.profile
+
+	if buildArgs.force_color == "on":
+		_shared_globals.color_supported = True
+	elif buildArgs.force_color == "off":
+		_shared_globals.color_supported = False
+
+	_shared_globals.forceProgressBar = buildArgs.force_progress_bar
+
+	if buildArgs.jobs:
+		_shared_globals.max_threads = buildArgs.jobs
+
+	if buildArgs.linker_jobs:
+		_shared_globals.max_linker_threads = max(buildArgs.linker_jobs, _shared_globals.max_threads)
+
+	_shared_globals.stopOnError = buildArgs.stop_on_error
+	_shared_globals.criticalPathReport = buildArgs.critical_path
+	_shared_globals.useJobServer = not buildArgs.no_jobserver
+	if buildArgs.process_backend:
+		_shared_globals.processBackend = buildArgs.process_backend
+	_shared_globals.processTimeout = buildArgs.process_timeout
+	_shared_globals.timeoutRetries = buildArgs.timeout_retries
+	_shared_globals.objectCacheDir = buildArgs.object_cache
+	_shared_globals.objectCacheSize = buildArgs.object_cache_size
+	_shared_globals.distributedWorkers = [
+		address.strip( ) for address in ( buildArgs.distribute or "" ).split( "," ) if address.strip( )
+	]
+	_shared_globals.memoryBudget = buildArgs.memory_budget
+	_shared_globals.maxLoad = buildArgs.max_load
+
+
+def _reportDependents( paths ):
+	"""
+	Print every object that was built from each of a list of files, grouped by project, with estimated compile times.
+
+	:param paths: Files to look up
+	:type paths: list[str]
+	"""
+	for path in paths:
+		path = os.path.abspath( path )
+		dependents = _header_cache.GetDependents( path )
+		if not dependents:
+			log.LOG_BUILD( "Nothing that has been built depends on {}.".format( path ) )
+			continue
+
+		byProject = { }
+		for obj, projectKey, sourceFile, duration in dependents:
+			byProject.setdefault( projectKey or "<unknown project>", [ ] ).append( ( duration or 0, sourceFile or obj ) )
+
+		total = sum( duration for entries in byProject.values( ) for duration, _ in entries )
+		longest = max( duration for entries in byProject.values( ) for duration, _ in entries )
+		log.LOG_BUILD(
+			"Changing {} would recompile {} file{} in {} project{}: about {:.2f}s of compile time, {:.2f}s with {} job{}."
+			.format(
+				path,
+				len( dependents ),
+				"" if len( dependents ) == 1 else "s",
+				len( byProject ),
+				"" if len( byProject ) == 1 else "s",
+				total,
+				max( longest, total / _shared_globals.max_threads ),
+				_shared_globals.max_threads,
+				"" if _shared_globals.max_threads == 1 else "s"
+			)
+		)
+		for projectKey in sorted( byProject ):
+			entries = sorted( byProject[projectKey], reverse = True )
+			log.LOG_BUILD( "  {} ({:.2f}s)".format( projectKey, sum( duration for duration, _ in entries ) ) )
+			for duration, sourceFile in entries:
+				log.LOG_BUILD( "    {:>8.2f}s  {}".format( duration, sourceFile ) )
+
+
 mainFile = ""
 mainFileDir = ""
 
+def _prepareProjects( generatingSolution ):
+	"""
+	Prepare every project to be built. Each project is prepared on a worker thread as soon as the projects it depends
+	on have been, so projects that don't depend on each other, including every target, architecture and toolchain of
+	the same project, are prepared at the same time.
+
+	:param generatingSolution: Whether a solution is being generated rather than building
+	:type generatingSolution: bool
+	"""
+	scheduler = _scheduler.Scheduler( )
+	scheduler.AddPool( ( _scheduler.NodeType.PREPARE, ), _shared_globals.max_threads, "csbuild-prepare" )
+
+	nodes = { }
+	for proj in _shared_globals.sortedProjects:
+		if proj.prebuilt == False and (proj.shell == False or generatingSolution):
+			func = proj.prepareBuild
+		else:
+			func = proj.minimalPrepareBuild
+
+		inputs = [ nodes[depend] for depend in list( proj.reconciledLinkDepends ) + list( proj.srcDepends ) if depend in nodes ]
+		nodes[proj.key] = scheduler.AddNode(
+			_scheduler.NodeType.PREPARE,
+			"prepare {} ({} {}/{})".format( proj.name, proj.targetName, proj.outputArchitecture, proj.activeToolchainName ),
+			func,
+			proj,
+			inputs
+		)
+
+	scheduler.Run( )
+
+	failed = [ node for node in scheduler.GetNodes( ) if node.state != _scheduler.NodeState.SUCCEEDED ]
+	if failed:
+		log.LOG_ERROR( "Could not prepare tasks for {}.".format( ", ".join(
+			"{} ({} {}/{})".format( node.project.name, node.project.targetName, node.project.outputArchitecture, node.project.activeToolchainName )
+			for node in failed
+		) ) )
+		Exit( 1 )
+
+
 def _run( ):
 
 	_setupdefaults( )
@@ -2825,6 +3150,14 @@ def _run( ):
 		action = "store", choices = ["on", "off"], default = None, const = "on", nargs = "?" )
 	parser.add_argument( '--force-progress-bar', help = "Force progress bar on or off.",
 		action = "store", choices = ["on", "off"], default = None, const = "on", nargs = "?" )
+
+	group = parser.add_mutually_exclusive_group( )
+	group.add_argument( '--server', action = "store_true",
+		help = "Evaluate the makefile once and wait for builds requested with --use-server, instead of building." )
+	group.add_argument( '--use-server', action = "store_true",
+		help = "Have the build server started with --server carry out this build, if one is running." )
+	group.add_argument( '--watch', action = "store_true",
+		help = "Build, then keep rebuilding whenever a source, header or makefile script changes." )
 	parser.add_argument( '--prefix', help = "install prefix (default /usr/local)", action = "store" )
 	parser.add_argument( '--libdir', help = "install location for libraries (default {prefix}/lib)", action = "store" )
 	parser.add_argument( '--incdir', help = "install prefix (default {prefix}/include)", action = "store" )
@@ -2849,12 +3182,44 @@ def _run( ):
 		help = "Stop compilation after the first error is encountered.",
 		action = "store_true"
 	)
+	parser.add_argument( '--critical-path', action = "store_true",
+		help = "After building, list the compiles and links along the longest chain of work in the build, and along the "
+		"chain that finished last, to help tune chunking and thread counts." )
+	parser.add_argument( '--memory-budget', metavar = "SIZE", type = _throttle.ParseSize,
+		help = "Only start a compile or link if the peak memory it and those already running used last time fits in SIZE "
+		"(e.g. 512M or 16G, megabytes if no unit is given). Defaults to the memory available when the build starts." )
+	parser.add_argument( '--max-load', metavar = "LOAD", type = float,
+		help = "Don't start any more compiles or links while the system's load average is above LOAD." )
+	parser.add_argument( '--process-backend', choices = [ "asyncio", "threads" ],
+		help = "How compiler and linker processes are run: all from one asyncio event loop (the default, where "
+		"supported), or with threads reading each one's output." )
+	parser.add_argument( '--process-timeout', metavar = "SECONDS", type = float,
+		help = "Kill any compile or link that runs for longer than SECONDS, or 0 to never kill one. By default, a compile "
+		"or link is killed if it runs for ten times as long as it took last time, and at least five minutes." )
+	parser.add_argument( '--timeout-retries', metavar = "COUNT", type = int, default = 0,
+		help = "Number of times to retry a compile or link that was killed for running too long." )
+	parser.add_argument( '--distribute', metavar = "HOST:PORT[,...]",
+		help = "Send compiles to the csbuild-worker processes at the given comma-separated addresses, on top of the ones "
+		"run locally. Files are preprocessed locally, so the workers only need the same compilers. The port defaults "
+		"to {}. The workers' token is read from the {} environment variable.".format(
+			_distributed_worker.DEFAULT_PORT, _distributed_worker.TOKEN_VARIABLE ) )
+	parser.add_argument( '--object-cache', metavar = "DIR",
+		help = "Keep every object that's compiled in DIR, keyed by its preprocessed source, compile command and compiler, "
+		"and restore objects from there instead of compiling them again. DIR can be shared between builds and checkouts." )
+	parser.add_argument( '--object-cache-size', metavar = "SIZE", type = _throttle.ParseSize,
+		help = "Most space the object cache can take up (e.g. 512M or 16G, megabytes if no unit is given). Once a build "
+		"finishes, the least recently used objects are removed to fit. Defaults to 5G." )
+	parser.add_argument( '--no-jobserver', action = "store_true",
+		help = "Don't share jobs with the GNU make jobserver csbuild was run with, or provide one to the processes it runs." )
 	parser.add_argument( '--no-precompile', help = "Disable precompiling globally, affects all projects",
 		action = "store_true" )
 	parser.add_argument( '--no-chunks', help = "Disable chunking globally, affects all projects",
 		action = "store_true" )
 	parser.add_argument( '--dg', '--dependency-graph', help="Generate dependency graph", action="store_true")
 	parser.add_argument( '--with-libs', help="Include linked libraries in dependency graph", action="store_true" )
+	parser.add_argument( '--what-rebuilds', metavar = "FILE", action = "append",
+		help = "List the files that would be recompiled if the given source or header changed, along with how long "
+		"they took to compile last time, and exit." )
 	parser.add_argument( "-d", "--define", help = "Add defines to each project being built.", action = "append")
 
 	group = parser.add_argument_group( "Solution generation", "Commands to generate a solution" )
@@ -2917,16 +3282,17 @@ def _run( ):
 		print("\nMaintainer: {} - {}".format( __maintainer__, __email__ ))
 		return
 
+	if args.use_server:
+		code = _server.RunClient( [ arg for arg in sys.argv[1:] if arg != "--use-server" ] )
+		if code is not None:
+			Exit( code )
+
 	# Add any defines that were passed in from the command line.
 	if args.define:
 		for define in args.define:
 			AddDefines(define)
 
-	_shared_globals.CleanBuild = args.clean
-	_shared_globals.do_install = args.install or args.install_headers or args.install_output
-	_shared_globals.quiet = args.quiet
-	_shared_globals.show_commands = args.show_commands
-	_shared_globals.rebuild = args.rebuild or args.profile
+	_applyPerBuildOptions( args )
 	if args.gui and _shared_globals.CleanBuild:
 		log.LOG_INFO("The GUI is currently disabled when performing a clean.")
 		args.gui = False
@@ -2939,13 +3305,6 @@ def _run( ):
 	if args.project:
 		project_build_list = set( args.project )
 
-	if args.force_color == "on":
-		_shared_globals.color_supported = True
-	elif args.force_color == "off":
-		_shared_globals.color_supported = False
-
-	_shared_globals.forceProgressBar = args.force_progress_bar
-
 	if args.prefix:
 		_shared_globals.install_prefix = os.path.abspath(args.prefix)
 	if args.libdir:
@@ -2963,20 +3322,10 @@ def _run( ):
 	_shared_globals.install_libdir = os.path.abspath(_shared_globals.install_libdir.format(prefix=_shared_globals.install_prefix, project=proj))
 	_shared_globals.install_incdir = os.path.abspath(_shared_globals.install_incdir.format(prefix=_shared_globals.install_prefix, project=proj))
 
-	if args.jobs:
-		_shared_globals.max_threads = args.jobs
-		_shared_globals.semaphore = threading.BoundedSemaphore( value = _shared_globals.max_threads )
-
-	if args.linker_jobs:
-		_shared_globals.max_linker_threads = max(args.linker_jobs, _shared_globals.max_threads)
-		_shared_globals.link_semaphore = threading.BoundedSemaphore( value = _shared_globals.max_linker_threads )
-
 	_shared_globals.profile = args.profile
 	_shared_globals.disable_chunks = args.no_chunks
 	_shared_globals.disable_precompile = args.no_precompile or args.profile
 
-	_shared_globals.stopOnError = args.stop_on_error
-
 	if args.generate_solution is not None:
 		args.at = True
 		args.aa = True
@@ -3463,35 +3812,128 @@ def _run( ):
 			log.LOG_BUILD("Wrote depends.png")
 		return
 
-	#headerCacheFile = os.path.join(_shared_globals.cacheDirectory, "header_info.csbc")
-	#if os.path.exists(headerCacheFile):
-	#	log.LOG_BUILD("Loading cache data...")
-	#	with open(headerCacheFile, "rb") as f:
-	#		_shared_globals.allheaders = pickle.load(f)
-	#	mtime = os.path.getmtime(headerCacheFile)
-	#	for header in _shared_globals.allheaders.keys():
-	#		if not header:
-	#			continue
-	#		try:
-	#			htime = os.path.getmtime(header)
-	#			if htime > mtime:
-	#				del _shared_globals.allheaders[header]
-	#		except:
-	#			del _shared_globals.allheaders[header]
+	if args.what_rebuilds:
+		_header_cache.Load( _header_cache.GetSettingsSignature( _shared_globals.sortedProjects ) )
+		_reportDependents( args.what_rebuilds )
+		return
 
+	def LoadCaches( ):
+		_header_cache.Load( _header_cache.GetSettingsSignature( _shared_globals.sortedProjects ) )
+		_hash_db.Load( )
+		_include_resolver.Load( )
 
-	for proj in _shared_globals.sortedProjects:
-		if proj.prebuilt == False and (proj.shell == False or args.generate_solution):
-			proj.prepareBuild( )
-		else:
-			proj.minimalPrepareBuild()
+	if args.server:
+		if not _server.IsSupported( ):
+			log.LOG_ERROR( "The build server is not supported on this platform." )
+			Exit( 1 )
+
+		serverArgv = sys.argv[1:]
+
+		def CheckServerRequest( argv ):
+			#argparse exits on errors, and sys.exit() has been replaced with something that can't be caught.
+			sys.exit = sysExit
+			try:
+				requestArgs, requestRemainder = parser.parse_known_args( argv )
+				serverArgs, serverRemainder = parser.parse_known_args( serverArgv )
+			except SystemExit:
+				return "invalid command line"
+			finally:
+				sys.exit = Exit
+
+			for key in set( vars( requestArgs ) ) | set( vars( serverArgs ) ):
+				if key not in _PER_BUILD_OPTIONS and getattr( requestArgs, key, None ) != getattr( serverArgs, key, None ):
+					return "--{} differs from the server's command line".format( key.replace( "_", "-" ) )
+			if requestRemainder != serverRemainder:
+				return "makefile options differ from the server's command line"
+			return None
+
+		def RefreshServerState( ):
+			#Each build runs in its own process and writes its results to disk, so pick those up while idle.
+			_stat_cache.Clear( )
+			LoadCaches( )
+			_stat_cache.Clear( )
+
+		RefreshServerState( )
+		request = _server.Serve(
+			_shared_globals.makefileScripts,
+			[ sys.executable, os.path.join( mainFileDir, mainFile ) ] + serverArgv,
+			CheckServerRequest,
+			RefreshServerState
+		)
+		if request is None:
+			Exit( 1 )
+
+		#Everything from here on is in the forked child handling the request.
+		requestArgs, _ = parser.parse_known_args( request["argv"] )
+		for key in _PER_BUILD_OPTIONS:
+			setattr( args, key, getattr( requestArgs, key ) )
+		if args.force_color is None:
+			_shared_globals.color_supported = request["tty"]
+		_applyPerBuildOptions( args )
+
+		_header_cache.Revalidate( )
+		_shared_globals.starttime = time.time( )
+	elif args.watch:
+		if not _watcher.IsSupported( ):
+			log.LOG_ERROR( "Watch mode is not supported on this platform." )
+			Exit( 1 )
+
+		watchDirs = set( )
+		ignoredDirs = set( )
+		sourceExtensions = set( )
+
+		def ResolveWatchPath( tempPath, project ):
+			return os.path.normpath( os.path.join( tempPath.workingDir, _utils.ResolveProjectMacros( tempPath.path, project ) ) )
+
+		for proj in _shared_globals.sortedProjects:
+			if proj.prebuilt or proj.shell:
+				continue
+			watchDirs.add( proj.workingDirectory )
+			for tempPath in proj.extraDirsTemp + proj.includeDirsTemp:
+				watchDirs.add( ResolveWatchPath( tempPath, proj ) )
+			for tempPath in ( proj.objDirTemp, proj.outputDirTemp ):
+				if tempPath:
+					ignoredDirs.add( os.path.normcase( ResolveWatchPath( tempPath, proj ) ) )
+			for extensions in ( proj.cExtensions, proj.cppExtensions, proj.asmExtensions, proj.cHeaderExtensions,
+					proj.cppHeaderExtensions, proj.ambiguousHeaderExtensions ):
+				sourceExtensions.update( os.path.normcase( extension ) for extension in extensions )
+
+		def IsIgnoredWatchDir( path ):
+			path = os.path.normcase( path )
+			return os.path.basename( path ) == ".csbuild" or path in ignoredDirs
+
+		def IsRelevantChange( path ):
+			if IsIgnoredWatchDir( os.path.dirname( path ) ):
+				return False
+			return os.path.splitext( path )[1] in sourceExtensions or _header_cache.IsTracked( path )
+
+		_watcher.Watch(
+			watchDirs,
+			_shared_globals.makefileScripts,
+			IsIgnoredWatchDir,
+			IsRelevantChange,
+			[ sys.executable, os.path.join( mainFileDir, mainFile ) ] + sys.argv[1:],
+			LoadCaches
+		)
+
+		#Everything from here on is in the forked child carrying out this round's build.
+		_shared_globals.starttime = time.time( )
+	else:
+		LoadCaches( )
+
+	manifestKey = _manifest.GetBuildKey( args, _PER_BUILD_OPTIONS )
+	useManifest = _manifest.CanUseManifest( _shared_globals.sortedProjects )
+	if useManifest and not _shared_globals.CleanBuild and not _shared_globals.do_install and not _shared_globals.rebuild \
+			and args.generate_solution is None and not args.gui:
+		if _manifest.IsUpToDate( manifestKey ):
+			log.LOG_BUILD( "Nothing has changed since the last successful build." )
+			Exit( 0 )
+
+	_prepareProjects( args.generate_solution is not None )
 
 	# Remove projects that don't actually build.
 	_shared_globals.sortedProjects = [ proj for proj in _shared_globals.sortedProjects if proj.prebuilt == False and (proj.shell == False or args.generate_solution) ]
 
-	#with open(headerCacheFile, "wb") as f:
-	#	pickle.dump(_shared_globals.allheaders, f, 2)
-
 	_utils.CheckVersion( )
 
 	totaltime = time.time( ) - _shared_globals.starttime
@@ -3499,6 +3941,8 @@ def _run( ):
 	totalsec = math.floor( totaltime % 60 )
 	_utils.ChunkedBuild( )
 	_utils.PreparePrecompiles( )
+	_header_cache.Save( )
+	_include_resolver.Save( )
 	log.LOG_BUILD( "Task preparation took {0}:{1:02}".format( int( totalmin ), int( totalsec ) ) )
 
 
@@ -3527,11 +3971,15 @@ def _run( ):
 		_installHeaders()
 	elif args.install_output:
 		_installOutput()
-	elif _shared_globals.rebuild:
-		_clean( )
-		_make( )
 	else:
+		if _shared_globals.rebuild:
+			_clean( )
 		_make( )
+		failedStates = ( _shared_globals.ProjectState.FAILED, _shared_globals.ProjectState.LINK_FAILED,
+			_shared_globals.ProjectState.ABORTED )
+		if useManifest and _shared_globals.build_success and \
+				not [ proj for proj in _shared_globals.sortedProjects if proj.state in failedStates ]:
+			_manifest.Write( manifestKey, _shared_globals.sortedProjects )
 
 	#Print out any errors or warnings incurred so the user doesn't have to scroll to see what went wrong
 	if _shared_globals.warnings:
@@ -0,0 +1,433 @@
+# Copyright (C) 2013 Jaedyn K. Draper
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Distributed compiles.
+
+With --distribute, csbuild connects to each of the listed compile workers (see _distributed_worker.py) when the build
+starts, opening one connection for every job the worker offers. Each connection is a remote slot. The compile pool gets
+a thread for every remote slot on top of the local ones, and the build graph scheduler weighs the two separately: a
+compile that can be done remotely is given a free remote slot if there is one, and everything else is held to the
+local job count as usual. Remote compiles don't take a job from the jobserver, and don't count against the memory
+budget.
+
+A remote compile is preprocessed locally, with the compiler's GetPreprocessCommand(), so the worker needs nothing but
+the compiler itself. The headers the source depends on are read from the line markers in the preprocessed output. The
+worker compiles the preprocessed source and sends back the object, which is written where the local compile would
+have put it, along with the compiler's output.
+
+Only files compiled by toolchains that support it (see compilerBase.SupportsDistributedCompile()), that don't use a
+precompiled header or flags workers refuse to run (see _distributed_worker.FindRefusedFlag()), are sent to workers, and
+never while profiling. If a worker can't be reached when the build starts
+it's left out; if a connection fails during the build, or a worker takes longer than the compile's timeout, the slot is
+dropped and the file is compiled locally instead.
+
+Workers only take compiles from builds that know the token they share, which is read from the CSBUILD_WORKER_TOKEN
+environment variable.
+"""
+
+import os
+import platform
+import re
+import shlex
+import socket
+import threading
+import zlib
+
+from . import log
+from . import _distributed_worker
+
+_CONNECT_TIMEOUT_SECONDS = 5
+
+#Preprocessor and dependency file flags, which don't apply to compiling a preprocessed source. The first ones take their
+#value as the next argument when it isn't joined on.
+_LOCAL_FLAGS_WITH_VALUE = frozenset( (
+	"-D", "-U", "-I", "-include", "-imacros", "-isystem", "-iquote", "-idirafter", "-iprefix", "-iwithprefix",
+	"-iwithprefixbefore", "-isysroot", "--sysroot", "-MF", "-MT", "-MQ", "-o",
+) )
+_LOCAL_FLAG_PREFIXES = (
+	"-D", "-U", "-I", "-M", "-o", "-include", "-imacros", "-isystem", "-iquote", "-idirafter", "-iprefix",
+	"-iwithprefix", "-isysroot", "--sysroot",
+)
+
+_LINE_MARKER = re.compile( br'^#(?:line)?\s+\d+\s+"((?:\\.|[^"\\])*)"([\s\d]*)$' )
+
+_active = None
+
+
+class WorkerError( Exception ):
+	"""
+	A remote compile couldn't be carried out, and the file has to be compiled locally.
+	"""
+	pass
+
+
+class Slot( object ):
+	"""
+	A connection to a worker, able to carry one compile at a time.
+
+	:ivar address: Address of the worker, as given on the command line
+	:type address: str
+	"""
+	def __init__( self, workers, sock, address ):
+		self.address = address
+		self._workers = workers
+		self._sock = sock
+		self._dropped = False
+
+
+	def Compile( self, job, source, obj, timeout ):
+		"""
+		Compile a preprocessed source on the worker.
+
+		:param job: What GetJob() returned for the compile
+		:type job: dict
+
+		:param source: The preprocessed source
+		:type source: bytes
+
+		:param obj: Where to write the object
+		:type obj: str
+
+		:param timeout: Seconds to wait for the result, or None to wait indefinitely
+		:type timeout: float
+
+		:return: The compiler's return code, and what it wrote to stdout and stderr
+		:rtype: tuple[int, bytes, bytes]
+
+		:raises WorkerError: If the compile couldn't be carried out. The slot is dropped, unless the worker refused to run
+			the compiler.
+		"""
+		protocol = _distributed_worker
+		try:
+			self._sock.settimeout( timeout )
+			protocol.SendJson( self._sock, protocol.JOB, job )
+			protocol.SendFrame( self._sock, protocol.SOURCE, zlib.compress( source, 1 ) )
+
+			result = protocol.RecvJson( self._sock, protocol.RESULT )
+			returncode = result["returncode"]
+			out = protocol.RecvFrame( self._sock, protocol.STDOUT )
+			errors = protocol.RecvFrame( self._sock, protocol.STDERR )
+			objData = zlib.decompress( protocol.RecvFrame( self._sock, protocol.OBJECT ) )
+		except (socket.error, EOFError, ValueError, KeyError, zlib.error) as e:
+			self._drop( )
+			if isinstance( e, socket.timeout ):
+				e = "timed out after {} seconds".format( int( timeout ) )
+			elif isinstance( e, EOFError ):
+				e = "connection closed"
+			raise WorkerError( "Lost connection to compile worker {}: {}".format( self.address, e ) )
+
+		if result.get( "rejected" ):
+			raise WorkerError( "Compile worker {} refused the compile: {}.".format( self.address, result["rejected"] ) )
+		if returncode == 0:
+			if not objData:
+				raise WorkerError( "Compile worker {} did not send back an object.".format( self.address ) )
+			with open( obj, "wb" ) as f:
+				f.write( objData )
+		return returncode, out, errors
+
+
+	def Release( self ):
+		"""
+		Make the slot available to the next compile.
+		"""
+		self._workers._release( self )
+
+
+	def _drop( self ):
+		self._dropped = True
+		try:
+			self._sock.close( )
+		except socket.error:
+			pass
+
+
+class RemoteWorkers( object ):
+	"""
+	The remote slots of every worker that could be reached.
+
+	:param canRunRemotely: Function taking a build graph node, that returns whether it can be run on a worker
+	:type canRunRemotely: callable
+	"""
+	def __init__( self, canRunRemotely ):
+		self._canRunRemotely = canRunRemotely
+		self._lock = threading.Lock( )
+		self._free = [ ]
+		self._all = [ ]
+		self._reserved = { }
+
+
+	@property
+	def numSlots( self ):
+		"""Number of remote slots there were when the build started"""
+		return len( self._all )
+
+
+	def Reserve( self, node ):
+		"""
+		Set a remote slot aside for a node that's about to be started, if it can run remotely and a slot is free.
+
+		:param node: Node that's ready to start
+		:type node: csbuild._scheduler.Node
+
+		:return: The reserved slot, or None if the node has to run locally
+		:rtype: Slot
+		"""
+		with self._lock:
+			if not self._free:
+				return None
+		if not self._canRunRemotely( node ):
+			return None
+		with self._lock:
+			if not self._free:
+				return None
+			slot = self._free.pop( )
+			self._reserved[os.path.abspath( node.key )] = slot
+		return slot
+
+
+	def TakeReservation( self, key ):
+		"""
+		:param key: Key of the node a slot may have been reserved for
+		:type key: str
+
+		:return: The slot reserved for it, or None if it wasn't given one
+		:rtype: Slot
+		"""
+		with self._lock:
+			return self._reserved.pop( os.path.abspath( key ), None )
+
+
+	def Close( self ):
+		"""
+		Close every connection.
+		"""
+		with self._lock:
+			slots = self._all
+			self._all = [ ]
+			self._free = [ ]
+			self._reserved = { }
+		for slot in slots:
+			slot._drop( )
+
+
+	def _add( self, slot ):
+		self._all.append( slot )
+		self._free.append( slot )
+
+
+	def _release( self, slot ):
+		with self._lock:
+			for key, reserved in list( self._reserved.items( ) ):
+				if reserved is slot:
+					del self._reserved[key]
+			if not slot._dropped and slot in self._all and slot not in self._free:
+				self._free.append( slot )
+
+
+def _parseAddress( address ):
+	host, _, port = address.rpartition( ":" )
+	if not host:
+		return address, _distributed_worker.DEFAULT_PORT
+	return host, int( port )
+
+
+def _connect( host, port, token ):
+	"""
+	:return: A connection to the worker, and what it said when it was connected to
+	:rtype: tuple[socket.socket, dict]
+
+	:raises WorkerError: If the worker is running an incompatible version of csbuild
+	"""
+	protocol = _distributed_worker
+	sock = socket.create_connection( ( host, port ), _CONNECT_TIMEOUT_SECONDS )
+	try:
+		sock.setsockopt( socket.IPPROTO_TCP, socket.TCP_NODELAY, 1 )
+		hello = protocol.RecvJson( sock, protocol.HELLO )
+		if hello.get( "version" ) != protocol.PROTOCOL_VERSION:
+			raise WorkerError( "it's running an incompatible version of csbuild" )
+		protocol.SendJson( sock, protocol.AUTH, { "response": protocol.GetAuthResponse( token, hello["challenge"] ) } )
+		try:
+			welcome = protocol.RecvJson( sock, protocol.WELCOME )
+		except EOFError:
+			raise WorkerError( "it did not accept the token in {}".format( protocol.TOKEN_VARIABLE ) )
+	except Exception:
+		sock.close( )
+		raise
+	return sock, welcome
+
+
+def Start( addresses, canRunRemotely ):
+	"""
+	Connect to the compile workers.
+
+	:param addresses: host:port of each worker. The port can be left out to use the default one.
+	:type addresses: list[str]
+
+	:param canRunRemotely: Function taking a build graph node, that returns whether it can be run on a worker
+	:type canRunRemotely: callable
+
+	:return: The remote slots, or None if no worker could be reached
+	:rtype: RemoteWorkers
+	"""
+	global _active
+
+	if _active is not None:
+		return _active
+
+	token = os.environ.get( _distributed_worker.TOKEN_VARIABLE, "" ).strip( )
+	if not token:
+		log.LOG_WARN( "{} is not set, so no compile worker will take compiles; compiling everything locally.".format(
+			_distributed_worker.TOKEN_VARIABLE ) )
+		return None
+
+	workers = RemoteWorkers( canRunRemotely )
+	for address in addresses:
+		try:
+			host, port = _parseAddress( address )
+			sock, welcome = _connect( host, port, token )
+		except (socket.error, EOFError, ValueError, KeyError, WorkerError) as e:
+			if isinstance( e, EOFError ):
+				e = "connection closed"
+			log.LOG_WARN( "Could not connect to compile worker {}: {}".format( address, e ) )
+			continue
+
+		workers._add( Slot( workers, sock, address ) )
+		for _ in range( int( welcome.get( "jobs", 1 ) ) - 1 ):
+			try:
+				sock, _ = _connect( host, port, token )
+			except (socket.error, EOFError, ValueError, KeyError, WorkerError) as e:
+				log.LOG_WARN( "Could not open another connection to compile worker {}: {}".format( address, e ) )
+				break
+			workers._add( Slot( workers, sock, address ) )
+
+	if not workers.numSlots:
+		log.LOG_WARN( "No compile workers are available, compiling everything locally." )
+		return None
+
+	log.LOG_INFO( "Distributing compiles over {} remote slot{}.".format(
+		workers.numSlots, "" if workers.numSlots == 1 else "s" ) )
+	_active = workers
+	return _active
+
+
+def Stop( ):
+	"""
+	Disconnect from the compile workers.
+	"""
+	global _active
+
+	if _active is None:
+		return
+	active = _active
+	_active = None
+	active.Close( )
+
+
+def TakeReservation( key ):
+	"""
+	:param key: Key of the node a slot may have been reserved for: the object file, for compiles
+	:type key: str
+
+	:return: The slot the scheduler reserved for it, or None if it's to be compiled locally
+	:rtype: Slot
+	"""
+	if _active is None:
+		return None
+	return _active.TakeReservation( key )
+
+
+def GetJob( cmd, inputName, outputName ):
+	"""
+	Describe a compile to a worker.
+
+	:param cmd: Compile command, reading inputName and writing outputName in the current directory
+	:type cmd: str
+
+	:param inputName: File name the preprocessed source is written to on the worker
+	:type inputName: str
+
+	:param outputName: File name of the object the command creates
+	:type outputName: str
+
+	:return: The job to send, or None if workers would refuse to run it
+	:rtype: dict
+	"""
+	args = [ arg.replace( '"', "" ) for arg in shlex.split( cmd, posix = platform.system( ) != "Windows" ) ]
+	flags = [ ]
+	skipValue = False
+	for arg in args[1:]:
+		if skipValue:
+			skipValue = False
+		elif arg in _LOCAL_FLAGS_WITH_VALUE:
+			skipValue = True
+		elif not arg.startswith( _LOCAL_FLAG_PREFIXES ) and arg != inputName:
+			flags.append( arg )
+
+	if _distributed_worker.FindRefusedFlag( flags ) is not None:
+		return None
+	return { "compiler": args[0], "flags": flags, "input": inputName, "output": outputName }
+
+
+def GetPreprocessedName( sourceFile, isPlainC ):
+	"""
+	:param sourceFile: Source file that's been preprocessed
+	:type sourceFile: str
+
+	:param isPlainC: Whether it's compiled as C
+	:type isPlainC: bool
+
+	:return: Name to give its preprocessed output on the worker, with the extension the compiler expects of it
+	:rtype: str
+	"""
+	isObjectiveC = os.path.splitext( sourceFile )[1].lower( ) in ( ".m", ".mm" )
+	if isPlainC:
+		return "source.mi" if isObjectiveC else "source.i"
+	return "source.mii" if isObjectiveC else "source.ii"
+
+
+def GetDependencies( preprocessed ):
+	"""
+	Get the files a preprocessed source was made from, leaving out system headers, the same as the dependencies the
+	compiler itself reports.
+
+	:param preprocessed: Preprocessed source with line markers
+	:type preprocessed: bytes
+
+	:return: Every file named in a line marker, other than system headers and the compiler's built-in pseudo-files
+	:rtype: list[str]
+	"""
+	dependencies = [ ]
+	seen = set( )
+	for line in preprocessed.splitlines( ):
+		if not line.startswith( b"#" ):
+			continue
+		match = _LINE_MARKER.match( line.rstrip( ) )
+		if match is None:
+			continue
+		#Flag 3 marks headers from a system include directory, which the compiler doesn't list as dependencies either.
+		if b"3" in match.group( 2 ).split( ):
+			continue
+		path = re.sub( br'\\(.)', br'\1', match.group( 1 ) ).decode( "utf-8", "replace" )
+		if path.startswith( "<" ) or path in seen:
+			continue
+		seen.add( path )
+		dependencies.append( path )
+	return dependencies
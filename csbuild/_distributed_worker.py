@@ -0,0 +1,395 @@
+# Copyright (C) 2013 Jaedyn K. Draper
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Distributed compile worker, and the protocol it speaks.
+
+Compiles preprocessed sources sent by builds on other machines (see _distributed.py). Run it with the csbuild-worker
+script, or this file directly:
+
+	CSBUILD_WORKER_TOKEN=secret csbuild-worker --host 0.0.0.0 --port 8427 --jobs 8 --compiler gcc --compiler g++
+
+Builds with the token can only run the allowed compilers, with flags that don't load plugins, run other programs or
+name files outside the compile's temporary directory (see FindRefusedFlag()). Only the standard library is used, because
+importing the csbuild package runs a build.
+"""
+
+import argparse
+import hashlib
+import hmac
+import json
+import multiprocessing
+import os
+import re
+import shutil
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import zlib
+
+PROTOCOL_VERSION = 3
+DEFAULT_PORT = 8427
+#Environment variable holding the token workers and builds share
+TOKEN_VARIABLE = "CSBUILD_WORKER_TOKEN"
+
+_FRAME_HEADER = struct.Struct( "<BI" )
+
+#Flags compiles can use, as long as they don't name files outside the compile's directory. The worker adds -c, -o and
+#the source itself; preprocessor flags have no effect on preprocessed sources, so builds leave them out.
+_ALLOWED_FLAGS = frozenset( ( "-c", "-w", "-p", "-pg", "-pipe", "-pthread", "-ansi", "-pass-exit-codes" ) )
+_ALLOWED_FLAG_PREFIXES = ( "-O", "-g", "-f", "-W", "-m", "-std=", "-stdlib=", "--target=", "-pedantic" )
+#Allowed by the prefixes above, but load plugins or pass options on to other programs.
+_REFUSED_FLAG_PREFIXES = ( "-fplugin", "-fpass-plugin", "-Wa,", "-Wl,", "-Wp,", "-mllvm" )
+#Flags whose value is the next argument, and what it can be.
+_SEPARATE_VALUE_FLAGS = frozenset( ( "-x", "-arch", "-target" ) )
+_SEPARATE_VALUE = re.compile( r"^[\w.+-]+$" )
+
+HELLO = 0
+JOB = 1
+SOURCE = 2
+RESULT = 3
+STDOUT = 4
+STDERR = 5
+OBJECT = 6
+AUTH = 7
+WELCOME = 8
+
+
+def SendFrame( sock, kind, payload ):
+	"""
+	Send a single message.
+
+	:param sock: Connection to send it on
+	:type sock: socket.socket
+
+	:param kind: What the message holds
+	:type kind: int
+
+	:param payload: Contents of the message
+	:type payload: bytes
+	"""
+	sock.sendall( _FRAME_HEADER.pack( kind, len( payload ) ) + payload )
+
+
+def _recvExactly( sock, length ):
+	chunks = []
+	while length:
+		data = sock.recv( min( length, 65536 ) )
+		if not data:
+			raise EOFError( )
+		chunks.append( data )
+		length -= len( data )
+	return b"".join( chunks )
+
+
+def RecvFrame( sock, expectedKind ):
+	"""
+	Receive a single message.
+
+	:param sock: Connection to receive it on
+	:type sock: socket.socket
+
+	:param expectedKind: What the message should hold
+	:type expectedKind: int
+
+	:return: Contents of the message
+	:rtype: bytes
+
+	:raises EOFError: If the connection was closed
+	:raises ValueError: If the message isn't of the expected kind
+	"""
+	kind, length = _FRAME_HEADER.unpack( _recvExactly( sock, _FRAME_HEADER.size ) )
+	payload = _recvExactly( sock, length )
+	if kind != expectedKind:
+		raise ValueError( "Expected message {}, got {}".format( expectedKind, kind ) )
+	return payload
+
+
+def SendJson( sock, kind, value ):
+	"""
+	Send a single message holding a JSON value.
+
+	:param sock: Connection to send it on
+	:type sock: socket.socket
+
+	:param kind: What the message holds
+	:type kind: int
+
+	:param value: Value to send
+	:type value: dict
+	"""
+	SendFrame( sock, kind, json.dumps( value ).encode( "utf-8" ) )
+
+
+def RecvJson( sock, expectedKind ):
+	"""
+	Receive a single message holding a JSON value.
+
+	:param sock: Connection to receive it on
+	:type sock: socket.socket
+
+	:param expectedKind: What the message should hold
+	:type expectedKind: int
+
+	:return: The value
+	:rtype: dict
+	"""
+	return json.loads( RecvFrame( sock, expectedKind ).decode( "utf-8" ) )
+
+
+def GetAuthResponse( token, challenge ):
+	"""
+	Answer the challenge a worker sends when it's connected to.
+
+	:param token: Token shared by the worker and the build
+	:type token: str
+
+	:param challenge: Challenge the worker sent
+	:type challenge: str
+
+	:return: The response
+	:rtype: str
+	"""
+	if not isinstance( token, bytes ):
+		token = token.encode( "utf-8" )
+	if not isinstance( challenge, bytes ):
+		challenge = challenge.encode( "utf-8" )
+	return hmac.new( token, challenge, hashlib.sha256 ).hexdigest( )
+
+
+def _isPlainFileName( name ):
+	return bool( name ) and os.path.basename( name ) == name and name not in ( ".", ".." )
+
+
+def _isOutsideDirectory( path ):
+	path = path.replace( "\\", "/" )
+	return path.startswith( "/" ) or re.match( r"^[A-Za-z]:", path ) is not None or ".." in path.split( "/" )
+
+
+def FindRefusedFlag( flags ):
+	"""
+	:param flags: Flags a compile is to be run with
+	:type flags: list[str]
+
+	:return: The first of them workers refuse to run, or None if they run them all
+	:rtype: str
+	"""
+	expectValue = False
+	for flag in flags:
+		if expectValue:
+			if not _SEPARATE_VALUE.match( flag ):
+				return flag
+			expectValue = False
+		elif flag in _SEPARATE_VALUE_FLAGS:
+			expectValue = True
+		elif flag not in _ALLOWED_FLAGS and not flag.startswith( _ALLOWED_FLAG_PREFIXES ):
+			return flag
+		elif flag.startswith( _REFUSED_FLAG_PREFIXES ):
+			return flag
+		elif any( _isOutsideDirectory( value ) for value in re.split( "[=,]", flag )[1:] ):
+			return flag
+	if expectValue:
+		return flags[-1]
+	return None
+
+
+def _checkJob( job, compilers ):
+	"""
+	:return: Why the worker won't run a compile, or None if it will
+	:rtype: str
+	"""
+	flags = job["flags"]
+	if not isinstance( flags, list ) or not all( isinstance( flag, type( u"" ) ) for flag in flags ):
+		return "its flags are not a list of strings"
+	if job["compiler"] not in compilers:
+		return "{} is not a compiler it runs".format( job["compiler"] )
+	refused = FindRefusedFlag( flags )
+	if refused is not None:
+		return "it doesn't run compiles with {}".format( refused )
+	if not _isPlainFileName( job["input"] ) or not _isPlainFileName( job["output"] ):
+		return "{} and {} are not plain file names".format( job["input"], job["output"] )
+	return None
+
+
+def _compile( job, source, tempRoot ):
+	"""
+	:return: Return code, stdout, stderr, and the object file's contents (empty if there isn't one)
+	:rtype: tuple[int, bytes, bytes, bytes]
+	"""
+	inputName = job["input"]
+	outputName = job["output"]
+	cmd = [ job["compiler"] ] + job["flags"] + [ "-c", "-o", outputName, inputName ]
+
+	directory = tempfile.mkdtemp( prefix = "csbuild-worker-", dir = tempRoot )
+	try:
+		with open( os.path.join( directory, inputName ), "wb" ) as f:
+			f.write( source )
+
+		try:
+			fd = subprocess.Popen( cmd, stdout = subprocess.PIPE, stderr = subprocess.PIPE, cwd = directory )
+		except OSError as e:
+			return 1, b"", "Could not run {}: {}\n".format( cmd[0], e ).encode( "utf-8" ), b""
+		out, errors = fd.communicate( )
+
+		obj = b""
+		outputPath = os.path.join( directory, outputName )
+		if fd.returncode == 0 and os.path.exists( outputPath ):
+			with open( outputPath, "rb" ) as f:
+				obj = f.read( )
+		return fd.returncode, out, errors, obj
+	finally:
+		shutil.rmtree( directory, ignore_errors = True )
+
+
+def _serveConnection( sock, address, jobs, numJobs, tempRoot, token, compilers ):
+	try:
+		challenge = hashlib.sha256( os.urandom( 32 ) ).hexdigest( )
+		SendJson( sock, HELLO, { "version": PROTOCOL_VERSION, "challenge": challenge } )
+		response = RecvJson( sock, AUTH )["response"].encode( "utf-8" )
+		if not hmac.compare_digest( response, GetAuthResponse( token, challenge ).encode( "utf-8" ) ):
+			sys.stderr.write( "Rejected connection from {}: wrong token\n".format( address[0] ) )
+			return
+		SendJson( sock, WELCOME, { "jobs": numJobs } )
+
+		while True:
+			try:
+				job = RecvJson( sock, JOB )
+			except EOFError:
+				return
+			source = zlib.decompress( RecvFrame( sock, SOURCE ) )
+
+			#A compile the worker won't run is refused rather than failed, so the build can compile the file itself and
+			#keep using the connection for others.
+			rejected = _checkJob( job, compilers )
+			if rejected is None:
+				with jobs:
+					returncode, out, errors, obj = _compile( job, source, tempRoot )
+			else:
+				returncode, out, errors, obj = 1, b"", b"", b""
+
+			SendJson( sock, RESULT, { "returncode": returncode, "rejected": rejected } )
+			SendFrame( sock, STDOUT, out )
+			SendFrame( sock, STDERR, errors )
+			SendFrame( sock, OBJECT, zlib.compress( obj, 1 ) )
+	except (socket.error, EOFError, ValueError, KeyError, TypeError, AttributeError, zlib.error) as e:
+		sys.stderr.write( "Dropped connection from {}: {}\n".format( address[0], e ) )
+	finally:
+		sock.close( )
+
+
+def Serve( host, port, numJobs, token, compilers, tempRoot = None ):
+	"""
+	Take compiles from any number of connections until interrupted.
+
+	:param host: Address to listen on
+	:type host: str
+
+	:param port: Port to listen on
+	:type port: int
+
+	:param numJobs: Most compiles to run at once
+	:type numJobs: int
+
+	:param token: Token builds have to prove they know before they can send compiles
+	:type token: str
+
+	:param compilers: The only compilers builds can run, exactly as they give them
+	:type compilers: set[str]
+
+	:param tempRoot: Directory to compile in, or None for the system's temporary directory
+	:type tempRoot: str
+	"""
+	jobs = threading.BoundedSemaphore( numJobs )
+	listener = socket.socket( socket.AF_INET, socket.SOCK_STREAM )
+	listener.setsockopt( socket.SOL_SOCKET, socket.SO_REUSEADDR, 1 )
+	listener.bind( ( host, port ) )
+	listener.listen( 64 )
+
+	sys.stdout.write( "csbuild worker listening on {}:{} with {} job{}, running {}\n".format(
+		host, listener.getsockname( )[1], numJobs, "" if numJobs == 1 else "s", ", ".join( sorted( compilers ) ) ) )
+	sys.stdout.flush( )
+
+	try:
+		while True:
+			sock, address = listener.accept( )
+			sock.setsockopt( socket.IPPROTO_TCP, socket.TCP_NODELAY, 1 )
+			thread = threading.Thread( target = _serveConnection, args = ( sock, address, jobs, numJobs, tempRoot, token, compilers ) )
+			thread.daemon = True
+			thread.start( )
+	finally:
+		listener.close( )
+
+
+def Main( argv ):
+	"""
+	Run a worker from the command line.
+
+	:param argv: Command line arguments, not including the program name
+	:type argv: list[str]
+
+	:return: Exit code
+	:rtype: int
+	"""
+	parser = argparse.ArgumentParser( prog = "csbuild-worker", description = "Compile files for csbuild builds on other machines." )
+	parser.add_argument( "--host", default = "127.0.0.1",
+		help = "Address to listen on. Use 0.0.0.0 to take compiles from other machines; anyone who has the token can "
+		"run the allowed compilers as this user." )
+	parser.add_argument( "--port", type = int, default = DEFAULT_PORT, help = "Port to listen on." )
+	parser.add_argument( "-j", "--jobs", type = int, default = multiprocessing.cpu_count( ),
+		help = "Number of compiles to run at once. Defaults to the number of CPUs." )
+	parser.add_argument( "--compiler", metavar = "COMMAND", action = "append", required = True,
+		help = "Compiler builds can run, exactly as they run it (e.g. g++ or /usr/bin/clang). Can be given more than "
+		"once; nothing else is run, and only with flags that don't load plugins, run other programs or name files "
+		"outside the compile's temporary directory." )
+	parser.add_argument( "--token-file", metavar = "FILE",
+		help = "File holding the token builds have to know to send compiles. Defaults to the {} environment "
+		"variable, one of which is required.".format( TOKEN_VARIABLE ) )
+	parser.add_argument( "--temp-dir", help = "Directory to compile in." )
+	workerArgs = parser.parse_args( argv )
+
+	if workerArgs.token_file:
+		try:
+			with open( workerArgs.token_file, "r" ) as f:
+				token = f.read( ).strip( )
+		except (IOError, OSError) as e:
+			sys.stderr.write( "Could not read {}: {}\n".format( workerArgs.token_file, e ) )
+			return 1
+	else:
+		token = os.environ.get( TOKEN_VARIABLE, "" ).strip( )
+	if not token:
+		sys.stderr.write( "No token given. Set {} or use --token-file.\n".format( TOKEN_VARIABLE ) )
+		return 1
+
+	try:
+		Serve( workerArgs.host, workerArgs.port, max( 1, workerArgs.jobs ), token, set( workerArgs.compiler ),
+			workerArgs.temp_dir )
+	except KeyboardInterrupt:
+		pass
+	except socket.error as e:
+		sys.stderr.write( "Could not listen on {}:{}: {}\n".format( workerArgs.host, workerArgs.port, e ) )
+		return 1
+	return 0
+
+
+if __name__ == "__main__":
+	sys.exit( Main( sys.argv[1:] ) )
@@ -0,0 +1,271 @@
+# Copyright (C) 2013 Jaedyn K. Draper
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Content hash database.
+
+Hashes, fingerprints, object hashes and compile and link timings from the last build, kept in a single append-only log
+under .csbuild/cache.
+"""
+
+import os
+import struct
+import sys
+import threading
+import time
+import zlib
+from multiprocessing.pool import ThreadPool
+
+if sys.version_info >= (3,0):
+	import pickle
+else:
+	import cPickle as pickle
+
+import csbuild
+from . import log
+from . import _shared_globals
+from . import _stat_cache
+
+_MAGIC = b"CSBHASHDB1\n"
+_BATCH_HEADER = struct.Struct( "<II" )
+_MIN_COMPACT_RECORDS = 1024
+_RACY_TIMESTAMP_WINDOW = 2.0
+
+_lock = threading.Lock( )
+
+_records = { }
+_pending = { }
+_logRecordCount = 0
+_needsCompaction = True
+
+
+def _getDatabaseFile( ):
+	return os.path.join( _shared_globals.cacheDirectory, "hashes.csbdb" )
+
+
+def _packBatch( items ):
+	payload = pickle.dumps( items, 2 )
+	return _BATCH_HEADER.pack( len( payload ), zlib.crc32( payload ) & 0xffffffff ) + payload
+
+
+def Load( ):
+	"""
+	Read the hash database from disk. Any partially written batch at the end of the log is discarded.
+	"""
+	global _logRecordCount
+	global _needsCompaction
+
+	with _lock:
+		_records.clear( )
+		_pending.clear( )
+	_logRecordCount = 0
+	_needsCompaction = True
+
+	dbFile = _getDatabaseFile( )
+	if not os.access( dbFile, os.F_OK ):
+		return
+
+	try:
+		with open( dbFile, "rb" ) as f:
+			data = f.read( )
+	except IOError as e:
+		log.LOG_WARN( "Could not read hash database {}: {}".format( dbFile, e ) )
+		return
+
+	if not data.startswith( _MAGIC ):
+		log.LOG_WARN( "Hash database {} is not in a recognized format and will be rebuilt.".format( dbFile ) )
+		return
+
+	offset = len( _MAGIC )
+	count = 0
+	while offset < len( data ):
+		if offset + _BATCH_HEADER.size > len( data ):
+			break
+		length, checksum = _BATCH_HEADER.unpack_from( data, offset )
+		start = offset + _BATCH_HEADER.size
+		payload = data[start:start + length]
+		if len( payload ) != length or zlib.crc32( payload ) & 0xffffffff != checksum:
+			break
+
+		try:
+			items = pickle.loads( payload )
+		except Exception as e:
+			#Written by a different version of python, most likely.
+			log.LOG_WARN( "Hash database {} could not be read ({}) and will be rebuilt.".format( dbFile, e ) )
+			with _lock:
+				_records.clear( )
+			_logRecordCount = 0
+			_needsCompaction = True
+			return
+
+		for key, value in items:
+			if value is None:
+				_records.pop( key, None )
+			else:
+				_records[key] = value
+			count += 1
+
+		offset = start + length
+
+	_logRecordCount = count
+	if offset < len( data ):
+		log.LOG_WARN( "Discarding incomplete records at the end of hash database {}.".format( dbFile ) )
+		#Anything appended after the damaged batch would never be read back, so the log has to be rewritten.
+		_needsCompaction = True
+	else:
+		_needsCompaction = False
+
+
+def Save( ):
+	"""
+	Write any changed records back to disk.
+	"""
+	global _logRecordCount
+	global _needsCompaction
+
+	with _lock:
+		if not _pending:
+			return
+
+		dbFile = _getDatabaseFile( )
+		if _needsCompaction or not os.access( dbFile, os.F_OK ) or \
+				_logRecordCount + len( _pending ) > max( _MIN_COMPACT_RECORDS, 2 * len( _records ) ):
+			try:
+				csbuild._utils.WriteFileAtomic( dbFile, _MAGIC + _packBatch( list( _records.items( ) ) ) )
+			except (IOError, OSError) as e:
+				log.LOG_WARN( "Could not write hash database {}: {}".format( dbFile, e ) )
+				return
+			_logRecordCount = len( _records )
+			_needsCompaction = False
+		else:
+			try:
+				with open( dbFile, "ab" ) as f:
+					f.write( _packBatch( list( _pending.items( ) ) ) )
+			except (IOError, OSError) as e:
+				log.LOG_WARN( "Could not write hash database {}: {}".format( dbFile, e ) )
+				_needsCompaction = True
+				return
+			_logRecordCount += len( _pending )
+
+		_pending.clear( )
+
+
+def Get( key ):
+	"""
+	Get a record from the database.
+
+	:param key: Key of the record
+	:type key: tuple
+
+	:return: The recorded value, or None if there isn't one
+	"""
+	return _records.get( key )
+
+
+def Set( key, value ):
+	"""
+	Set a record in the database. It's only queued to be written if the value has actually changed.
+
+	:param key: Key of the record
+	:type key: tuple
+
+	:param value: New value, or None to remove the record
+	"""
+	with _lock:
+		if _records.get( key ) == value:
+			return
+		if value is None:
+			del _records[key]
+		else:
+			_records[key] = value
+		_pending[key] = value
+
+
+def GetFileHash( path ):
+	"""
+	Get the fingerprint of the current contents of a file. Each file is only looked at once per build.
+
+	If the file's size and modification time match the ones recorded the last time it was fingerprinted, the recorded
+	fingerprint is reused without reading the file at all.
+
+	:param path: Path to the file
+	:type path: str
+
+	:return: The file's fingerprint
+	:rtype: bytes
+	"""
+	try:
+		return _shared_globals.newmd5s[path]
+	except KeyError:
+		pass
+
+	st = _stat_cache.Stat( path )
+	if st is None:
+		raise OSError( 2, "No such file or directory", path )
+	signature = _stat_cache.GetSignature( st )
+	record = _records.get( ( "fingerprint", path ) )
+
+	if record is not None and record[0] == signature:
+		newmd5 = record[1]
+	else:
+		newmd5 = csbuild._utils.GetFileFingerprint( path )
+		#A file modified again within the filesystem's timestamp granularity would keep the same signature, so
+		#don't trust the signature of anything that was modified too recently to tell.
+		if time.time( ) - st.st_mtime > _RACY_TIMESTAMP_WINDOW:
+			Set( ( "fingerprint", path ), ( signature, newmd5 ) )
+
+	_shared_globals.newmd5s[path] = newmd5
+	return newmd5
+
+
+def _hashFileNoRaise( path ):
+	try:
+		GetFileHash( path )
+	except (IOError, OSError):
+		pass
+
+
+def PrefetchFileHashes( paths ):
+	"""
+	Hash a group of files in parallel, so that later calls to GetFileHash() for them are simple lookups.
+	Files that can't be read are skipped, and will raise when they're actually requested.
+
+	:param paths: Files to hash
+	:type paths: iterable[str]
+	"""
+	paths = [ path for path in set( paths ) if path not in _shared_globals.newmd5s ]
+	if not paths:
+		return
+
+	numThreads = min( _shared_globals.max_threads, len( paths ) )
+	if numThreads <= 1:
+		for path in paths:
+			_hashFileNoRaise( path )
+		return
+
+	#Threads rather than processes: on network filesystems the time goes to waiting on stat and read calls, which
+	#don't hold the GIL, and a process pool would have to re-import (and so re-run) the makefile on some platforms.
+	pool = ThreadPool( numThreads )
+	try:
+		for _ in pool.imap_unordered( _hashFileNoRaise, paths, max( 1, len( paths ) // ( numThreads * 4 ) ) ):
+			pass
+	finally:
+		pool.close( )
+		pool.join( )
@@ -0,0 +1,646 @@
+# Copyright (C) 2013 Jaedyn K. Draper
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Persistent include graph cache.
+
+Keeps each scanned file's direct includes, the transitive header sets, and the dependencies the compiler reported for
+each object, and drops whatever a changed file or a changed include directory could have affected when it's loaded.
+"""
+
+import os
+import sys
+import threading
+import time
+
+if sys.version_info >= (3,0):
+	import pickle
+else:
+	import cPickle as pickle
+
+import csbuild
+from . import log
+from . import _shared_globals
+from . import _stat_cache
+from . import _include_resolver
+
+_CACHE_VERSION = 6
+#A dependency modified again within its timestamp granularity would keep the same stamp, so dependencies modified this
+#recently are recorded with a stamp that never matches.
+_RACY_TIMESTAMP_WINDOW = 2.0
+_RACY_STAMP = ( -1, -1, -1 )
+
+_lock = threading.Lock( )
+
+_stamps = { }
+_includes = { }
+_directives = { }
+#( configuration, source file ) -> set of headers found by the conditional include scanner
+_configurationHeaders = { }
+_objectDeps = { }
+#Objects whose recorded dependencies predate a change to one of the directories searched for includes
+_unresolvedObjects = set( )
+#Directory -> ( signature, frozenset of normcase'd names ), as returned by _include_resolver.GetDirectoryStates()
+_directories = { }
+#Object -> ( project key, file compiled, seconds the compile took )
+_objectInfo = { }
+#Dependency -> stamp when it was last checked, and the validation in which that stamp last changed
+_dependencyStamps = { }
+_dependencyChanges = { }
+#Object -> the validation in which it was last built or found to be up to date
+_checkedObjects = { }
+#Number of times the cache has been validated
+_validation = 0
+#Dependency -> set of objects that depend on it. Built from _objectDeps when the cache is loaded.
+_dependents = { }
+#( validation, dependency ) for every entry in _dependencyChanges, most recent first
+_recentChanges = [ ]
+_dirty = False
+_settingsSignature = None
+
+
+def _getCacheFile( ):
+	return os.path.join( _shared_globals.cacheDirectory, "header_info.csbc" )
+
+
+def GetStamp( path ):
+	"""
+	Get the stamp used to validate a cached entry.
+
+	:param path: Path to the file
+	:type path: str
+
+	:return: (mtime, size, inode) tuple, or None if the file can't be stat'ed
+	:rtype: tuple or None
+	"""
+	st = _stat_cache.Stat( path )
+	if st is None:
+		return None
+	return ( st.st_mtime, st.st_size, st.st_ino )
+
+
+def GetSettingsSignature( projects ):
+	"""
+	Build a signature of every project setting that affects how include directives are resolved into paths.
+	If this changes between runs, the resolved transitive sets are discarded (the raw include lists are kept).
+
+	:param projects: Projects being built
+	:type projects: list[csbuild.projectSettings.projectSettings]
+
+	:rtype: list
+	"""
+	signature = set( )
+	for project in projects:
+		signature.add(
+			(
+				project.workingDirectory,
+				tuple( project.includeDirs ),
+				project.ignoreExternalHeaders,
+				project.headerRecursionDepth,
+			)
+		)
+	return sorted( signature )
+
+
+def Load( settingsSignature ):
+	"""
+	Load the include graph cache from disk into _shared_globals.allheaders and validate it.
+
+	:param settingsSignature: Value returned by GetSettingsSignature() for the current build
+	:type settingsSignature: list
+	"""
+	global _stamps
+	global _includes
+	global _directives
+	global _configurationHeaders
+	global _objectDeps
+	global _directories
+	global _objectInfo
+	global _dependencyStamps
+	global _dependencyChanges
+	global _checkedObjects
+	global _validation
+	global _dirty
+	global _settingsSignature
+
+	_settingsSignature = settingsSignature
+	_stamps = { }
+	_includes = { }
+	_directives = { }
+	_configurationHeaders = { }
+	_objectDeps = { }
+	_unresolvedObjects.clear( )
+	_directories = { }
+	_objectInfo = { }
+	_dependencyStamps = { }
+	_dependencyChanges = { }
+	_checkedObjects = { }
+	_validation = 0
+	_dependents.clear( )
+	_dirty = False
+	_shared_globals.allheaders = { }
+
+	cacheFile = _getCacheFile( )
+	if not os.access( cacheFile, os.F_OK ):
+		return
+
+	try:
+		with open( cacheFile, "rb" ) as f:
+			data = pickle.load( f )
+	except Exception as e:
+		log.LOG_WARN( "Could not read header cache {}: {}".format( cacheFile, e ) )
+		return
+
+	if not isinstance( data, dict ) or data.get( "version" ) != _CACHE_VERSION:
+		return
+
+	allheaders = data["allheaders"]
+
+	if data["settings"] != settingsSignature:
+		log.LOG_INFO( "Include settings have changed, discarding cached header dependency sets." )
+		allheaders = { }
+		_dirty = True
+
+	_stamps = data["stamps"]
+	_includes = data["includes"]
+	_directives = data["directives"]
+	_configurationHeaders = data["configurations"]
+	_objectDeps = data["objects"]
+	_directories = data["directories"]
+	_unresolvedObjects.update( data["unresolved"] )
+	_objectInfo = data["objectInfo"]
+	_dependencyStamps = data["dependencyStamps"]
+	_dependencyChanges = data["dependencyChanges"]
+	_checkedObjects = data["checkedObjects"]
+	_validation = data["validation"]
+	_shared_globals.allheaders = allheaders
+
+	for obj, ( _, dependencies ) in _objectDeps.items( ):
+		for dependency in dependencies:
+			_dependents.setdefault( dependency, set( ) ).add( obj )
+
+	Revalidate( )
+
+
+def Revalidate( ):
+	"""
+	Check every file in the loaded cache against the filesystem, dropping the entries for any that have changed along
+	with every transitive set that contains them. Load() does this itself; it only needs calling separately when the
+	cache has been held in memory while files may have been changing.
+	"""
+	global _dirty
+	global _validation
+	global _recentChanges
+
+	#Adding, removing or renaming a file in any directory that was searched for includes can change what the includes by
+	#that name resolve to, so the sets and the compilers' dependency lists involving them have to be worked out again.
+	#The include lists of each file are still good, and the old dependency lists are kept to tell which objects now
+	#resolve differently. Objects stay marked until they're rebuilt or checked, even if that's not until a later run.
+	changedNames = set( )
+	for directory, ( signature, names ) in list( _directories.items( ) ):
+		st = _stat_cache.Stat( directory )
+		newSignature = _stat_cache.GetSignature( st ) if st is not None else None
+		if newSignature == signature:
+			continue
+		newNames = None
+		if st is not None:
+			try:
+				newNames = frozenset( os.path.normcase( name ) for name in os.listdir( directory ) )
+			except OSError:
+				newSignature = None
+		if newNames != names:
+			log.LOG_INFO( "Contents of {} have changed, discarding the cached header dependency sets affected.".format( directory ) )
+			changedNames.update( ( names or frozenset( ) ) ^ ( newNames or frozenset( ) ) )
+		_directories[directory] = ( newSignature, newNames )
+		_dirty = True
+
+	if changedNames:
+		_invalidateIncludesOf( changedNames )
+	changed = set( )
+	for path, stamp in _stamps.items( ):
+		if GetStamp( path ) != stamp:
+			changed.add( path )
+
+	for path in changed:
+		log.LOG_INFO( "Header cache entry for {} is out of date.".format( path ) )
+		del _stamps[path]
+		_includes.pop( path, None )
+		_directives.pop( path, None )
+
+	if changed:
+		_dirty = True
+		allheaders = _shared_globals.allheaders
+		for path in list( allheaders.keys( ) ):
+			headers = allheaders[path]
+			if path in changed or path not in _stamps or not changed.isdisjoint( headers ):
+				del allheaders[path]
+		for key in list( _configurationHeaders.keys( ) ):
+			if key[1] not in _stamps or not changed.isdisjoint( _configurationHeaders[key] ):
+				del _configurationHeaders[key]
+
+	#Nothing refers to this validation until something changes, so it only needs saving if something does.
+	_validation += 1
+	now = time.time( )
+	for dependency, stamp in _dependencyStamps.items( ):
+		newStamp = GetStamp( dependency )
+		if newStamp != stamp:
+			_dependencyStamps[dependency] = _getDependencyStamp( newStamp, now )
+			_dependencyChanges[dependency] = _validation
+			_dirty = True
+	_recentChanges = sorted( ( ( validation, dependency ) for dependency, validation in _dependencyChanges.items( ) ), reverse = True )
+
+	log.LOG_INFO( "Checked header cache: {} files, {} invalidated.".format( len( _stamps ) + len( changed ), len( changed ) ) )
+
+
+def _includesAny( path, names ):
+	includes = _includes.get( path )
+	if includes is None:
+		directives = _directives.get( path )
+		if directives is None:
+			return False
+		includes = [ ]
+		for directive, argument in directives[1]:
+			if directive in ( "include", "include_next", "import" ):
+				if argument[:1] not in ( '"', "<" ):
+					#A computed include could be anything.
+					return True
+				includes.append( argument[1:-1] )
+	for include in includes:
+		if os.path.normcase( os.path.basename( include ) ) in names:
+			return True
+	return False
+
+
+def _invalidateIncludesOf( names ):
+	"""
+	Drop everything that involves a file including something by one of the given names.
+
+	:param names: File names that have been added to or removed from a directory searched for includes
+	:type names: set[str]
+	"""
+	affected = set( path for path in set( _includes ) | set( _directives ) if _includesAny( path, names ) )
+
+	allheaders = _shared_globals.allheaders
+	for path in list( allheaders.keys( ) ):
+		if path in affected or not affected.isdisjoint( allheaders[path] ):
+			del allheaders[path]
+	for key in list( _configurationHeaders.keys( ) ):
+		if key[1] in affected or not affected.isdisjoint( _configurationHeaders[key] ):
+			del _configurationHeaders[key]
+
+	#The compiler's dependency lists can name files that have never been scanned, which could include anything.
+	for obj, ( _, dependencies ) in _objectDeps.items( ):
+		for dependency in dependencies:
+			if dependency in affected or ( dependency not in _includes and dependency not in _directives ):
+				_unresolvedObjects.add( obj )
+				break
+
+
+def Save( ):
+	"""
+	Write the include graph cache back to disk, if anything has changed since it was loaded.
+	"""
+	global _dirty
+
+	with _lock:
+		directories = _include_resolver.GetDirectoryStates( )
+		if not _dirty and all( _directories.get( directory ) == state for directory, state in directories.items( ) ):
+			return
+		_directories.update( directories )
+
+		#Changes older than the last check of every object will never be looked at again, and neither will
+		#dependencies nothing depends on anymore.
+		oldestCheck = min( _checkedObjects.values( ) ) if _checkedObjects else _validation
+		for dependency in list( _dependencyStamps.keys( ) ):
+			if dependency not in _dependents:
+				del _dependencyStamps[dependency]
+				_dependencyChanges.pop( dependency, None )
+			elif _dependencyChanges.get( dependency, oldestCheck ) <= oldestCheck:
+				_dependencyChanges.pop( dependency, None )
+
+		data = {
+			"version": _CACHE_VERSION,
+			"settings": _settingsSignature,
+			"stamps": _stamps,
+			"includes": _includes,
+			"directives": _directives,
+			"configurations": _configurationHeaders,
+			"objects": _objectDeps,
+			"directories": _directories,
+			"unresolved": _unresolvedObjects,
+			"objectInfo": _objectInfo,
+			"dependencyStamps": _dependencyStamps,
+			"dependencyChanges": _dependencyChanges,
+			"checkedObjects": _checkedObjects,
+			"validation": _validation,
+			#Only keep transitive sets whose root we have a stamp for, otherwise they can never be validated.
+			"allheaders": dict( ( path, headers ) for path, headers in _shared_globals.allheaders.items( ) if path in _stamps ),
+		}
+
+		try:
+			csbuild._utils.WriteFileAtomic( _getCacheFile( ), pickle.dumps( data, 2 ) )
+		except Exception as e:
+			log.LOG_WARN( "Could not write header cache: {}".format( e ) )
+			return
+
+		_dirty = False
+
+
+def IsTracked( path ):
+	"""
+	:param path: Full path to a file
+	:type path: str
+
+	:return: Whether the file has been scanned for includes, i.e., whether it's a source or header some build uses
+	:rtype: bool
+	"""
+	return path in _stamps
+
+
+def GetIncludedFiles( path, scanner ):
+	"""
+	Get the list of files directly included by a file, scanning it only if there's no valid cached result.
+
+	:param path: Full path to the file
+	:type path: str
+
+	:param scanner: Function that scans the file and returns the list of includes
+	:type scanner: function
+
+	:return: List of include directives, as written in the file
+	:rtype: list[str]
+	"""
+	global _dirty
+
+	if path in _includes:
+		return _includes[path]
+
+	stamp = GetStamp( path )
+	headers = scanner( path )
+
+	with _lock:
+		if stamp is not None:
+			_stamps[path] = stamp
+		_includes[path] = headers
+		_dirty = True
+
+	return headers
+
+
+def GetDirectives( path, scanner ):
+	"""
+	Get the preprocessing directives in a file, scanning it only if there's no valid cached result.
+
+	:param path: Full path to the file
+	:type path: str
+
+	:param scanner: Function that scans the file and returns its directives
+	:type scanner: function
+
+	:return: Value returned by the scanner
+	"""
+	global _dirty
+
+	if path in _directives:
+		return _directives[path]
+
+	stamp = GetStamp( path )
+	directives = scanner( path )
+
+	with _lock:
+		if stamp is not None:
+			_stamps[path] = stamp
+		_directives[path] = directives
+		_dirty = True
+
+	return directives
+
+
+def GetConfigurationHeaders( configuration, path ):
+	"""
+	Get the headers the conditional include scanner found for a source file in a given configuration.
+
+	:param configuration: Key identifying the configuration
+	:type configuration: str
+
+	:param path: Full path to the source file
+	:type path: str
+
+	:return: Full paths of the headers, or None if there's no valid cached result
+	:rtype: frozenset[str] or None
+	"""
+	return _configurationHeaders.get( ( configuration, path ) )
+
+
+def SetConfigurationHeaders( configuration, path, headers ):
+	"""
+	Record the headers the conditional include scanner found for a source file in a given configuration. Every file
+	involved must have been read through GetDirectives(), so that the result is dropped when any of them changes.
+
+	:param configuration: Key identifying the configuration
+	:type configuration: str
+
+	:param path: Full path to the source file
+	:type path: str
+
+	:param headers: Full paths of the headers
+	:type headers: set[str]
+	"""
+	global _dirty
+
+	with _lock:
+		_configurationHeaders[( configuration, path )] = frozenset( headers )
+		_dirty = True
+
+
+def _getDependencyStamp( stamp, readTime ):
+	if stamp is not None and stamp[0] >= readTime - _RACY_TIMESTAMP_WINDOW:
+		return _RACY_STAMP
+	return stamp
+
+
+def SetObjectDependencies( obj, dependencies, projectKey, sourceFile, duration ):
+	"""
+	Record the files a freshly built object file depends on, as reported by the compiler.
+
+	:param obj: Path to the object file
+	:type obj: str
+
+	:param dependencies: Full paths of every file the object was built from
+	:type dependencies: list[str]
+
+	:param projectKey: Key of the project the object was built for
+	:type projectKey: str
+
+	:param sourceFile: The file that was compiled
+	:type sourceFile: str
+
+	:param duration: Time the compile took, in seconds
+	:type duration: float
+	"""
+	global _dirty
+
+	obj = os.path.abspath( obj )
+	stamp = GetStamp( obj )
+	#The compiler may have read any of them as soon as it started.
+	startTime = time.time( ) - duration
+	dependencyStamps = [ ( dependency, _getDependencyStamp( GetStamp( dependency ), startTime ) ) for dependency in dependencies ]
+
+	with _lock:
+		entry = _objectDeps.pop( obj, None )
+		if entry is not None:
+			for dependency in entry[1]:
+				dependents = _dependents.get( dependency )
+				if dependents is not None:
+					dependents.discard( obj )
+					if not dependents:
+						del _dependents[dependency]
+
+		if stamp is None:
+			_objectInfo.pop( obj, None )
+			_checkedObjects.pop( obj, None )
+		else:
+			_objectDeps[obj] = ( stamp, dependencies )
+			_objectInfo[obj] = ( projectKey, sourceFile, duration )
+			_checkedObjects[obj] = _validation
+			for dependency, dependencyStamp in dependencyStamps:
+				_dependents.setdefault( dependency, set( ) ).add( obj )
+				if dependency not in _dependencyStamps:
+					_dependencyStamps[dependency] = dependencyStamp
+		_unresolvedObjects.discard( obj )
+		_dirty = True
+
+
+def GetObjectDependencies( obj ):
+	"""
+	Get the dependencies the compiler reported the last time an object file was built.
+
+	:param obj: Path to the object file
+	:type obj: str
+
+	:return: Full paths of every file the object was built from, or None if they aren't known for the object as it
+	currently exists on disk, or if includes may resolve differently now than when it was built
+	:rtype: list[str] or None
+	"""
+	obj = os.path.abspath( obj )
+	if obj in _unresolvedObjects:
+		return None
+
+	entry = _objectDeps.get( obj )
+	if entry is None:
+		return None
+
+	stamp, dependencies = entry
+	if GetStamp( obj ) != stamp:
+		return None
+
+	return dependencies
+
+
+def ConfirmObjectDependencies( obj ):
+	"""
+	Record that the includes of an object file still resolve to the dependencies that were recorded for it, after a
+	change to one of the directories they're searched in.
+
+	:param obj: Path to the object file
+	:type obj: str
+	"""
+	global _dirty
+
+	obj = os.path.abspath( obj )
+	with _lock:
+		if obj in _unresolvedObjects:
+			_unresolvedObjects.discard( obj )
+			_dirty = True
+
+
+def GetChangedDependencies( obj ):
+	"""
+	Get the dependencies of an object file that have changed since it was last built or found to be up to date.
+
+	:param obj: Path to the object file, which GetObjectDependencies() must have returned a list for
+	:type obj: str
+
+	:return: Full paths of the dependencies that may have changed
+	:rtype: list[str]
+	"""
+	obj = os.path.abspath( obj )
+	checked = _checkedObjects.get( obj )
+	if checked is None:
+		return list( _objectDeps[obj][1] )
+
+	changed = [ ]
+	for validation, dependency in _recentChanges:
+		if validation <= checked:
+			break
+		if obj in _dependents.get( dependency, ( ) ):
+			changed.append( dependency )
+	return changed
+
+
+def MarkObjectUpToDate( obj ):
+	"""
+	Record that an object file has been checked against all of its dependencies and found to be up to date, so that
+	only dependencies that change from here on are checked next time.
+
+	:param obj: Path to the object file
+	:type obj: str
+	"""
+	global _dirty
+
+	obj = os.path.abspath( obj )
+	with _lock:
+		if obj in _objectDeps and _checkedObjects.get( obj ) != _validation:
+			_checkedObjects[obj] = _validation
+			_dirty = True
+
+
+def GetDependents( path ):
+	"""
+	Get every object file that was built from a given file the last time it was built.
+
+	:param path: Full path to the file
+	:type path: str
+
+	:return: List of ( object file, project key, file compiled, seconds the compile took ) tuples
+	:rtype: list[tuple[str, str, str, float]]
+	"""
+	ret = [ ]
+	for obj in _dependents.get( path, ( ) ):
+		projectKey, sourceFile, duration = _objectInfo.get( obj, ( None, None, None ) )
+		ret.append( ( obj, projectKey, sourceFile, duration ) )
+	return ret
+
+
+def GetRecordedDependencies( obj ):
+	"""
+	Get the dependencies recorded for an object file without checking that they're still current. This is only
+	suitable for things like prefetching, where a stale answer costs time rather than correctness, or for comparing
+	with the headers an object's includes resolve to now.
+
+	:param obj: Path to the object file
+	:type obj: str
+
+	:rtype: list[str] or None
+	"""
+	entry = _objectDeps.get( os.path.abspath( obj ) )
+	if entry is None:
+		return None
+	return entry[1]
@@ -0,0 +1,276 @@
+# Copyright (C) 2013 Jaedyn K. Draper
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Include path resolver.
+
+Resolves #include directives to files, the way the compiler would: relative to the working directory, then to the
+directory of the including file, then through each include directory in turn.
+
+Rather than probing each candidate path, every directory involved is listed once and kept as an index of the names in
+it, so a lookup is a set membership test per include directory, and a header that isn't found anywhere costs no more
+than one that is. The result of every lookup, including the misses, is remembered for the rest of the run, per search
+path. The directory indexes are also saved to .csbuild/cache along with each directory's modification time, and on the
+next run an index is only reused if the directory's modification time hasn't changed, i.e., nothing has been added to,
+removed from or renamed within it.
+
+Everything is forgotten whenever the stat cache is cleared, as that means a build step may have changed anything.
+"""
+
+import os
+import sys
+import threading
+import time
+
+if sys.version_info >= (3,0):
+	import pickle
+else:
+	import cPickle as pickle
+
+import csbuild
+from . import log
+from . import _shared_globals
+from . import _stat_cache
+
+_INDEX_VERSION = 1
+#A directory changed again within its timestamp granularity would keep the same timestamp, so indexes of directories
+#modified this recently are used for the current run but not saved.
+_RACY_TIMESTAMP_WINDOW = 2.0
+_RACY_SIGNATURE = ( -1, -1 )
+
+_lock = threading.Lock( )
+
+#Directory -> ( signature, frozenset of normcase'd names ) as loaded from, or to be saved to, disk
+_indexes = { }
+#Directory -> ( signature, frozenset of normcase'd names ) for directories checked in the current generation of the stat
+#cache. Both are None if the directory doesn't exist.
+_validIndexes = { }
+#Directory -> ( signature, frozenset of normcase'd names ) for every directory checked since Load(), kept across
+#generations
+_consultedDirectories = { }
+#( cwd, relative directory, header ) -> path found relative to either directory, or "" if there wasn't one
+_localResults = { }
+#( include directories, header ) -> path found through the include directories, or "" if there wasn't one
+_searchResults = { }
+_generation = None
+_dirty = False
+
+
+def _getIndexFile( ):
+	return os.path.join( _shared_globals.cacheDirectory, "include_index.csbc" )
+
+
+def Load( ):
+	"""
+	Load the directory indexes saved by the last build.
+	"""
+	global _indexes
+	global _dirty
+	global _generation
+
+	with _lock:
+		_indexes = { }
+		_validIndexes.clear( )
+		_consultedDirectories.clear( )
+		_localResults.clear( )
+		_searchResults.clear( )
+		_generation = None
+		_dirty = False
+
+	indexFile = _getIndexFile( )
+	if not os.access( indexFile, os.F_OK ):
+		return
+
+	try:
+		with open( indexFile, "rb" ) as f:
+			data = pickle.load( f )
+	except Exception as e:
+		log.LOG_WARN( "Could not read include index {}: {}".format( indexFile, e ) )
+		return
+
+	if isinstance( data, dict ) and data.get( "version" ) == _INDEX_VERSION:
+		_indexes = data["indexes"]
+
+
+def Save( ):
+	"""
+	Write the directory indexes back to disk, if any have changed since they were loaded.
+	"""
+	global _dirty
+
+	with _lock:
+		if not _dirty:
+			return
+
+		data = {
+			"version": _INDEX_VERSION,
+			"indexes": _indexes,
+		}
+		try:
+			csbuild._utils.WriteFileAtomic( _getIndexFile( ), pickle.dumps( data, 2 ) )
+		except Exception as e:
+			log.LOG_WARN( "Could not write include index: {}".format( e ) )
+			return
+
+		_dirty = False
+
+
+def _checkGeneration( ):
+	global _generation
+
+	generation = _stat_cache.GetGeneration( )
+	if generation != _generation:
+		with _lock:
+			_validIndexes.clear( )
+			_localResults.clear( )
+			_searchResults.clear( )
+			_generation = generation
+
+
+def _getIndex( directory ):
+	global _dirty
+
+	try:
+		return _validIndexes[directory][1]
+	except KeyError:
+		pass
+
+	st = _stat_cache.Stat( directory )
+	signature = None
+	if st is None:
+		index = None
+	else:
+		signature = _stat_cache.GetSignature( st )
+		entry = _indexes.get( directory )
+		if entry is not None and entry[0] == signature:
+			index = entry[1]
+		else:
+			try:
+				index = frozenset( os.path.normcase( name ) for name in os.listdir( directory ) )
+			except OSError:
+				index = None
+			else:
+				with _lock:
+					if time.time( ) - st.st_mtime > _RACY_TIMESTAMP_WINDOW:
+						_indexes[directory] = ( signature, index )
+						_dirty = True
+					else:
+						_indexes.pop( directory, None )
+						signature = _RACY_SIGNATURE
+
+	_validIndexes[directory] = ( signature, index )
+	_consultedDirectories[directory] = ( signature, index )
+	return index
+
+
+def TrackSearchPath( files, searchDirs ):
+	"""
+	Record the state of every directory the includes of a group of files would be resolved through, without resolving
+	anything. Used when the headers an object depends on are already known, so that a file being added ahead of one of
+	them is still noticed next time.
+
+	:param files: Full paths of the files whose includes were resolved
+	:type files: iterable[str]
+
+	:param searchDirs: The working directory and include directories that were searched
+	:type searchDirs: list[str]
+	"""
+	_checkGeneration( )
+
+	directories = set( os.path.dirname( path ) for path in files )
+	directories.update( searchDirs )
+	for directory in directories:
+		directory = os.path.normcase( os.path.abspath( directory ) )
+		if directory not in _validIndexes:
+			_getIndex( directory )
+
+
+def GetDirectoryStates( ):
+	"""
+	Get the state of every directory consulted to resolve includes during this run. If the names in any of them change,
+	includes may resolve differently.
+
+	:return: Dictionary of directory to ( signature (see _stat_cache.GetSignature()), frozenset of normcase'd names ), or
+	( None, None ) for directories that didn't exist. Directories that were modified too recently to be sure of get a
+	signature that never matches.
+	:rtype: dict
+	"""
+	return dict( _consultedDirectories )
+
+
+def _exists( path ):
+	path = os.path.normcase( os.path.abspath( path ) )
+	directory, name = os.path.split( path )
+	if not name:
+		return False
+	index = _getIndex( directory )
+	return index is not None and name in index
+
+
+def Resolve( headerFile, relativeDir, includeDirs, workingDir = None ):
+	"""
+	Find the file an #include directive refers to.
+
+	:param headerFile: The path as written in the #include directive
+	:type headerFile: str
+
+	:param relativeDir: Directory of the file containing the directive, or None
+	:type relativeDir: str or None
+
+	:param includeDirs: Include directories to search, in order
+	:type includeDirs: list[str]
+
+	:param workingDir: Directory searched before any other, or None for the current working directory
+	:type workingDir: str
+
+	:return: Path to the file, or an empty string if it couldn't be found
+	:rtype: str
+	"""
+	_checkGeneration( )
+
+	cwd = workingDir if workingDir is not None else os.getcwd( )
+	key = ( cwd, relativeDir, headerFile )
+	try:
+		result = _localResults[key]
+	except KeyError:
+		result = ""
+		if _exists( os.path.join( cwd, headerFile ) ):
+			result = os.path.join( cwd, headerFile )
+		elif relativeDir is not None and _exists( os.path.join( relativeDir, headerFile ) ):
+			result = os.path.join( relativeDir, headerFile )
+		_localResults[key] = result
+
+	if result:
+		return result
+
+	key = ( tuple( includeDirs ), headerFile )
+	try:
+		return _searchResults[key]
+	except KeyError:
+		pass
+
+	for incDir in includeDirs:
+		path = os.path.join( incDir, headerFile )
+		if _exists( path ):
+			result = path
+			break
+
+	_searchResults[key] = result
+	return result
@@ -0,0 +1,370 @@
+# Copyright (C) 2013 Jaedyn K. Draper
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+GNU make jobserver.
+
+A jobserver keeps the total number of jobs run by a tree of processes (make running csbuild running make, and so on)
+within a single limit. It's a pipe holding one byte, or token, for each job that can run beyond the first. Every process
+in the tree gets one job for free, and has to read a token from the pipe before starting each job on top of that,
+writing it back once the job is done. Child processes find the pipe through the --jobserver-auth option in the
+MAKEFLAGS environment variable: either as a pair of inherited file descriptors, or as the path of a named pipe.
+
+When csbuild is run by make with a jobserver, each compile and link takes a token before it runs. Otherwise, csbuild
+creates a named pipe with a token for each thread beyond the first, and uses it itself as well as advertising it to
+every process it runs, so compilers and sub-builds that support the protocol share csbuild's threads rather than
+adding their own on top.
+
+Only available on platforms with named pipes.
+"""
+
+import errno
+import os
+import re
+import select
+import shutil
+import tempfile
+import threading
+
+from . import log
+
+_TOKEN = b"+"
+#How often a thread waiting for a token checks whether the free job has come back in the meantime.
+_POLL_INTERVAL_SECONDS = 0.5
+
+_active = None
+_previousMakeFlags = None
+
+
+class JobServer( object ):
+	"""
+	Connection to a jobserver.
+
+	:param readFd: File descriptor tokens are read from
+	:type readFd: int
+
+	:param writeFd: File descriptor tokens are written back to
+	:type writeFd: int
+
+	:param ownedFds: File descriptors opened for this object, to be closed with it
+	:type ownedFds: list[int]
+
+	:param tempDir: Directory holding the named pipe, if this object created it
+	:type tempDir: str
+
+	:param blockingRead: Whether readFd blocks when there's nothing to read, so has to be read on a thread of its own
+	:type blockingRead: bool
+	"""
+	def __init__( self, readFd, writeFd, ownedFds, tempDir = None, blockingRead = False ):
+		self._readFd = readFd
+		self._writeFd = writeFd
+		self._ownedFds = ownedFds
+		self._tempDir = tempDir
+		self._lock = threading.Lock( )
+		self._cond = threading.Condition( self._lock )
+		self._freeJobAvailable = True
+		self._held = [ ]
+		self._blockingRead = blockingRead
+		#For blocking descriptors: how many threads are waiting, the tokens read for them, and the thread reading them
+		self._waiting = 0
+		self._ready = [ ]
+		self._reader = None
+		self._ownerGone = False
+		self._closed = False
+
+
+	def Acquire( self ):
+		"""
+		Wait until another job can be run.
+
+		:return: Token to pass back to Release() when the job is done
+		:rtype: bytes
+		"""
+		if self._blockingRead:
+			return self._acquireFromReader( )
+
+		while True:
+			with self._lock:
+				if self._freeJobAvailable:
+					self._freeJobAvailable = False
+					return None
+
+			#Another process can take the token between select() and read(), which just means waiting some more.
+			try:
+				readable, _, _ = select.select( [ self._readFd ], [ ], [ ], _POLL_INTERVAL_SECONDS )
+				if not readable:
+					continue
+				token = os.read( self._readFd, 1 )
+			except (OSError, select.error) as e:
+				if e.args[0] in ( errno.EINTR, errno.EAGAIN ):
+					continue
+				raise
+
+			if not token:
+				#Whoever owned the jobserver has gone away, there's nothing left to share.
+				return None
+
+			with self._lock:
+				self._held.append( token )
+			return token
+
+
+	def _acquireFromReader( self ):
+		with self._cond:
+			self._waiting += 1
+			try:
+				while True:
+					if self._freeJobAvailable:
+						self._freeJobAvailable = False
+						return None
+					if self._ready:
+						token = self._ready.pop( )
+						self._held.append( token )
+						return token
+					if self._ownerGone:
+						return None
+					if self._reader is None:
+						self._reader = threading.Thread( target = self._readTokens, name = "csbuild-jobserver" )
+						self._reader.daemon = True
+						self._reader.start( )
+					self._cond.notify_all( )
+					self._cond.wait( _POLL_INTERVAL_SECONDS )
+			finally:
+				self._waiting -= 1
+
+
+	def _readTokens( self ):
+		#A read can't be interrupted, so it's only started when a thread is waiting for a token. If that thread gets the
+		#free job instead, the token is kept for the next one.
+		while True:
+			with self._cond:
+				while not self._closed and self._waiting <= len( self._ready ):
+					self._cond.wait( )
+				if self._closed:
+					return
+			try:
+				token = os.read( self._readFd, 1 )
+			except OSError as e:
+				if e.errno == errno.EINTR:
+					continue
+				token = b""
+
+			with self._cond:
+				if self._closed:
+					if token:
+						os.write( self._writeFd, token )
+					return
+				if token:
+					self._ready.append( token )
+				else:
+					self._ownerGone = True
+				self._cond.notify_all( )
+			if not token:
+				return
+
+
+	def Release( self, token ):
+		"""
+		Let another job run in place of one that's done.
+
+		:param token: Value returned by Acquire() for the job
+		:type token: bytes
+		"""
+		with self._cond:
+			if token is None:
+				self._freeJobAvailable = True
+				self._cond.notify_all( )
+				return
+			self._held.remove( token )
+		os.write( self._writeFd, token )
+
+
+	def Close( self ):
+		"""
+		Give back every token still held, and release the jobserver's resources.
+		"""
+		with self._cond:
+			held = self._held + self._ready
+			self._held = [ ]
+			self._ready = [ ]
+			self._closed = True
+			self._cond.notify_all( )
+		for token in held:
+			try:
+				os.write( self._writeFd, token )
+			except OSError:
+				pass
+
+		#A reader thread still blocked on make's descriptor is left to give back whatever it gets.
+		for fd in self._ownedFds:
+			os.close( fd )
+		if self._tempDir is not None:
+			shutil.rmtree( self._tempDir, ignore_errors = True )
+
+
+def IsSupported( ):
+	"""
+	:return: Whether jobservers can be used on this platform
+	:rtype: bool
+	"""
+	return hasattr( os, "mkfifo" )
+
+
+def _parseMakeFlags( makeFlags ):
+	"""
+	:return: What the last --jobserver-auth (or --jobserver-fds, from make before 4.2) option in MAKEFLAGS says, or None
+	:rtype: str
+	"""
+	words = makeFlags.split( )
+	#The first word holds the single-letter options, without a dash. make runs nothing at all with -n.
+	if words and not words[0].startswith( "-" ) and "n" in words[0]:
+		return None
+
+	auth = None
+	for word in words:
+		if word == "--":
+			break
+		match = re.match( r"--jobserver-(?:auth|fds)=(.*)$", word )
+		if match:
+			auth = match.group( 1 )
+	return auth
+
+
+def Connect( makeFlags ):
+	"""
+	Connect to the jobserver described by MAKEFLAGS, if there is one.
+
+	:param makeFlags: Value of the MAKEFLAGS environment variable
+	:type makeFlags: str
+
+	:return: Connection to the jobserver, or None if there isn't one that can be used
+	:rtype: JobServer
+	"""
+	auth = _parseMakeFlags( makeFlags )
+	if auth is None:
+		return None
+
+	if auth.startswith( "fifo:" ):
+		path = auth[len( "fifo:" ):]
+		try:
+			fd = os.open( path, os.O_RDWR | os.O_NONBLOCK )
+		except OSError as e:
+			log.LOG_WARN( "Could not open jobserver {}: {}. Running without it.".format( path, e ) )
+			return None
+		return JobServer( fd, fd, [ fd ] )
+
+	match = re.match( r"(\d+),(\d+)$", auth )
+	if not match:
+		log.LOG_WARN( "Jobserver {} is not in a supported format. Running without it.".format( auth ) )
+		return None
+
+	readFd, writeFd = int( match.group( 1 ) ), int( match.group( 2 ) )
+	try:
+		os.fstat( readFd )
+		os.fstat( writeFd )
+	except OSError:
+		#make only passes the jobserver on to commands it knows run make, or that are marked with '+'.
+		log.LOG_WARN( "The jobserver make advertised isn't available to csbuild. "
+			"Prefix the command that runs csbuild with '+' in your makefile to share make's jobs." )
+		return None
+
+	#The descriptors are shared with make, which expects them to block, so they can't be made non-blocking. Opening
+	#the pipe again gives csbuild a descriptor of its own that can be.
+	try:
+		fd = os.open( "/proc/self/fd/{}".format( readFd ), os.O_RDONLY | os.O_NONBLOCK )
+	except OSError:
+		return JobServer( readFd, writeFd, [ ], blockingRead = True )
+	return JobServer( fd, writeFd, [ fd ] )
+
+
+def Create( numJobs ):
+	"""
+	Create a new jobserver as a named pipe.
+
+	:param numJobs: Total number of jobs the jobserver allows, including the one each process gets for free
+	:type numJobs: int
+
+	:return: Connection to the new jobserver, and the MAKEFLAGS value that advertises it to child processes
+	:rtype: tuple[JobServer, str]
+	"""
+	tempDir = tempfile.mkdtemp( prefix = "csbuild-jobserver-" )
+	path = os.path.join( tempDir, "fifo" )
+	os.mkfifo( path, 0o600 )
+	fd = os.open( path, os.O_RDWR | os.O_NONBLOCK )
+	server = JobServer( fd, fd, [ fd ], tempDir )
+	for _ in range( numJobs - 1 ):
+		os.write( fd, _TOKEN )
+	return server, "-j{} --jobserver-auth=fifo:{}".format( numJobs, path )
+
+
+def Start( numJobs ):
+	"""
+	Start sharing jobs with the rest of the process tree: through make's jobserver if csbuild was run by make with
+	one, otherwise through a new jobserver advertised to every process csbuild runs.
+
+	:param numJobs: Total number of jobs to allow, if csbuild has to create the jobserver
+	:type numJobs: int
+
+	:return: The active jobserver, or None if there isn't one
+	:rtype: JobServer
+	"""
+	global _active
+	global _previousMakeFlags
+
+	if _active is not None or not IsSupported( ):
+		return _active
+
+	makeFlags = os.environ.get( "MAKEFLAGS", "" )
+	_active = Connect( makeFlags )
+	if _active is not None:
+		log.LOG_INFO( "Sharing jobs with the jobserver from MAKEFLAGS." )
+		return _active
+
+	try:
+		_active, newMakeFlags = Create( numJobs )
+	except (IOError, OSError) as e:
+		log.LOG_WARN( "Could not create a jobserver: {}".format( e ) )
+		return None
+
+	_previousMakeFlags = os.environ.get( "MAKEFLAGS" )
+	os.environ["MAKEFLAGS"] = " ".join( flag for flag in ( makeFlags, newMakeFlags ) if flag )
+	return _active
+
+
+def Stop( ):
+	"""
+	Give back any tokens still held, and remove the jobserver if csbuild created it.
+	"""
+	global _active
+	global _previousMakeFlags
+
+	if _active is None:
+		return
+
+	if _active._tempDir is not None:
+		if _previousMakeFlags is None:
+			os.environ.pop( "MAKEFLAGS", None )
+		else:
+			os.environ["MAKEFLAGS"] = _previousMakeFlags
+		_previousMakeFlags = None
+
+	active = _active
+	_active = None
+	active.Close( )
@@ -0,0 +1,320 @@
+# Copyright (C) 2013 Jaedyn K. Draper
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Whole-build manifest.
+
+At the end of every successful build, the size and modification time of everything that went into it are written
+out: the makefile scripts, every source and header, the libraries that were linked, the compilers that were run, the
+directories files were discovered in (so added and removed files are noticed), and every object and output file that
+was produced, along with the command signature each object was compiled with.
+
+On the next run, once the makefile has been evaluated, the manifest for the same command line is checked before any
+project is prepared. It's only used if the environment is exactly the same as it was, since the makefile can read any
+of it, and if nothing in it has changed, the build is already up to date and csbuild exits straight away, without
+scanning headers, locating libraries or planning chunks. Only the manifests of the most recently built command lines
+are kept.
+
+Build steps from makefiles and plugins can depend on anything, so projects that have any never use a manifest.
+"""
+
+import glob
+import hashlib
+import os
+import platform
+import shlex
+import sys
+import time
+from multiprocessing.pool import ThreadPool
+
+if sys.version_info >= (3,0):
+	import pickle
+else:
+	import cPickle as pickle
+
+import csbuild
+from . import log
+from . import _shared_globals
+from . import _stat_cache
+from . import _hash_db
+from . import _header_cache
+
+_MANIFEST_VERSION = 1
+#Inputs modified this close to the start of the build may have changed again after they were read.
+_RACY_TIMESTAMP_WINDOW = 2.0
+
+_MAX_MANIFESTS = 4
+
+_STEP_LISTS = (
+	"prePrepareBuildSteps",
+	"postPrepareBuildSteps",
+	"preMakeSteps",
+	"postMakeSteps",
+	"preBuildSteps",
+	"postBuildSteps",
+	"preLinkSteps",
+)
+
+
+def GetBuildKey( buildArgs, ignoredOptions ):
+	"""
+	Build a key identifying everything about how csbuild was invoked that could change what the makefile sets up.
+	Each distinct command line gets its own manifest, which is only used if the whole key matches.
+
+	:param buildArgs: Parsed command line arguments
+	:type buildArgs: argparse.Namespace
+
+	:param ignoredOptions: Names of options that don't affect what gets built
+	:type ignoredOptions: iterable[str]
+
+	:rtype: str
+	"""
+	options = sorted( ( key, repr( value ) ) for key, value in vars( buildArgs ).items( ) if key not in ignoredOptions )
+	#The makefile can read any environment variable at all, and what it sets up from them isn't known until the
+	#projects have been prepared, which is the work the manifest is there to skip.
+	environment = sorted( os.environ.items( ) )
+	commandLine = repr( ( csbuild.__version__, sys.version, options ) )
+	everything = repr( ( commandLine, environment ) )
+	if sys.version_info >= (3, 0):
+		commandLine = commandLine.encode( "utf-8" )
+		everything = everything.encode( "utf-8" )
+	#The first part names the manifest file, so there's only ever one for each command line.
+	return "{}_{}".format( hashlib.md5( commandLine ).hexdigest( )[:16], hashlib.md5( everything ).hexdigest( ) )
+
+
+def _getManifestFile( key ):
+	return os.path.join( _shared_globals.cacheDirectory, "manifest_{}.csbm".format( key.split( "_" )[0] ) )
+
+
+def _pruneManifests( keep ):
+	manifests = [ ]
+	for path in glob.glob( os.path.join( _shared_globals.cacheDirectory, "manifest_*.csbm" ) ):
+		try:
+			manifests.append( ( os.path.getmtime( path ), path ) )
+		except OSError:
+			pass
+	manifests.sort( reverse = True )
+	for _, path in [ manifest for manifest in manifests if manifest[1] != keep ][_MAX_MANIFESTS - 1:]:
+		try:
+			os.remove( path )
+		except OSError:
+			pass
+
+
+def CanUseManifest( projects ):
+	"""
+	:param projects: Projects being built
+	:type projects: list[csbuild.projectSettings.projectSettings]
+
+	:return: Whether the build can be skipped based on a manifest. Build steps from the makefile or plugins might
+	depend on anything at all, so a manifest is never used when there are any. Must be called before the build
+	starts, as the toolchains add global steps of their own.
+	:rtype: bool
+	"""
+	if _shared_globals.globalPreMakeSteps or _shared_globals.globalPostMakeSteps:
+		return False
+	for project in projects:
+		if project.plugins:
+			return False
+		for stepList in _STEP_LISTS:
+			if getattr( project, stepList ):
+				return False
+	return True
+
+
+def _getSignature( path ):
+	st = _stat_cache.Stat( path )
+	if st is None:
+		return None
+	return _stat_cache.GetSignature( st )
+
+
+def _getSignatures( paths ):
+	paths = list( paths )
+	numThreads = min( _shared_globals.max_threads, len( paths ) )
+	if numThreads <= 1:
+		return [ ( path, _getSignature( path ) ) for path in paths ]
+	pool = ThreadPool( numThreads )
+	try:
+		return pool.map( lambda path: ( path, _getSignature( path ) ), paths, max( 1, len( paths ) // ( numThreads * 4 ) ) )
+	finally:
+		pool.close( )
+		pool.join( )
+
+
+def _findExecutable( command ):
+	try:
+		executable = shlex.split( command, posix = platform.system( ) != "Windows" )[0]
+	except (ValueError, IndexError):
+		return None
+	executable = executable.strip( '"' )
+	if os.path.dirname( executable ):
+		return os.path.abspath( executable )
+
+	extensions = [ "" ]
+	if platform.system( ) == "Windows":
+		extensions += os.environ.get( "PATHEXT", ".EXE" ).lower( ).split( os.pathsep )
+	for directory in os.environ.get( "PATH", "" ).split( os.pathsep ):
+		for extension in extensions:
+			path = os.path.join( directory, executable + extension )
+			if os.path.isfile( path ):
+				return path
+	return None
+
+
+def _collectDirectories( project, ignored ):
+	directories = set( os.path.abspath( path ) for path in project.includeDirs )
+	directories.update( os.path.abspath( path ) for path in project.libraryDirs )
+
+	ignored = ignored | set( os.path.abspath( path ) for path in project.excludeDirs )
+
+	for sourceDir in [ project.workingDirectory ] + list( project.extraDirs ):
+		for root, dirnames, _ in os.walk( os.path.join( project.workingDirectory, sourceDir ) ):
+			root = os.path.abspath( root )
+			directories.add( root )
+			dirnames[:] = [
+				dirname for dirname in dirnames
+				if dirname != ".csbuild" and os.path.join( root, dirname ) not in ignored
+			]
+
+	return directories - ignored
+
+
+def _collectObjects( project ):
+	objs = set( )
+	for source in project.allsources:
+		objs.add( csbuild._utils.GetSourceObjPath( project, source ) )
+	if project.unity:
+		objs.add( csbuild._utils.GetUnityChunkObjPath( project ) )
+	else:
+		for chunk in project.chunks:
+			if isinstance( chunk, list ):
+				objs.add( csbuild._utils.GetChunkedObjPath( project, chunk ) )
+	return set( os.path.abspath( obj ) for obj in objs )
+
+
+def Write( key, projects ):
+	"""
+	Record the state of everything that went into a successful build. Should only be called if CanUseManifest()
+	returned True before the build started.
+
+	:param key: Value returned by GetBuildKey()
+	:type key: str
+
+	:param projects: Projects that were built
+	:type projects: list[csbuild.projectSettings.projectSettings]
+	"""
+	manifestFile = _getManifestFile( key )
+
+	inputs = set( _shared_globals.makefileScripts )
+	outputs = set( )
+	commands = { }
+
+	#The build writes to these, and everything in them that matters is recorded individually as an output.
+	buildDirectories = set( )
+	for project in projects:
+		buildDirectories.add( os.path.abspath( project.objDir ) )
+		buildDirectories.add( os.path.abspath( project.outputDir ) )
+
+	for project in projects:
+		inputs.update( project.allsources )
+		inputs.update( project.allheaders )
+		for source in project.allsources:
+			inputs.update( _shared_globals.allheaders.get( source, ( ) ) )
+		inputs.update( project.libraryLocations )
+		inputs.update( project.extraObjs )
+		inputs.update( _collectDirectories( project, buildDirectories ) )
+		for command in ( project.ccCmd, project.cxxCmd ):
+			executable = _findExecutable( command )
+			if executable:
+				inputs.add( executable )
+
+		outputs.add( os.path.join( project.outputDir, project.outputName ) )
+		for obj in _collectObjects( project ):
+			outputs.add( obj )
+			commands[obj] = _hash_db.Get( ( "cmd", obj ) )
+			inputs.update( _header_cache.GetRecordedDependencies( obj ) or ( ) )
+
+	inputs = set( os.path.abspath( path ) for path in inputs )
+
+	#csbuild invalidates what it writes itself, but the linkers and compilers may have written more than that.
+	_stat_cache.Clear( )
+	files = dict( _getSignatures( inputs | outputs ) )
+
+	racyTime = ( _shared_globals.starttime - _RACY_TIMESTAMP_WINDOW ) * 1000000000
+	for path in inputs:
+		signature = files[path]
+		if signature is not None and signature[1] >= racyTime:
+			log.LOG_INFO( "Not writing a build manifest, {} was modified too recently to tell whether it changed during the build.".format( path ) )
+			if os.access( manifestFile, os.F_OK ):
+				os.remove( manifestFile )
+			return
+
+	data = {
+		"version": _MANIFEST_VERSION,
+		"key": key,
+		"files": files,
+		"commands": commands,
+	}
+	try:
+		csbuild._utils.WriteFileAtomic( manifestFile, pickle.dumps( data, 2 ) )
+	except Exception as e:
+		log.LOG_WARN( "Could not write build manifest: {}".format( e ) )
+	_pruneManifests( manifestFile )
+
+
+def IsUpToDate( key ):
+	"""
+	Check whether anything recorded in the manifest of the last successful build with the same key has changed.
+
+	:param key: Value returned by GetBuildKey()
+	:type key: str
+
+	:return: True if nothing has changed and the build can be skipped
+	:rtype: bool
+	"""
+	manifestFile = _getManifestFile( key )
+	if not os.access( manifestFile, os.F_OK ):
+		return False
+
+	start = time.time( )
+	try:
+		with open( manifestFile, "rb" ) as f:
+			data = pickle.load( f )
+	except Exception as e:
+		log.LOG_WARN( "Could not read build manifest {}: {}".format( manifestFile, e ) )
+		return False
+
+	if not isinstance( data, dict ) or data.get( "version" ) != _MANIFEST_VERSION or data.get( "key" ) != key:
+		return False
+
+	files = data["files"]
+	for path, signature in _getSignatures( files ):
+		if signature != files[path]:
+			log.LOG_INFO( "Build manifest is out of date: {} has changed.".format( path ) )
+			return False
+
+	for obj, signature in data["commands"].items( ):
+		if _hash_db.Get( ( "cmd", obj ) ) != signature:
+			log.LOG_INFO( "Build manifest is out of date: {} was compiled with a different command.".format( obj ) )
+			return False
+
+	log.LOG_INFO( "Checked build manifest: {} files in {:.2f}s.".format( len( files ), time.time( ) - start ) )
+	return True
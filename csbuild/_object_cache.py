@@ -0,0 +1,377 @@
+# Copyright (C) 2013 Jaedyn K. Draper
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Content-addressed object cache.
+
+With --object-cache, objects are stored under a hash of the preprocessed source, the compile command, the working
+directory and the compiler, and restored instead of compiled when they're found. The least recently used entries are
+removed once the cache outgrows its maximum size.
+"""
+
+import hashlib
+import json
+import os
+import struct
+import subprocess
+import tempfile
+import threading
+
+from . import log
+
+DEFAULT_MAX_SIZE = 5 * 1024 * 1024 * 1024
+
+#Changing how entries are keyed or stored invalidates every entry made before.
+_CACHE_VERSION = 1
+#When the cache is too big, it's trimmed to this fraction of its maximum size, so it isn't trimmed again straight away.
+_TRIM_FRACTION = 0.9
+_STATS_FILE = "stats.json"
+#Each entry is the sizes of the compiler's stdout, its stderr and the object, followed by each of them in turn.
+_ENTRY_HEADER = struct.Struct( "<QQQ" )
+
+_lock = threading.Lock( )
+_directory = None
+_maxSize = DEFAULT_MAX_SIZE
+_hits = 0
+_misses = 0
+_added = 0
+_compilerIdentities = { }
+
+
+def IsEnabled( ):
+	"""
+	:return: Whether the build is using an object cache
+	:rtype: bool
+	"""
+	return _directory is not None
+
+
+def _findExecutable( executable, env ):
+	if os.path.dirname( executable ):
+		return os.path.abspath( executable )
+	path = ( env or os.environ ).get( "PATH", os.defpath )
+	for directory in path.split( os.pathsep ):
+		candidate = os.path.join( directory, executable )
+		if os.path.isfile( candidate ) and os.access( candidate, os.X_OK ):
+			return candidate
+	return None
+
+
+def GetCompilerIdentity( executable, env ):
+	"""
+	:param executable: Compiler executable, as it's run
+	:type executable: str
+
+	:param env: Environment it's run with, or None for this process's
+	:type env: dict[str, str]
+
+	:return: Something that changes whenever the compiler does
+	:rtype: str
+	"""
+	path = ( env or os.environ ).get( "PATH" )
+	with _lock:
+		identity = _compilerIdentities.get( ( executable, path ) )
+	if identity is not None:
+		return identity
+
+	parts = [ executable ]
+	resolved = _findExecutable( executable, env )
+	if resolved is not None:
+		resolved = os.path.realpath( resolved )
+		st = os.stat( resolved )
+		parts.append( "{} {} {}".format( resolved, st.st_size, int( st.st_mtime ) ) )
+	try:
+		fd = subprocess.Popen( [ executable, "--version" ], stdout = subprocess.PIPE, stderr = subprocess.PIPE, env = env )
+		out, _ = fd.communicate( )
+		parts.append( out.decode( "utf-8", "replace" ) )
+	except OSError:
+		pass
+
+	identity = "\n".join( parts )
+	with _lock:
+		_compilerIdentities[( executable, path )] = identity
+	return identity
+
+
+def GetKey( compilerIdentity, cmd, workingDirectory, preprocessed ):
+	"""
+	:param compilerIdentity: What GetCompilerIdentity() returned for the compiler
+	:type compilerIdentity: str
+
+	:param cmd: Compile command, with placeholders for the source and object
+	:type cmd: str
+
+	:param workingDirectory: Directory the file is compiled in, which ends up in debug information
+	:type workingDirectory: str
+
+	:param preprocessed: The preprocessed source
+	:type preprocessed: bytes
+
+	:return: Key of the object in the cache
+	:rtype: str
+	"""
+	digest = hashlib.sha256( )
+	for part in ( str( _CACHE_VERSION ), compilerIdentity, cmd, workingDirectory ):
+		part = part.encode( "utf-8" ) if not isinstance( part, bytes ) else part
+		digest.update( part )
+		digest.update( b"\0" )
+	digest.update( preprocessed )
+	return digest.hexdigest( )
+
+
+def _getPath( key ):
+	return os.path.join( _directory, key[:2], key[2:] )
+
+
+def Fetch( key, obj ):
+	"""
+	Restore an object from the cache.
+
+	:param key: Key returned by GetKey()
+	:type key: str
+
+	:param obj: Where to write the object
+	:type obj: str
+
+	:return: What the compiler wrote to stdout and stderr when it was compiled, or None if it isn't in the cache
+	:rtype: tuple[bytes, bytes]
+	"""
+	global _hits
+	global _misses
+
+	path = _getPath( key )
+	try:
+		with open( path, "rb" ) as f:
+			data = f.read( )
+		#Entries are evicted in order of when they were last used.
+		os.utime( path, None )
+	except (IOError, OSError):
+		data = None
+
+	if data is not None:
+		outSize, errorsSize, objSize = _ENTRY_HEADER.unpack_from( data ) if len( data ) >= _ENTRY_HEADER.size else ( 0, 0, 0 )
+		if _ENTRY_HEADER.size + outSize + errorsSize + objSize != len( data ) or not objSize:
+			log.LOG_WARN( "Removing corrupt object cache entry {}".format( path ) )
+			_remove( path )
+			data = None
+
+	if data is None:
+		with _lock:
+			_misses += 1
+		return None
+
+	start = _ENTRY_HEADER.size
+	out = data[start:start + outSize]
+	start += outSize
+	errors = data[start:start + errorsSize]
+	start += errorsSize
+	with open( obj, "wb" ) as f:
+		f.write( data[start:] )
+	with _lock:
+		_hits += 1
+	return out, errors
+
+
+def Store( key, obj, out, errors ):
+	"""
+	Add a freshly compiled object to the cache.
+
+	:param key: Key returned by GetKey()
+	:type key: str
+
+	:param obj: The object
+	:type obj: str
+
+	:param out: What the compiler wrote to stdout
+	:type out: bytes
+
+	:param errors: What the compiler wrote to stderr
+	:type errors: bytes
+	"""
+	global _added
+
+	path = _getPath( key )
+	try:
+		with open( obj, "rb" ) as f:
+			objData = f.read( )
+		_makeDirectory( os.path.dirname( path ) )
+		#Written under another name first, so other builds never see half an entry.
+		fd, tempPath = tempfile.mkstemp( dir = os.path.dirname( path ), prefix = ".tmp" )
+		with os.fdopen( fd, "wb" ) as f:
+			f.write( _ENTRY_HEADER.pack( len( out ), len( errors ), len( objData ) ) )
+			f.write( out )
+			f.write( errors )
+			f.write( objData )
+		try:
+			os.rename( tempPath, path )
+		except OSError:
+			#Someone else got there first.
+			_remove( tempPath )
+			return
+	except (IOError, OSError) as e:
+		log.LOG_WARN( "Could not add {} to the object cache: {}".format( obj, e ) )
+		return
+
+	with _lock:
+		_added += _ENTRY_HEADER.size + len( out ) + len( errors ) + len( objData )
+
+
+def _makeDirectory( path ):
+	try:
+		os.makedirs( path )
+	except OSError:
+		if not os.path.isdir( path ):
+			raise
+
+
+def _remove( path ):
+	try:
+		os.remove( path )
+	except OSError:
+		pass
+
+
+def _readStats( ):
+	try:
+		with open( os.path.join( _directory, _STATS_FILE ), "r" ) as f:
+			return json.load( f )
+	except (IOError, OSError, ValueError):
+		return { }
+
+
+def _writeStats( stats ):
+	path = os.path.join( _directory, _STATS_FILE )
+	try:
+		fd, tempPath = tempfile.mkstemp( dir = _directory, prefix = ".tmp" )
+		with os.fdopen( fd, "w" ) as f:
+			json.dump( stats, f )
+		if os.path.exists( path ):
+			os.remove( path )
+		os.rename( tempPath, path )
+	except (IOError, OSError):
+		pass
+
+
+def _trim( ):
+	"""
+	Remove the least recently used entries until the cache is small enough.
+
+	:return: Size of the cache afterwards, and how many entries were removed
+	:rtype: tuple[int, int]
+	"""
+	entries = [ ]
+	size = 0
+	for root, _, files in os.walk( _directory ):
+		if root == _directory:
+			continue
+		for name in files:
+			path = os.path.join( root, name )
+			try:
+				st = os.stat( path )
+			except OSError:
+				continue
+			entries.append( ( st.st_mtime, st.st_size, path ) )
+			size += st.st_size
+
+	removed = 0
+	if size > _maxSize:
+		entries.sort( )
+		for _, entrySize, path in entries:
+			if size <= _maxSize * _TRIM_FRACTION:
+				break
+			_remove( path )
+			size -= entrySize
+			removed += 1
+	return size, removed
+
+
+def _formatSize( size ):
+	size = float( size )
+	for suffix in ( "KB", "MB", "GB" ):
+		size /= 1024
+		if size < 1024 or suffix == "GB":
+			return "{:.1f} {}".format( size, suffix )
+
+
+def Start( directory, maxSize ):
+	"""
+	Start using an object cache.
+
+	:param directory: Directory the cache is kept in. It's created if it doesn't exist.
+	:type directory: str
+
+	:param maxSize: Most space the cache can take up, in bytes, or None for the default
+	:type maxSize: int
+	"""
+	global _directory
+	global _maxSize
+	global _hits
+	global _misses
+	global _added
+
+	try:
+		_makeDirectory( directory )
+	except OSError as e:
+		log.LOG_WARN( "Could not create object cache directory {}: {}".format( directory, e ) )
+		return
+
+	_directory = os.path.abspath( directory )
+	_maxSize = maxSize if maxSize is not None else DEFAULT_MAX_SIZE
+	with _lock:
+		_hits = 0
+		_misses = 0
+		_added = 0
+
+
+def Stop( ):
+	"""
+	Stop using the cache, trimming it if it's grown too big, and report how well it did.
+	"""
+	global _directory
+
+	if _directory is None:
+		return
+
+	with _lock:
+		hits = _hits
+		misses = _misses
+		added = _added
+
+	stats = _readStats( )
+	stats["hits"] = stats.get( "hits", 0 ) + hits
+	stats["misses"] = stats.get( "misses", 0 ) + misses
+	#The size is only known exactly after a trim, and estimated in between.
+	stats["size"] = stats.get( "size", 0 ) + added
+	if stats["size"] > _maxSize:
+		stats["size"], removed = _trim( )
+		if removed:
+			log.LOG_INFO( "Removed {} least recently used object cache entr{}.".format( removed, "y" if removed == 1 else "ies" ) )
+	_writeStats( stats )
+
+	if hits or misses:
+		log.LOG_BUILD( "Object cache: {} hit{}, {} miss{} ({:.0f}% hit rate). In total, {} hits and {} misses; {} of {} used.".format(
+			hits, "" if hits == 1 else "s",
+			misses, "" if misses == 1 else "es",
+			100.0 * hits / ( hits + misses ),
+			stats["hits"], stats["misses"],
+			_formatSize( stats["size"] ), _formatSize( _maxSize )
+		) )
+	_directory = None
+
@@ -0,0 +1,803 @@
+# Copyright (C) 2013 Jaedyn K. Draper
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Conditional include scanner.
+
+Used instead of projectSettings.follow_headers() for projects that call csbuild.EnablePreprocessorHeaderScanning().
+Each source file is walked the way the preprocessor would walk it: #if, #ifdef, #ifndef, #elif and #else are evaluated
+against the macros the compiler predefines for the file's command line (when the toolchain can report them) plus the
+project's defines and undefines and whatever the files themselves #define, so headers in inactive blocks aren't treated
+as dependencies. #pragma once and include guards are honored, and computed includes (#include MACRO) are expanded.
+
+Whenever the outcome of a condition can't be known for certain, every branch that might be taken is followed, so the
+result is never missing a header the compiler would actually include. A computed include that can't be expanded makes
+the whole result unknown.
+
+The preprocessing directives of each file are kept in the header cache, and the resulting header set is cached per
+source file and configuration (compiler predefines, defines, undefines and include directories), so the same source
+can have different dependencies on each target and architecture.
+"""
+
+import hashlib
+import os
+import platform
+import re
+import shlex
+import subprocess
+import sys
+import threading
+
+import csbuild
+from . import log
+from . import _header_cache
+
+#The same limit gcc has, in case of a header that unconditionally includes itself
+_MAX_INCLUDE_DEPTH = 200
+#Conditions are evaluated in intmax_t and uintmax_t, which are 64 bits wide on everything csbuild supports.
+_INTMAX_BITS = 64
+_INTMAX_MAX = ( 1 << ( _INTMAX_BITS - 1 ) ) - 1
+_UINTMAX_MASK = ( 1 << _INTMAX_BITS ) - 1
+
+_INCLUDE_DIRECTIVES = frozenset( ( "include", "include_next", "import" ) )
+_CONDITIONAL_DIRECTIVES = frozenset( ( "if", "ifdef", "ifndef", "elif", "elifdef", "elifndef", "else", "endif" ) )
+_MACRO_DIRECTIVES = frozenset( ( "define", "undef" ) )
+
+_lineContinuationRegex = re.compile( r"\\[ \t]*\r?\n" )
+_commentOrLiteralRegex = re.compile( r"//[^\n]*|/\*.*?\*/|\"(?:\\.|[^\"\\\n])*\"|'(?:\\.|[^'\\\n])*'", re.S )
+_directiveRegex = re.compile( r"^[ \t]*#[ \t]*([A-Za-z_]\w*)[ \t]*(.*)$", re.M )
+_defineRegex = re.compile( r"([A-Za-z_]\w*)(\([^)]*\))?\s*(.*)$" )
+_identifierRegex = re.compile( r"[A-Za-z_]\w*" )
+_tokenRegex = re.compile(
+	r"\s*(?:"
+	r"(?P<number>(?:0[xX][0-9A-Fa-f]+|[0-9]+)[uUlL]*)|"
+	r"(?P<char>L?'(?:\\.|[^'\\])+')|"
+	r"(?P<name>[A-Za-z_]\w*)|"
+	r"(?P<op>\|\||&&|==|!=|<=|>=|<<|>>|[-+*/%<>&|^!~?:(),])"
+	r")"
+)
+#Macros the preprocessor provides itself, which the compiler doesn't list along with the rest
+_BUILTIN_MACROS = frozenset( (
+	"__FILE__",
+	"__LINE__",
+	"__COUNTER__",
+	"__DATE__",
+	"__TIME__",
+	"__TIMESTAMP__",
+	"__INCLUDE_LEVEL__",
+	"__BASE_FILE__",
+) )
+
+_guardIfRegex = re.compile( r"^!\s*defined\s*(?:\(\s*([A-Za-z_]\w*)\s*\)|([A-Za-z_]\w*))$" )
+
+_predefinesLock = threading.Lock( )
+#Command line -> dictionary of predefined macros, or None if the toolchain can't report them
+_predefinedMacros = { }
+
+
+def _stripComments( match ):
+	text = match.group( 0 )
+	if text.startswith( "/" ):
+		#Keep the line structure, so block comments can't join two directives together.
+		return " " + "\n" * text.count( "\n" )
+	return text
+
+
+def ScanDirectives( path ):
+	"""
+	Read the preprocessing directives that matter for include scanning out of a file.
+
+	:param path: Full path to the file
+	:type path: str
+
+	:return: Tuple of the include guard macro (or None if the file doesn't have one), and the list of
+	(directive, argument) tuples in the order they appear
+	:rtype: tuple[str or None, list[tuple[str, str]]]
+	"""
+	if sys.version_info >= (3, 0):
+		f = open( path, encoding = "latin-1" )
+	else:
+		f = open( path )
+	with f:
+		text = f.read( )
+
+	text = _lineContinuationRegex.sub( "", text )
+	if "/" in text or "'" in text or '"' in text:
+		text = _commentOrLiteralRegex.sub( _stripComments, text )
+
+	directives = [ ]
+	for match in _directiveRegex.finditer( text ):
+		name = match.group( 1 )
+		if name in _INCLUDE_DIRECTIVES or name in _CONDITIONAL_DIRECTIVES or name in _MACRO_DIRECTIVES:
+			directives.append( ( name, match.group( 2 ).strip( ) ) )
+		elif name == "pragma" and match.group( 2 ).strip( ) == "once":
+			directives.append( ( "pragma once", "" ) )
+
+	return _findIncludeGuard( directives ), directives
+
+
+def _findIncludeGuard( directives ):
+	if len( directives ) < 3 or directives[-1][0] != "endif":
+		return None
+
+	directive, argument = directives[0]
+	if directive == "ifndef":
+		guard = argument
+	elif directive == "if":
+		match = _guardIfRegex.match( argument )
+		if match is None:
+			return None
+		guard = match.group( 1 ) or match.group( 2 )
+	else:
+		return None
+
+	match = _defineRegex.match( directives[1][1] )
+	if directives[1][0] != "define" or match is None or match.group( 1 ) != guard:
+		return None
+
+	#The #endif that closes the first #ifndef has to be the last directive in the file.
+	depth = 0
+	for i, ( directive, _ ) in enumerate( directives ):
+		if directive in ( "if", "ifdef", "ifndef" ):
+			depth += 1
+		elif directive == "endif":
+			depth -= 1
+			if depth == 0:
+				return guard if i == len( directives ) - 1 else None
+		elif directive in ( "else", "elif", "elifdef", "elifndef" ) and depth == 1:
+			return None
+	return None
+
+
+def _tokenize( expression ):
+	tokens = [ ]
+	pos = 0
+	length = len( expression )
+	while pos < length:
+		match = _tokenRegex.match( expression, pos )
+		if match is None or match.end( ) == pos:
+			if expression[pos:].strip( ):
+				return None
+			break
+		pos = match.end( )
+		for kind in ( "number", "char", "name", "op" ):
+			value = match.group( kind )
+			if value is not None:
+				tokens.append( ( kind, value ) )
+				break
+	return tokens
+
+
+def _parseNumber( text ):
+	text = text.rstrip( "uUlL" )
+	try:
+		if text[:2] in ( "0x", "0X" ):
+			return int( text, 16 )
+		if len( text ) > 1 and text[0] == "0":
+			return int( text, 8 )
+		return int( text )
+	except ValueError:
+		return None
+
+
+def _parseChar( text ):
+	text = text.lstrip( "L" )[1:-1]
+	if len( text ) == 1:
+		return ord( text )
+	escapes = { "n": 10, "t": 9, "r": 13, "0": 0, "\\": 92, "'": 39, '"': 34, "a": 7, "b": 8, "f": 12, "v": 11 }
+	if len( text ) == 2 and text[0] == "\\" and text[1] in escapes:
+		return escapes[text[1]]
+	return None
+
+
+def _convert( value, unsigned ):
+	"""
+	Convert a value to intmax_t or uintmax_t, wrapping it around the way the compiler would.
+	"""
+	value &= _UINTMAX_MASK
+	if not unsigned and value > _INTMAX_MAX:
+		value -= _UINTMAX_MASK + 1
+	return value
+
+
+class _ExpressionParser( object ):
+	"""
+	Evaluates the tokens of a #if expression once macros have been expanded. As in C, the arithmetic is done in
+	intmax_t, or uintmax_t if either operand is unsigned, so values are ( int, whether it's unsigned ) tuples, or None
+	when they can't be known; None propagates through every operator except where the other operand decides the result
+	on its own.
+	"""
+
+	_binaryPrecedence = {
+		"||": 1, "&&": 2, "|": 3, "^": 4, "&": 5,
+		"==": 6, "!=": 6,
+		"<": 7, ">": 7, "<=": 7, ">=": 7,
+		"<<": 8, ">>": 8,
+		"+": 9, "-": 9,
+		"*": 10, "/": 10, "%": 10,
+	}
+
+	def __init__( self, tokens ):
+		self.tokens = tokens
+		self.pos = 0
+
+	def Parse( self ):
+		"""
+		:return: Value of the expression, or None if it can't be known
+		:rtype: int or None
+		"""
+		value = self._parseConditional( )
+		if self.pos != len( self.tokens ):
+			raise ValueError( "Unexpected token" )
+		return None if value is None else value[0]
+
+	def _peek( self ):
+		if self.pos < len( self.tokens ):
+			return self.tokens[self.pos]
+		return ( None, None )
+
+	def _expect( self, op ):
+		if self._peek( ) != ( "op", op ):
+			raise ValueError( "Expected {}".format( op ) )
+		self.pos += 1
+
+	def _parseConditional( self ):
+		condition = self._parseBinary( 1 )
+		if self._peek( ) != ( "op", "?" ):
+			return condition
+		self.pos += 1
+		ifTrue = self._parseConditional( )
+		self._expect( ":" )
+		ifFalse = self._parseConditional( )
+		if ifTrue is None or ifFalse is None:
+			#The type of the result depends on both branches, so a negative one might have become unsigned.
+			result = ifTrue if condition is not None and condition[0] else ifFalse
+			if condition is None or result is None or ( not result[1] and result[0] < 0 ):
+				return None
+			return result
+		unsigned = ifTrue[1] or ifFalse[1]
+		ifTrue = ( _convert( ifTrue[0], unsigned ), unsigned )
+		ifFalse = ( _convert( ifFalse[0], unsigned ), unsigned )
+		if condition is None:
+			return ifTrue if ifTrue == ifFalse else None
+		return ifTrue if condition[0] else ifFalse
+
+	def _parseBinary( self, minPrecedence ):
+		left = self._parseUnary( )
+		while True:
+			kind, op = self._peek( )
+			precedence = self._binaryPrecedence.get( op ) if kind == "op" else None
+			if precedence is None or precedence < minPrecedence:
+				return left
+			self.pos += 1
+			right = self._parseBinary( precedence + 1 )
+			left = self._apply( op, left, right )
+
+	@staticmethod
+	def _apply( op, left, right ):
+		if op == "&&":
+			if ( left is not None and left[0] == 0 ) or ( right is not None and right[0] == 0 ):
+				return ( 0, False )
+			if left is None or right is None:
+				return None
+			return ( 1, False )
+		if op == "||":
+			if ( left is not None and left[0] != 0 ) or ( right is not None and right[0] != 0 ):
+				return ( 1, False )
+			if left is None or right is None:
+				return None
+			return ( 0, False )
+		if left is None or right is None:
+			return None
+
+		if op in ( "<<", ">>" ):
+			#Shifting by a negative amount or by the width of the type is undefined.
+			if right[0] < 0 or right[0] >= _INTMAX_BITS:
+				return None
+			unsigned = left[1]
+			value = left[0] << right[0] if op == "<<" else left[0] >> right[0]
+			return ( _convert( value, unsigned ), unsigned )
+
+		unsigned = left[1] or right[1]
+		a = _convert( left[0], unsigned )
+		b = _convert( right[0], unsigned )
+		if op in ( "/", "%" ):
+			if b == 0:
+				return None
+			#Division truncates towards zero.
+			quotient = abs( a ) // abs( b )
+			if ( a < 0 ) != ( b < 0 ):
+				quotient = -quotient
+			value = quotient if op == "/" else a - b * quotient
+			return ( _convert( value, unsigned ), unsigned )
+		if op in ( "==", "!=", "<", ">", "<=", ">=" ):
+			return ( int( {
+				"==": lambda: a == b,
+				"!=": lambda: a != b,
+				"<": lambda: a < b,
+				">": lambda: a > b,
+				"<=": lambda: a <= b,
+				">=": lambda: a >= b,
+			}[op]( ) ), False )
+		return ( _convert( {
+			"|": lambda: a | b,
+			"^": lambda: a ^ b,
+			"&": lambda: a & b,
+			"+": lambda: a + b,
+			"-": lambda: a - b,
+			"*": lambda: a * b,
+		}[op]( ), unsigned ), unsigned )
+
+	def _parseUnary( self ):
+		kind, value = self._peek( )
+		if kind == "op" and value in ( "!", "~", "-", "+" ):
+			self.pos += 1
+			operand = self._parseUnary( )
+			if operand is None:
+				return None
+			number, unsigned = operand
+			if value == "!":
+				return ( int( not number ), False )
+			if value == "~":
+				return ( _convert( ~number, unsigned ), unsigned )
+			if value == "-":
+				return ( _convert( -number, unsigned ), unsigned )
+			return operand
+		if kind == "op" and value == "(":
+			self.pos += 1
+			result = self._parseConditional( )
+			self._expect( ")" )
+			return result
+		if kind == "value":
+			self.pos += 1
+			return None if value is None else ( value, False )
+		if kind == "number":
+			self.pos += 1
+			number = _parseNumber( value )
+			if number is None or number > _UINTMAX_MASK:
+				return None
+			#A constant too big for intmax_t is unsigned, whether or not it says so.
+			unsigned = "u" in value.lower( ) or number > _INTMAX_MAX
+			return ( number, unsigned )
+		if kind == "char":
+			self.pos += 1
+			number = _parseChar( value )
+			return None if number is None else ( number, False )
+		raise ValueError( "Unexpected token" )
+
+
+class _MacroState( object ):
+	"""
+	The macros defined at a given point in a translation unit.
+
+	When the complete set of macros the compiler predefines isn't known, any name that hasn't been explicitly
+	defined or undefined might have been predefined, so its state is unknown. Names defined or undefined inside a block
+	that may or may not be active also become unknown.
+	"""
+	def __init__( self, macros, undefined, complete ):
+		#Name -> ( parameter list or None for object-like macros, replacement text )
+		self.macros = dict( macros )
+		self.undefined = set( undefined )
+		self.unknown = set( )
+		self.complete = complete
+
+	def IsDefined( self, name ):
+		"""
+		:return: True or False, or None if it can't be known
+		:rtype: bool or None
+		"""
+		if name in self.macros:
+			return True
+		if name in self.unknown or name in _BUILTIN_MACROS or name.startswith( "__has_" ):
+			return None
+		if self.complete or name in self.undefined:
+			return False
+		return None
+
+	def Define( self, argument, certain ):
+		match = _defineRegex.match( argument )
+		if match is None:
+			return
+		name = match.group( 1 )
+		if not certain:
+			self.MakeUnknown( name )
+			return
+		self.macros[name] = ( match.group( 2 ), match.group( 3 ).strip( ) )
+		self.undefined.discard( name )
+		self.unknown.discard( name )
+
+	def Undefine( self, argument, certain ):
+		match = _identifierRegex.match( argument )
+		if match is None:
+			return
+		name = match.group( 0 )
+		if not certain:
+			self.MakeUnknown( name )
+			return
+		self.macros.pop( name, None )
+		self.undefined.add( name )
+		self.unknown.discard( name )
+
+	def MakeUnknown( self, name ):
+		self.macros.pop( name, None )
+		self.undefined.discard( name )
+		self.unknown.add( name )
+
+	def ExpandText( self, text, depth = 0 ):
+		"""
+		Expand object-like macros in a piece of text, for computed includes.
+
+		:return: The expanded text, or None if it can't be known
+		:rtype: str or None
+		"""
+		match = _identifierRegex.match( text )
+		if match is None or match.end( ) != len( text ) or depth > 32:
+			return text
+		if self.IsDefined( text ) is not True:
+			return None
+		parameters, replacement = self.macros[text]
+		if parameters is not None:
+			return None
+		return self.ExpandText( replacement, depth + 1 )
+
+
+class _UnresolvedInclude( Exception ):
+	pass
+
+
+class _Scanner( object ):
+	def __init__( self, project, macroState ):
+		self.project = project
+		self.macros = macroState
+		self.headers = set( )
+		self.pragmaOnce = set( )
+
+	def Scan( self, path ):
+		"""
+		:return: Full paths of the headers, or None if an include's name couldn't be worked out
+		:rtype: set[str] or None
+		"""
+		try:
+			self._walk( path, 0, True )
+		except _UnresolvedInclude:
+			return None
+		return self.headers
+
+	def _walk( self, path, depth, certain ):
+		if depth > _MAX_INCLUDE_DEPTH:
+			return
+
+		try:
+			guard, directives = _header_cache.GetDirectives( path, ScanDirectives )
+		except (IOError, OSError):
+			return
+
+		if guard is not None and self.macros.IsDefined( guard ) is True:
+			return
+
+		directory = os.path.dirname( path )
+		project = self.project
+
+		#Each entry is [ whether the current branch might be active, whether it's certainly active or certainly
+		#inactive, whether an earlier branch was certainly taken, whether any earlier branch might have been taken ].
+		#A branch that's certainly inactive because the enclosing block is inactive has all of them set to skip.
+		#Nothing in a file included from a branch that might not be active is certain either.
+		stack = [ ]
+		active = True
+
+		for directive, argument in directives:
+			if directive in _CONDITIONAL_DIRECTIVES:
+				if directive in ( "if", "ifdef", "ifndef" ):
+					stack.append( ( active, certain, [ False, False ] ) )
+					if not active:
+						stack[-1][2][0] = True
+						continue
+					result = self._evaluate( directive, argument )
+					active = result is not False
+					certain = certain and result is not None
+					stack[-1][2][0] = result is True
+					stack[-1][2][1] = active
+				elif directive in ( "elif", "elifdef", "elifndef", "else" ):
+					if not stack:
+						continue
+					parentActive, parentCertain, taken = stack[-1]
+					if not parentActive or taken[0]:
+						active = False
+						certain = parentCertain
+						continue
+					if directive == "else":
+						result = True
+					else:
+						result = self._evaluate( directive[2:], argument )
+					active = result is not False
+					#This branch is only certain if every earlier one was certainly not taken.
+					certain = parentCertain and result is not None and not taken[1]
+					taken[0] = result is True
+					taken[1] = taken[1] or active
+				else:
+					if stack:
+						active, certain, _ = stack.pop( )
+				continue
+
+			if not active:
+				continue
+
+			if directive == "define":
+				self.macros.Define( argument, certain )
+			elif directive == "undef":
+				self.macros.Undefine( argument, certain )
+			elif directive == "pragma once":
+				self.pragmaOnce.add( path )
+			elif directive in _INCLUDE_DIRECTIVES:
+				header = self._getIncludedName( argument )
+				if not header:
+					#A computed include that can't be expanded could name any header at all.
+					raise _UnresolvedInclude( )
+
+				subpath = project.get_full_path( header, directory )
+				if not subpath:
+					continue
+				if project.ignoreExternalHeaders and not subpath.startswith( project.workingDirectory ):
+					continue
+
+				self.headers.add( subpath )
+
+				if subpath in self.pragmaOnce:
+					continue
+				if directive == "import":
+					self.pragmaOnce.add( subpath )
+				if project.headerRecursionDepth != 0 and depth + 1 >= project.headerRecursionDepth:
+					continue
+				self._walk( subpath, depth + 1, certain )
+
+	def _getIncludedName( self, argument ):
+		if argument[:1] not in ( '"', "<" ):
+			argument = self.macros.ExpandText( argument )
+			if argument is None:
+				return None
+		if argument[:1] == '"':
+			end = argument.find( '"', 1 )
+		elif argument[:1] == "<":
+			end = argument.find( ">", 1 )
+		else:
+			return None
+		if end == -1:
+			return None
+		return argument[1:end]
+
+	def _evaluate( self, directive, argument ):
+		"""
+		:return: True or False, or None if it can't be known
+		:rtype: bool or None
+		"""
+		if directive == "ifdef":
+			match = _identifierRegex.match( argument )
+			return self.macros.IsDefined( match.group( 0 ) ) if match else None
+		if directive == "ifndef":
+			match = _identifierRegex.match( argument )
+			if match is None:
+				return None
+			defined = self.macros.IsDefined( match.group( 0 ) )
+			return None if defined is None else not defined
+
+		tokens = self._expand( _tokenize( argument ), set( ), 0 )
+		if tokens is None:
+			return None
+		try:
+			value = _ExpressionParser( tokens ).Parse( )
+		except (ValueError, IndexError, OverflowError):
+			return None
+		return None if value is None else value != 0
+
+	def _expand( self, tokens, hidden, depth ):
+		"""
+		Replace defined(), __has_include() and macros in a tokenized #if expression with their values.
+		Returns None if the expression uses a function-like macro, which isn't worth expanding here.
+		"""
+		if tokens is None or depth > 32:
+			return None
+
+		result = [ ]
+		i = 0
+		while i < len( tokens ):
+			kind, value = tokens[i]
+			i += 1
+			if kind != "name":
+				result.append( ( kind, value ) )
+				continue
+
+			if value == "defined" or value in ( "__has_include", "__has_include_next" ):
+				parenthesized = i < len( tokens ) and tokens[i] == ( "op", "(" )
+				if value == "defined":
+					nameIndex = i + 1 if parenthesized else i
+					if nameIndex >= len( tokens ) or tokens[nameIndex][0] != "name":
+						return None
+					defined = self.macros.IsDefined( tokens[nameIndex][1] )
+					i = nameIndex + 1
+					if parenthesized:
+						if i >= len( tokens ) or tokens[i] != ( "op", ")" ):
+							return None
+						i += 1
+					result.append( ( "value", None if defined is None else int( defined ) ) )
+				else:
+					#The argument was tokenized as an expression, so it can't be put back together reliably; whether
+					#the file exists is simply unknown.
+					if not parenthesized:
+						return None
+					nesting = 0
+					while i < len( tokens ):
+						if tokens[i] == ( "op", "(" ):
+							nesting += 1
+						elif tokens[i] == ( "op", ")" ):
+							nesting -= 1
+							if nesting == 0:
+								break
+						i += 1
+					i += 1
+					result.append( ( "value", None ) )
+				continue
+
+			if value in hidden:
+				#A macro that refers to itself isn't expanded again, and is left as an identifier.
+				result.append( ( "value", 0 ) )
+				continue
+
+			defined = self.macros.IsDefined( value )
+			if defined is None:
+				result.append( ( "value", None ) )
+			elif not defined:
+				#Any identifier left after expansion evaluates to 0, except for true in C++.
+				result.append( ( "value", 1 if value == "true" else 0 ) )
+			else:
+				parameters, replacement = self.macros.macros[value]
+				if parameters is not None:
+					return None
+				expanded = self._expand( _tokenize( replacement ), hidden | set( ( value, ) ), depth + 1 )
+				if expanded is None:
+					return None
+				if expanded:
+					result.append( ( "op", "(" ) )
+					result.extend( expanded )
+					result.append( ( "op", ")" ) )
+				else:
+					result.append( ( "value", 0 ) )
+		return result
+
+
+def _getPredefinedMacros( project, baseCommand, isCpp ):
+	key = ( baseCommand, isCpp )
+	with _predefinesLock:
+		if key in _predefinedMacros:
+			return _predefinedMacros[key]
+
+	macros = project.activeToolchain.Compiler( ).GetPredefinedMacros( baseCommand, project, isCpp )
+
+	with _predefinesLock:
+		_predefinedMacros[key] = macros
+	return macros
+
+
+def ParsePredefinedMacros( output ):
+	"""
+	Parse a list of #define directives, such as the output of gcc -dM -E, into a dictionary of macros.
+
+	:param output: The compiler's output
+	:type output: str
+
+	:return: Dictionary of macro name to ( parameter list or None, replacement text )
+	:rtype: dict
+	"""
+	macros = { }
+	for line in output.splitlines( ):
+		line = line.strip( )
+		if not line.startswith( "#define " ):
+			continue
+		match = _defineRegex.match( line[8:] )
+		if match is not None:
+			macros[match.group( 1 )] = ( match.group( 2 ), match.group( 3 ).strip( ) )
+	return macros
+
+
+def RunPredefinedMacroCommand( cmd ):
+	"""
+	Run a compiler command that prints its predefined macros, and parse the result.
+
+	:param cmd: The command line
+	:type cmd: str
+
+	:return: Dictionary of macro name to ( parameter list or None, replacement text ), or None if the command failed
+	:rtype: dict or None
+	"""
+	if platform.system( ) != "Windows":
+		cmd = shlex.split( cmd )
+	try:
+		fd = subprocess.Popen( cmd, stdin = subprocess.PIPE, stdout = subprocess.PIPE, stderr = subprocess.PIPE )
+		output, errors = fd.communicate( b"" )
+	except OSError as e:
+		log.LOG_WARN( "Could not get predefined macros from the compiler: {}".format( e ) )
+		return None
+	if fd.returncode != 0:
+		log.LOG_WARN( "Could not get predefined macros from the compiler: {}".format( errors.strip( ) ) )
+		return None
+	if sys.version_info >= (3, 0):
+		output = output.decode( "utf-8", "replace" )
+	return ParsePredefinedMacros( output )
+
+
+def _getConfiguration( project, sourceFile, forPrecompiledHeader ):
+	baseCommand, settings, isPlainC, _ = csbuild._utils.GetCompileSettings( project, sourceFile, forPrecompiledHeader )
+	predefined = _getPredefinedMacros( project, baseCommand, not isPlainC )
+
+	if predefined is not None:
+		#The compiler's own report already takes the command's defines and undefines into account.
+		macros = predefined
+		undefined = ( )
+		complete = True
+	else:
+		macros = { }
+		for define in settings.defines:
+			name, _, value = define.partition( "=" )
+			macros[name.strip( )] = ( None, value.strip( ) if value else "1" )
+		undefined = set( settings.undefines )
+		for name in undefined:
+			macros.pop( name, None )
+		complete = False
+
+	key = repr( (
+		sorted( macros.items( ) ),
+		sorted( undefined ),
+		complete,
+		project.workingDirectory,
+		list( project.includeDirs ),
+		project.ignoreExternalHeaders,
+		project.headerRecursionDepth,
+	) )
+	if sys.version_info >= (3, 0):
+		key = key.encode( "utf-8" )
+	return hashlib.md5( key ).hexdigest( ), macros, undefined, complete
+
+
+def GetIncludedHeaders( project, sourceFile, forPrecompiledHeader ):
+	"""
+	Get every header a source file includes when compiled for a given project, taking preprocessor conditionals into
+	account.
+
+	:param project: Project the file is being compiled for
+	:type project: csbuild.projectSettings.projectSettings
+
+	:param sourceFile: Full path to the file
+	:type sourceFile: str
+
+	:param forPrecompiledHeader: Whether the file is a precompiled header
+	:type forPrecompiledHeader: bool
+
+	:return: Full paths of the headers, or None if they can't be determined
+	:rtype: set[str] or None
+	"""
+	configuration, macros, undefined, complete = _getConfiguration( project, sourceFile, forPrecompiledHeader )
+
+	headers = _header_cache.GetConfigurationHeaders( configuration, sourceFile )
+	if headers is not None:
+		return set( headers )
+
+	headers = _Scanner( project, _MacroState( macros, undefined, complete ) ).Scan( sourceFile )
+	if headers is not None:
+		_header_cache.SetConfigurationHeaders( configuration, sourceFile, headers )
+	return headers
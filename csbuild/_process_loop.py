@@ -0,0 +1,223 @@
+# Copyright (C) 2013 Jaedyn K. Draper
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Asyncio process loop.
+
+While a build is running, a single asyncio event loop on a thread of its own starts every compiler and linker process,
+reads their output from non-blocking pipes, and collects them when they exit. The threads running compiles and links
+hand their commands over to it and wait for the results, so no thread is ever dedicated to reading a single process's
+output.
+
+Processes are collected with wait4() rather than through asyncio's child watchers, which would take a thread per
+process on some platforms, and would throw away the memory usage the throttle needs. Every running process is listed
+in _shared_globals.subprocesses as usual, so when the build is aborted they're killed straight away along with
+everything else.
+
+Only available on Python 3 and platforms with wait4(). Compiles with --profile read the compiler's output a line at a
+time, as it's written, and always use threads.
+"""
+
+import asyncio
+import concurrent.futures
+import errno
+import os
+import subprocess
+import sys
+import threading
+
+from . import _shared_globals
+from . import _throttle
+
+#Once a process has closed its output, how long to wait before checking whether it's exited, at first and at most.
+_MIN_POLL_SECONDS = 0.001
+_MAX_POLL_SECONDS = 0.05
+
+_loop = None
+_thread = None
+
+
+class _OutputProtocol( asyncio.Protocol ):
+	def __init__( self, process, chunks ):
+		self._process = process
+		self._chunks = chunks
+
+
+	def data_received( self, data ):
+		self._chunks.append( data )
+
+
+	def connection_lost( self, exc ):
+		self._process._pipeClosed( )
+
+
+class _Process( object ):
+	"""
+	A process being run by the loop, from start until it has been collected.
+	"""
+	def __init__( self, cmd, key, cwd, env, future ):
+		self._key = key
+		self._future = future
+		self._out = [ ]
+		self._errors = [ ]
+		self._openPipes = 2
+		self._pollDelay = _MIN_POLL_SECONDS
+
+		self._fd = subprocess.Popen( cmd, stdout = subprocess.PIPE, stderr = subprocess.PIPE, cwd = cwd, env = env )
+		with _shared_globals.spmutex:
+			_shared_globals.subprocesses[key] = self._fd
+
+		for pipe, chunks in ( ( self._fd.stdout, self._out ), ( self._fd.stderr, self._errors ) ):
+			task = _loop.create_task( _loop.connect_read_pipe( lambda chunks = chunks: _OutputProtocol( self, chunks ), pipe ) )
+			task.add_done_callback( self._pipeConnected )
+
+
+	def _pipeConnected( self, task ):
+		if task.exception( ) is not None:
+			self._fd.kill( )
+			self._pipeClosed( )
+
+
+	def _pipeClosed( self ):
+		self._openPipes -= 1
+		if self._openPipes == 0:
+			self._poll( )
+
+
+	def _poll( self ):
+		try:
+			pid, status, usage = os.wait4( self._fd.pid, os.WNOHANG )
+		except OSError as e:
+			if e.errno == errno.EINTR:
+				pid = 0
+			elif e.errno == errno.ECHILD:
+				#Already collected by whoever killed it.
+				self._finish( None )
+				return
+			else:
+				self._finish( None, e )
+				return
+
+		if pid == 0:
+			_loop.call_later( self._pollDelay, self._poll )
+			self._pollDelay = min( self._pollDelay * 2, _MAX_POLL_SECONDS )
+			return
+
+		self._finish( _throttle.RecordExit( self._fd, status, usage ) )
+
+
+	def _finish( self, peakMemory, exception = None ):
+		with _shared_globals.spmutex:
+			_shared_globals.subprocesses.pop( self._key, None )
+
+		if exception is not None:
+			self._future.set_exception( exception )
+		else:
+			returncode = self._fd.returncode if self._fd.returncode is not None else -1
+			self._future.set_result( ( returncode, b"".join( self._out ), b"".join( self._errors ), peakMemory ) )
+
+
+def _startProcess( cmd, key, cwd, env, future ):
+	if not future.set_running_or_notify_cancel( ):
+		return
+	try:
+		_Process( cmd, key, cwd, env, future )
+	except Exception as e:
+		future.set_exception( e )
+
+
+def IsSupported( ):
+	"""
+	:return: Whether processes can be run through the loop on this platform
+	:rtype: bool
+	"""
+	return sys.version_info >= (3, 4) and hasattr( os, "wait4" )
+
+
+def IsRunning( ):
+	"""
+	:return: Whether the loop has been started
+	:rtype: bool
+	"""
+	return _loop is not None
+
+
+def Start( ):
+	"""
+	Start the loop's thread, if it isn't already running.
+	"""
+	global _loop
+	global _thread
+
+	if _loop is not None or not IsSupported( ):
+		return
+
+	_loop = asyncio.new_event_loop( )
+	_thread = threading.Thread( target = _loop.run_forever, name = "csbuild-processes" )
+	_thread.daemon = True
+	_thread.start( )
+
+
+def Stop( ):
+	"""
+	Stop the loop's thread. Nothing should be running through it.
+	"""
+	global _loop
+	global _thread
+
+	if _loop is None:
+		return
+
+	_loop.call_soon_threadsafe( _loop.stop )
+	if _thread is threading.current_thread( ):
+		#Called by csbuild.Exit() from a callback on the loop, which is about to end the process anyway.
+		_loop = None
+		_thread = None
+		return
+	_thread.join( )
+	_loop.close( )
+	_loop = None
+	_thread = None
+
+
+def RunProcess( cmd, key, cwd = None, env = None ):
+	"""
+	Run a process through the loop and wait for it to finish. Must only be called while the loop is running, and not
+	from the loop's own thread.
+
+	:param cmd: Command to run
+	:type cmd: list[str] or str
+
+	:param key: Key the process is listed under in _shared_globals.subprocesses while it's running: the file it creates
+	:type key: str
+
+	:param cwd: Directory to run it in
+	:type cwd: str
+
+	:param env: Environment to run it with
+	:type env: dict[str, str]
+
+	:return: The process's return code, what it wrote to stdout and stderr, and its peak resident memory in bytes, or
+		None if it couldn't be measured
+	:rtype: tuple[int, bytes, bytes, int]
+	"""
+	future = concurrent.futures.Future( )
+	_loop.call_soon_threadsafe( _startProcess, cmd, key, cwd, env, future )
+	return future.result( )
@@ -0,0 +1,530 @@
+# Copyright (C) 2013 Jaedyn K. Draper
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Build graph scheduler.
+
+Runs every step, precompiled header, compile, scrape and link of the build as nodes of a single dependency graph,
+starting each node as soon as its inputs are done, longest chains first, on the pool its type is assigned to.
+"""
+
+import functools
+import heapq
+import itertools
+import sys
+import time
+import traceback
+
+if sys.version_info >= (3,0):
+	import queue
+else:
+	import Queue as queue
+
+import csbuild
+from . import log
+from . import _shared_globals
+from . import _worker_pool
+
+
+class NodeType( object ):
+	"""
+	The kinds of work a build graph is made of.
+	"""
+	STEP = 0
+	PCH = 1
+	COMPILE = 2
+	LINK = 3
+	PREPARE = 4
+	SCRAPE = 5
+
+
+class NodeState( object ):
+	"""
+	The progress of a node through the build.
+	"""
+	WAITING = 0
+	READY = 1
+	RUNNING = 2
+	SUCCEEDED = 3
+	FAILED = 4
+	SKIPPED = 5
+
+
+class Node( object ):
+	"""
+	A single piece of work in the build graph.
+
+	:ivar nodeType: What kind of work the node does
+	:type nodeType: NodeType
+
+	:ivar name: Description of the node, for messages
+	:type name: str
+
+	:ivar project: Project the node belongs to, if any
+	:type project: csbuild.projectSettings.projectSettings
+
+	:ivar inputs: Nodes that have to finish before this one can start
+	:type inputs: list[Node]
+
+	:ivar outputs: Nodes that depend on this one
+	:type outputs: list[Node]
+
+	:ivar state: Progress of the node
+	:type state: NodeState
+
+	:ivar priority: Nodes with lower values are started first when more than one is ready
+	:type priority: int or float
+
+	:ivar startTime: When the node started running, or 0 if it hasn't
+	:type startTime: float
+
+	:ivar endTime: When the node finished running, or 0 if it hasn't
+	:type endTime: float
+
+	:ivar key: Identifies the node from one build to the next, so how long it took can be remembered, or None
+	:type key: str
+
+	:ivar estimate: How long the node is expected to take, in seconds
+	:type estimate: float
+
+	:ivar memory: Most memory the node is expected to use at once, in bytes
+	:type memory: int
+
+	:ivar criticalPath: Estimated time from when the node starts until everything that depends on it is done, as
+		calculated by Scheduler.Prioritize()
+	:type criticalPath: float
+
+	:ivar remote: Remote slot the node was given when it started, or None if it runs locally
+	:type remote: csbuild._distributed.Slot
+	"""
+	def __init__( self, nodeType, name, func, project, key, onReady, onSkip, sequence ):
+		self.nodeType = nodeType
+		self.name = name
+		self.project = project
+		self.key = key
+		self.estimate = 0
+		self.memory = 0
+		self.criticalPath = 0
+		self.remote = None
+		self.inputs = [ ]
+		self.outputs = [ ]
+		self.state = NodeState.WAITING
+		self.priority = 0
+		self.startTime = 0
+		self.endTime = 0
+		self._func = func
+		self._onReady = onReady
+		self._onSkip = onSkip
+		self._sequence = sequence
+		self._waitingOn = 0
+
+
+	def __lt__( self, other ):
+		return ( self.priority, self._sequence ) < ( other.priority, other._sequence )
+
+
+	def __repr__( self ):
+		return "<Node {}>".format( self.name )
+
+
+	def _run( self, jobServer = None ):
+		#Work done on another machine doesn't use up a job on this one.
+		if self.remote is not None:
+			jobServer = None
+		token = jobServer.Acquire( ) if jobServer is not None else None
+		self.startTime = time.time( )
+		try:
+			return self._func( )
+		finally:
+			self.endTime = time.time( )
+			if jobServer is not None:
+				jobServer.Release( token )
+			if self.remote is not None:
+				self.remote.Release( )
+
+
+class Scheduler( object ):
+	"""
+	Runs a graph of nodes, each as soon as everything it depends on is done.
+	"""
+	def __init__( self ):
+		self._nodes = [ ]
+		self._sequence = itertools.count( )
+		self._completed = queue.Queue( )
+		self._pools = { }
+		self._allPools = [ ]
+		self._jobServers = { }
+		self._remotes = { }
+		self._localWorkers = { }
+		self._limits = { }
+		self._admission = None
+		self._ready = { }
+		self._inFlight = { }
+		self._jobs = { }
+		self._stopping = False
+
+
+	def AddPool( self, nodeTypes, numWorkers, name, jobServer = None, remote = None ):
+		"""
+		Create a worker pool to run the given types of node on.
+
+		:param nodeTypes: Types of node run on the pool
+		:type nodeTypes: iterable[NodeType]
+
+		:param numWorkers: Number of nodes the pool runs locally at once
+		:type numWorkers: int
+
+		:param name: Name of the pool's threads
+		:type name: str
+
+		:param jobServer: Jobserver each node run locally on the pool has to take a job from while it runs
+		:type jobServer: csbuild._jobserver.JobServer
+
+		:param remote: Remote slots nodes run on the pool can be given, in addition to the local workers. The pool has a
+			thread for each of them as well.
+		:type remote: csbuild._distributed.RemoteWorkers
+
+		:return: The new pool
+		:rtype: csbuild._worker_pool.WorkerPool
+		"""
+		numRemoteSlots = remote.numSlots if remote is not None else 0
+		pool = _worker_pool.WorkerPool( numWorkers + numRemoteSlots, name, self._completed )
+		self._allPools.append( pool )
+		self._jobServers[pool] = jobServer
+		self._localWorkers[pool] = numWorkers
+		if remote is not None:
+			self._remotes[pool] = remote
+		for nodeType in nodeTypes:
+			self._pools[nodeType] = pool
+		return pool
+
+
+	def SetLimit( self, nodeType, limit ):
+		"""
+		Limit how many nodes of the given type can be in flight at once.
+
+		:param nodeType: Type of node to limit
+		:type nodeType: NodeType
+
+		:param limit: Function taking no arguments that returns the current limit
+		:type limit: callable
+		"""
+		self._limits[nodeType] = limit
+
+
+	def SetAdmission( self, admission ):
+		"""
+		Set a check every node run on a worker pool has to pass before it's started.
+
+		:param admission: Function taking the node and a list of the nodes already started on worker pools, that
+			returns whether the node can start now
+		:type admission: callable
+		"""
+		self._admission = admission
+
+
+	def AddNode( self, nodeType, name, func, project = None, inputs = ( ), onReady = None, onSkip = None, key = None ):
+		"""
+		Add a node to the graph.
+
+		:param nodeType: What kind of work the node does
+		:type nodeType: NodeType
+
+		:param name: Description of the node, for messages
+		:type name: str
+
+		:param func: Function that does the node's work, called with no arguments. The node fails if it returns False
+			or raises an exception.
+		:type func: callable
+
+		:param project: Project the node belongs to, if any
+		:type project: csbuild.projectSettings.projectSettings
+
+		:param inputs: Nodes that have to finish before this one can start
+		:type inputs: iterable[Node]
+
+		:param onReady: Function called with the node when all of its inputs have finished
+		:type onReady: callable
+
+		:param onSkip: Function called with the node if it's skipped because an input failed or the build was stopped
+		:type onSkip: callable
+
+		:param key: Identifies the node from one build to the next
+		:type key: str
+
+		:return: The new node
+		:rtype: Node
+		"""
+		node = Node( nodeType, name, func, project, key, onReady, onSkip, next( self._sequence ) )
+		self._nodes.append( node )
+		for inputNode in inputs:
+			self.AddInput( node, inputNode )
+		return node
+
+
+	def AddInput( self, node, inputNode ):
+		"""
+		Make a node wait for another to finish before it starts.
+
+		:param node: Node that has to wait
+		:type node: Node
+
+		:param inputNode: Node it has to wait for
+		:type inputNode: Node
+		"""
+		if inputNode in node.inputs:
+			return
+		node.inputs.append( inputNode )
+		inputNode.outputs.append( node )
+		node._waitingOn += 1
+
+
+	def GetNodes( self ):
+		"""
+		:return: Every node in the graph, in the order they were added
+		:rtype: list[Node]
+		"""
+		return list( self._nodes )
+
+
+	def Prioritize( self ):
+		"""
+		Set each node's priority so that, of the nodes that are ready, the ones with the longest estimated chain of work
+		still ahead of them are started first. Nodes' estimates should be filled in before calling this.
+		"""
+		lengths, _ = self._longestPaths( lambda node: node.estimate )
+		for node, length in lengths.items( ):
+			node.criticalPath = length
+			node.priority = -length
+
+
+	def GetCriticalPath( self, duration ):
+		"""
+		Find the longest chain of nodes in the graph, each depending on the one before it.
+
+		:param duration: Function returning how long a node takes
+		:type duration: callable
+
+		:return: The nodes in the chain, in the order they have to run
+		:rtype: list[Node]
+		"""
+		lengths, nextNodes = self._longestPaths( duration )
+		if not lengths:
+			return [ ]
+
+		#A node that takes no time ties with the chain that follows it, so prefer chains that start at the beginning.
+		node = max( lengths, key = lambda node: ( lengths[node], not node.inputs ) )
+		path = [ ]
+		while node is not None:
+			path.append( node )
+			node = nextNodes[node]
+		return path
+
+
+	def GetFinishingPath( self ):
+		"""
+		Find the chain of nodes that decided when the graph finished: the last node to finish, then whichever of its
+		inputs finished last, and so on back to the start. Only nodes that ran are considered.
+
+		:return: The nodes in the chain, in the order they ran
+		:rtype: list[Node]
+		"""
+		ran = [ node for node in self._nodes if node.endTime ]
+		if not ran:
+			return [ ]
+
+		path = [ ]
+		node = max( ran, key = lambda node: node.endTime )
+		while node is not None:
+			path.append( node )
+			inputs = [ inputNode for inputNode in node.inputs if inputNode.endTime ]
+			node = max( inputs, key = lambda inputNode: inputNode.endTime ) if inputs else None
+		path.reverse( )
+		return path
+
+
+	def _longestPaths( self, duration ):
+		"""
+		:return: The length of the longest chain starting at each node, and the next node along that chain
+		:rtype: tuple[dict[Node, float], dict[Node, Node]]
+		"""
+		#Kahn's algorithm, starting from the nodes nothing depends on. Nodes in a dependency loop are left out.
+		remaining = dict( ( node, len( node.outputs ) ) for node in self._nodes )
+		order = [ node for node in self._nodes if not node.outputs ]
+		lengths = { }
+		nextNodes = { }
+		for node in order:
+			nextNode = None
+			for output in node.outputs:
+				if nextNode is None or lengths[output] > lengths[nextNode]:
+					nextNode = output
+			lengths[node] = duration( node ) + ( lengths[nextNode] if nextNode is not None else 0 )
+			nextNodes[node] = nextNode
+
+			for inputNode in node.inputs:
+				remaining[inputNode] -= 1
+				if remaining[inputNode] == 0:
+					order.append( inputNode )
+		return lengths, nextNodes
+
+
+	def Run( self ):
+		"""
+		Run the graph to completion. If the build is interrupted, csbuild exits from here.
+
+		:return: Nodes that never ran because they depend on each other, directly or not. These are skipped.
+		:rtype: list[Node]
+		"""
+		for node in self._nodes:
+			if node._waitingOn == 0:
+				self._makeReady( node )
+
+		self._dispatch( )
+		while self._jobs:
+			job = None
+			try:
+				job = self._completed.get( True, 0.5 )
+			except queue.Empty:
+				pass
+
+			if _shared_globals.interrupted:
+				csbuild.Exit( 2 )
+			if job is None:
+				#Whatever held nodes back might have changed in the meantime.
+				self._dispatch( )
+				continue
+
+			node = self._jobs.pop( job )
+			self._inFlight[node.nodeType] -= 1
+			self._finish( node, job.exception is None and job.result is not False )
+			self._dispatch( )
+
+		stuck = [ node for node in self._nodes if node.state == NodeState.WAITING ]
+		for node in stuck:
+			self._skip( node )
+
+		for pool in self._allPools:
+			pool.Stop( )
+		return stuck
+
+
+	def _makeReady( self, node ):
+		node.state = NodeState.READY
+		if node._onReady is not None:
+			node._onReady( node )
+		heapq.heappush( self._ready.setdefault( node.nodeType, [ ] ), node )
+
+
+	def _canStart( self, node ):
+		pool = self._pools.get( node.nodeType )
+		if pool is None:
+			return True
+
+		limit = self._limits.get( node.nodeType )
+		if limit is not None and self._inFlight.get( node.nodeType, 0 ) >= limit( ):
+			return False
+		if pool.pending + pool.running >= pool.numWorkers:
+			return False
+
+		remote = self._remotes.get( pool )
+		if remote is not None:
+			node.remote = remote.Reserve( node )
+			if node.remote is not None:
+				return True
+
+		runningLocally = [ runningNode for runningNode in self._jobs.values( ) if runningNode.remote is None ]
+		if len( [ runningNode for runningNode in runningLocally if self._pools[runningNode.nodeType] is pool ] ) >= \
+				self._localWorkers[pool]:
+			return False
+		return self._admission is None or self._admission( node, runningLocally )
+
+
+	def _dispatch( self ):
+		startedSomething = True
+		while startedSomething and not self._stopping:
+			startedSomething = False
+			for nodeType, ready in sorted( self._ready.items( ) ):
+				while ready and not self._stopping and self._canStart( ready[0] ):
+					node = heapq.heappop( ready )
+					node.state = NodeState.RUNNING
+					startedSomething = True
+
+					pool = self._pools.get( nodeType )
+					if pool is None:
+						#Nodes without a pool run on this thread. As in a pool, an exception only fails the node, not the build.
+						try:
+							succeeded = node._run( ) is not False
+						except Exception:
+							log.LOG_ERROR( "{} failed:\n{}".format( node.name, traceback.format_exc( ) ) )
+							succeeded = False
+						self._finish( node, succeeded )
+					else:
+						self._inFlight[nodeType] = self._inFlight.get( nodeType, 0 ) + 1
+						self._jobs[pool.Submit( functools.partial( node._run, self._jobServers[pool] ), node.priority )] = node
+
+
+	def _finish( self, node, succeeded ):
+		if not succeeded:
+			node.state = NodeState.FAILED
+			#Not every node that fails reports it itself, and one that raised certainly hasn't.
+			_shared_globals.build_success = False
+			if _shared_globals.stopOnError:
+				self._stop( )
+			for output in node.outputs:
+				self._skip( output )
+			return
+
+		node.state = NodeState.SUCCEEDED
+		for output in node.outputs:
+			output._waitingOn -= 1
+			if output._waitingOn == 0 and output.state == NodeState.WAITING:
+				self._makeReady( output )
+
+
+	def _skip( self, node ):
+		if node.state not in ( NodeState.WAITING, NodeState.READY ):
+			return
+		node.state = NodeState.SKIPPED
+		if node._onSkip is not None:
+			node._onSkip( node )
+		for output in node.outputs:
+			self._skip( output )
+
+
+	def _stop( self ):
+		"""
+		Stop starting new work, and skip everything that hasn't been started yet.
+		"""
+		if self._stopping:
+			return
+		self._stopping = True
+
+		for pool in self._allPools:
+			for job in pool.CancelPending( ):
+				node = self._jobs.pop( job )
+				self._inFlight[node.nodeType] -= 1
+				if node.remote is not None:
+					node.remote.Release( )
+					node.remote = None
+				node.state = NodeState.READY
+				self._skip( node )
+
+		for node in self._nodes:
+			self._skip( node )
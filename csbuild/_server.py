@@ -0,0 +1,332 @@
+# Copyright (C) 2013 Jaedyn K. Draper
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""
+Build server.
+
+Running a makefile with --server evaluates it and expands every project for the requested targets, toolchains and
+architectures once, loads the header and hash caches, and then waits on a local socket instead of building. Running
+the same makefile with --use-server sends the command line to that server instead of evaluating the makefile again.
+
+The server handles each request by forking: the child inherits the already-evaluated projects and warm caches,
+carries on with the rest of a normal build (file discovery, dependency checks, compiling and linking), and exits. Its
+output is relayed back to the client, which exits with the build's return code. Because the child does the build, the
+server's own state is never modified by one, so every request starts from the same freshly evaluated graph.
+
+A request is only served if its command line selects the same projects and settings the server was started with;
+options that only affect how a build is carried out (verbosity, job counts, --rebuild, --clean and so on) may differ.
+If any script the makefile ran has changed since it was evaluated, the server refuses the request and restarts
+itself. Whenever a request is refused, or no server is running, the client just runs the build itself.
+
+Only available on platforms with fork() and Unix domain sockets.
+"""
+
+import errno
+import json
+import os
+import select
+import signal
+import socket
+import struct
+import sys
+
+from . import log
+from . import _shared_globals
+
+_FRAME_HEADER = struct.Struct( "<BI" )
+
+_REQUEST = 0
+_STDOUT = 1
+_STDERR = 2
+_EXIT = 3
+_REFUSED = 4
+
+
+def IsSupported( ):
+	"""
+	:return: Whether the build server can be used on this platform
+	:rtype: bool
+	"""
+	return hasattr( os, "fork" ) and hasattr( socket, "AF_UNIX" )
+
+
+def GetSocketPath( ):
+	"""
+	:return: Path to the socket the server for this makefile listens on
+	:rtype: str
+	"""
+	return os.path.join( os.path.dirname( _shared_globals.cacheDirectory ), "server.sock" )
+
+
+def _sendFrame( sock, kind, payload ):
+	sock.sendall( _FRAME_HEADER.pack( kind, len( payload ) ) + payload )
+
+
+def _recvExactly( sock, length ):
+	chunks = []
+	while length:
+		data = sock.recv( min( length, 65536 ) )
+		if not data:
+			raise EOFError( )
+		chunks.append( data )
+		length -= len( data )
+	return b"".join( chunks )
+
+
+def _recvFrame( sock ):
+	kind, length = _FRAME_HEADER.unpack( _recvExactly( sock, _FRAME_HEADER.size ) )
+	return kind, _recvExactly( sock, length )
+
+
+def _writeOutput( fd, data ):
+	#Straight to the file descriptor: the build's output already went through the logger once, on the server's side.
+	while data:
+		written = os.write( fd, data )
+		data = data[written:]
+
+
+def RunClient( argv ):
+	"""
+	Ask a running build server to carry out a build.
+
+	:param argv: Command line arguments for the build
+	:type argv: list[str]
+
+	:return: The build's exit code, or None if no server took the request and the build should run locally
+	:rtype: int or None
+	"""
+	if not IsSupported( ):
+		return None
+
+	socketPath = GetSocketPath( )
+	if not os.path.exists( socketPath ):
+		log.LOG_INFO( "No build server is running, building locally." )
+		return None
+
+	sys.stdout.flush( )
+	sock = socket.socket( socket.AF_UNIX, socket.SOCK_STREAM )
+	try:
+		sock.connect( socketPath )
+	except socket.error as e:
+		log.LOG_INFO( "Could not connect to build server ({}), building locally.".format( e ) )
+		sock.close( )
+		return None
+
+	request = { "argv": argv, "tty": os.isatty( 1 ) }
+	try:
+		_sendFrame( sock, _REQUEST, json.dumps( request ).encode( "utf-8" ) )
+
+		while True:
+			kind, payload = _recvFrame( sock )
+			if kind == _STDOUT:
+				_writeOutput( 1, payload )
+			elif kind == _STDERR:
+				_writeOutput( 2, payload )
+			elif kind == _EXIT:
+				return int( payload.decode( "utf-8" ) )
+			elif kind == _REFUSED:
+				log.LOG_INFO( "Build server declined the request ({}), building locally.".format( payload.decode( "utf-8" ) ) )
+				return None
+	except (EOFError, socket.error) as e:
+		log.LOG_ERROR( "Lost connection to the build server: {}".format( e ) )
+		return 1
+	finally:
+		sock.close( )
+
+
+def _getScriptStamps( scripts ):
+	stamps = { }
+	for script in scripts:
+		try:
+			st = os.stat( script )
+			stamps[script] = ( st.st_mtime, st.st_size )
+		except OSError:
+			stamps[script] = None
+	return stamps
+
+
+def _relayBuild( conn, pid, stdoutRead, stderrRead ):
+	streams = { stdoutRead: _STDOUT, stderrRead: _STDERR }
+	clientGone = False
+	while streams:
+		try:
+			readable, _, _ = select.select( list( streams ), [], [] )
+		except select.error as e:
+			if e.args[0] == errno.EINTR:
+				continue
+			raise
+		for fd in readable:
+			data = os.read( fd, 65536 )
+			if not data:
+				os.close( fd )
+				del streams[fd]
+				continue
+			if clientGone:
+				continue
+			try:
+				_sendFrame( conn, streams[fd], data )
+			except socket.error:
+				#Nobody is waiting for this build any more, so abort it the same way ctrl+c would.
+				log.LOG_WARN_NOPUSH( "Build client disconnected, aborting its build." )
+				clientGone = True
+				try:
+					os.kill( pid, signal.SIGINT )
+				except OSError:
+					pass
+
+	_, status = os.waitpid( pid, 0 )
+	if os.WIFEXITED( status ):
+		code = os.WEXITSTATUS( status )
+	else:
+		code = 1
+
+	if not clientGone:
+		try:
+			_sendFrame( conn, _EXIT, str( code ).encode( "utf-8" ) )
+		except socket.error:
+			pass
+	return code
+
+
+def Serve( scripts, restartCommand, checkRequest, refresh ):
+	"""
+	Wait for build requests and fork a child to handle each one. This only returns in the child processes, which should
+	go on to carry out the build.
+
+	:param scripts: Every script that was run while evaluating the makefile
+	:type scripts: iterable[str]
+
+	:param restartCommand: Command line that starts this server again, used when the scripts change
+	:type restartCommand: list[str]
+
+	:param checkRequest: Called with a request's command line. Returns None if the request can be served, or a string
+	explaining why not.
+	:type checkRequest: function
+
+	:param refresh: Called in the server after each build, to bring any state the build may have changed on disk back
+	up to date.
+	:type refresh: function
+
+	:return: The request being handled, as a dict containing "argv" and "tty", or None if the server couldn't start
+	:rtype: dict or None
+	"""
+	socketPath = GetSocketPath( )
+	if os.path.exists( socketPath ):
+		probe = socket.socket( socket.AF_UNIX, socket.SOCK_STREAM )
+		try:
+			probe.connect( socketPath )
+		except socket.error:
+			#Left behind by a server that didn't shut down cleanly.
+			os.remove( socketPath )
+		else:
+			log.LOG_ERROR( "A build server is already running for this makefile ({}).".format( socketPath ) )
+			return None
+		finally:
+			probe.close( )
+
+	serverPid = os.getpid( )
+
+	scriptStamps = _getScriptStamps( scripts )
+
+	server = socket.socket( socket.AF_UNIX, socket.SOCK_STREAM )
+	server.bind( socketPath )
+	server.listen( 8 )
+
+	previousHandlers = { }
+
+	def _shutdown( sig, frame ):
+		#The usual signal handlers exit immediately, without unwinding, so the socket has to be removed here.
+		if os.path.exists( socketPath ):
+			os.remove( socketPath )
+		handler = previousHandlers[sig]
+		if callable( handler ):
+			handler( sig, frame )
+		else:
+			os._exit( 128 + sig )
+
+	for sig in ( signal.SIGINT, signal.SIGTERM ):
+		previousHandlers[sig] = signal.signal( sig, _shutdown )
+
+	log.LOG_BUILD( "Build server listening on {}".format( socketPath ) )
+
+	try:
+		while True:
+			conn, _ = server.accept( )
+			try:
+				kind, payload = _recvFrame( conn )
+				if kind != _REQUEST:
+					continue
+				request = json.loads( payload.decode( "utf-8" ) )
+
+				if _getScriptStamps( scriptStamps ) != scriptStamps:
+					_sendFrame( conn, _REFUSED, b"makefile has changed, server is restarting" )
+					conn.close( )
+					log.LOG_BUILD( "Makefile scripts have changed, restarting build server." )
+					server.close( )
+					os.remove( socketPath )
+					sys.stdout.flush( )
+					sys.stderr.flush( )
+					_shared_globals.logFile.flush( )
+					os.execv( restartCommand[0], restartCommand )
+
+				reason = checkRequest( request["argv"] )
+				if reason is not None:
+					_sendFrame( conn, _REFUSED, reason.encode( "utf-8" ) )
+					continue
+
+				log.LOG_BUILD( "Building: {}".format( " ".join( request["argv"] ) ) )
+
+				stdoutRead, stdoutWrite = os.pipe( )
+				stderrRead, stderrWrite = os.pipe( )
+
+				sys.stdout.flush( )
+				sys.stderr.flush( )
+				_shared_globals.logFile.flush( )
+
+				pid = os.fork( )
+				if pid == 0:
+					for sig, handler in previousHandlers.items( ):
+						signal.signal( sig, handler )
+					server.close( )
+					conn.close( )
+					os.close( stdoutRead )
+					os.close( stderrRead )
+					os.dup2( stdoutWrite, 1 )
+					os.dup2( stderrWrite, 2 )
+					os.close( stdoutWrite )
+					os.close( stderrWrite )
+					return request
+
+				os.close( stdoutWrite )
+				os.close( stderrWrite )
+
+				code = _relayBuild( conn, pid, stdoutRead, stderrRead )
+				log.LOG_BUILD( "Build finished with exit code {}".format( code ) )
+				refresh( )
+			except (EOFError, socket.error, ValueError) as e:
+				log.LOG_WARN_NOPUSH( "Dropped build request: {}".format( e ) )
+			finally:
+				conn.close( )
+	finally:
+		#The children return through here too, and must leave the socket for the server.
+		if os.getpid( ) == serverPid and os.path.exists( socketPath ):
+			server.close( )
+			os.remove( socketPath )
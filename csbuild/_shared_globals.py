@@ -31,6 +31,9 @@ are documented here. Others are left undocumented.
 :var max_threads: Number of threads available for compilation
 :type max_threads: int
 
+:var compilePool: Worker pool that runs compiles while a build is in progress
+:type compilePool: csbuild._worker_pool.WorkerPool
+
 :var build_success: Whether or not the build succeeded
 :type build_success: bool
 
@@ -142,8 +145,7 @@ columns = terminfo.TermInfo.GetNumColumns( ) if color_supported else 0
 max_threads = multiprocessing.cpu_count( )
 max_linker_threads = max_threads
 
-semaphore = threading.BoundedSemaphore( value = max_threads )
-link_semaphore = threading.BoundedSemaphore( value = max_linker_threads )
+compilePool = None
 
 lock = threading.Lock( )
 
@@ -157,7 +159,6 @@ interrupted = False
 
 show_commands = False
 
-oldmd5s = { }
 newmd5s = { }
 
 times = []
@@ -190,9 +191,9 @@ install_libdir = "{prefix}/lib"
 install_incdir = "{prefix}/include"
 
 makefile_dict = { }
+makefileScripts = set( )
 
 allheaders = { }
-headerPaths = {}
 headerCheck = {}
 
 current_compile = 1
@@ -222,6 +223,16 @@ rebuild = False
 sgmutex = threading.Lock( )
 
 stopOnError = False
+criticalPathReport = False
+useJobServer = True
+processBackend = "asyncio"
+processTimeout = None
+timeoutRetries = 0
+distributedWorkers = [ ]
+objectCacheDir = None
+objectCacheSize = None
+memoryBudget = None
+maxLoad = None
 
 target_list = []
 
@@ -0,0 +1,281 @@
+# Copyright (C) 2013 Jaedyn K. Draper
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""
+Process-wide stat cache.
+
+Every project, target, architecture and toolchain combination checks the same object, chunk, header and output files,
+so the results of os.stat are kept here for the whole run instead of being asked for over and over. The first time a
+file in a given directory is looked up, the whole directory is listed in one os.scandir() pass; after that, a file
+that isn't in the listing is known not to exist without touching the filesystem, and on platforms where scandir
+returns stat information along with the listing (Windows), the stat is free as well.
+
+csbuild calls Invalidate() on every file it writes or deletes itself. Build steps from makefiles and plugins can
+write anything, so the whole cache is dropped after any of them runs.
+"""
+
+import os
+import stat
+import threading
+
+try:
+	from os import scandir as _scandir
+except:
+	try:
+		from scandir import scandir as _scandir
+	except:
+		_scandir = None
+
+_lock = threading.Lock( )
+
+#normcase'd directory -> { normcase'd name: DirEntry, or None if the entry needs to be stat'ed directly }
+_listings = { }
+#normcase'd path -> stat result, or None if the path doesn't exist
+_stats = { }
+#Bumped on every invalidation, so results computed while an invalidation happened are never stored.
+_generation = 0
+
+
+def _normalize( path ):
+	return os.path.normcase( os.path.abspath( path ) )
+
+
+def _listDirectory( directory ):
+	if _scandir is not None:
+		listing = { }
+		it = _scandir( directory )
+		try:
+			for entry in it:
+				listing[os.path.normcase( entry.name )] = entry
+		finally:
+			if hasattr( it, "close" ):
+				it.close( )
+		return listing
+	return dict( ( os.path.normcase( name ), None ) for name in os.listdir( directory ) )
+
+
+def _getListing( directory ):
+	try:
+		return _listings[directory]
+	except KeyError:
+		pass
+
+	generation = _generation
+	try:
+		listing = _listDirectory( directory )
+	except OSError:
+		listing = { }
+		#Distinguish a directory that doesn't exist (nothing in it can exist) from one we just can't list.
+		if os.path.isdir( directory ):
+			return None
+
+	with _lock:
+		if generation == _generation:
+			_listings[directory] = listing
+	return listing
+
+
+def _stat( path ):
+	try:
+		return _stats[path]
+	except KeyError:
+		pass
+
+	generation = _generation
+	directory, name = os.path.split( path )
+	listing = _getListing( directory ) if name else None
+	result = None
+
+	if listing is None or name not in listing or listing[name] is None:
+		if listing is None or name in listing:
+			try:
+				result = os.stat( path )
+			except OSError:
+				result = None
+	else:
+		try:
+			result = listing[name].stat( )
+		except OSError:
+			#Dangling symlink, or the file was removed since the directory was listed.
+			result = None
+
+	with _lock:
+		if generation == _generation:
+			_stats[path] = result
+	return result
+
+
+def Stat( path ):
+	"""
+	Get the stat information for a file, following symlinks.
+
+	:param path: Path to the file
+	:type path: str
+
+	:return: The file's stat result, or None if it doesn't exist
+	:rtype: os.stat_result or None
+	"""
+	return _stat( _normalize( path ) )
+
+
+def Exists( path ):
+	"""
+	Cached equivalent of os.access( path, os.F_OK ).
+
+	:param path: Path to the file or directory
+	:type path: str
+
+	:rtype: bool
+	"""
+	return _stat( _normalize( path ) ) is not None
+
+
+def IsDir( path ):
+	"""
+	Cached equivalent of os.path.isdir( path ).
+
+	:param path: Path to check
+	:type path: str
+
+	:rtype: bool
+	"""
+	st = _stat( _normalize( path ) )
+	return st is not None and stat.S_ISDIR( st.st_mode )
+
+
+def GetModificationTime( path ):
+	"""
+	Cached equivalent of os.path.getmtime( path ).
+
+	:param path: Path to the file
+	:type path: str
+
+	:raises OSError: if the file doesn't exist
+
+	:rtype: float
+	"""
+	st = _stat( _normalize( path ) )
+	if st is None:
+		raise OSError( 2, "No such file or directory", path )
+	return st.st_mtime
+
+
+def GetSize( path ):
+	"""
+	Cached equivalent of os.path.getsize( path ).
+
+	:param path: Path to the file
+	:type path: str
+
+	:raises OSError: if the file doesn't exist
+
+	:rtype: int
+	"""
+	st = _stat( _normalize( path ) )
+	if st is None:
+		raise OSError( 2, "No such file or directory", path )
+	return st.st_size
+
+
+def GetSignature( st ):
+	"""
+	Reduce a stat result to the parts that change whenever the file's contents do.
+
+	:param st: Result of Stat()
+	:type st: os.stat_result
+
+	:return: (size, mtime in nanoseconds) tuple
+	:rtype: tuple
+	"""
+	if hasattr( st, "st_mtime_ns" ):
+		return ( st.st_size, st.st_mtime_ns )
+	return ( st.st_size, int( st.st_mtime * 1000000000 ) )
+
+
+def Invalidate( path ):
+	"""
+	Forget everything known about a path. Must be called whenever csbuild creates, modifies or removes a file.
+
+	:param path: Path to the file or directory that changed
+	:type path: str
+	"""
+	global _generation
+
+	path = _normalize( path )
+
+	with _lock:
+		_generation += 1
+		#The path might be a directory we've listed, which may have been removed or replaced.
+		_listings.pop( path, None )
+		#Writing a file can also create the directories above it, so walk up the whole chain. Entries marked None in a
+		#listing are stat'ed directly the next time they're asked for.
+		while True:
+			_stats.pop( path, None )
+			directory, name = os.path.split( path )
+			if not name:
+				break
+			listing = _listings.get( directory )
+			if listing is not None:
+				listing[name] = None
+			path = directory
+
+
+def Clear( ):
+	"""
+	Forget everything. Used after running build steps, which may have changed any file.
+	"""
+	global _generation
+
+	with _lock:
+		_generation += 1
+		_listings.clear( )
+		_stats.clear( )
+
+
+def Retain( directories ):
+	"""
+	Forget everything except the listings of the given directories and the files directly inside them. Used by watch
+	mode, which is told about every change made in the directories it watches, but not about changes made elsewhere.
+
+	:param directories: Directories whose entries should be kept
+	:type directories: iterable[str]
+	"""
+	global _generation
+
+	directories = set( _normalize( directory ) for directory in directories )
+
+	with _lock:
+		_generation += 1
+		for directory in list( _listings ):
+			if directory not in directories:
+				del _listings[directory]
+		for path in list( _stats ):
+			if os.path.dirname( path ) not in directories:
+				del _stats[path]
+
+
+def GetGeneration( ):
+	"""
+	:return: A number that changes whenever anything in the cache is invalidated, so that anything derived from the
+	cache's contents can tell when it needs to be recomputed
+	:rtype: int
+	"""
+	return _generation
@@ -0,0 +1,218 @@
+# Copyright (C) 2013 Jaedyn K. Draper
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Memory and load throttle.
+
+Holds back compiles and links that would take the build over its memory budget or the system over its maximum load
+average, using the peak memory each one used the last time it ran.
+"""
+
+import errno
+import os
+import re
+import sys
+import threading
+
+_SIZE_SUFFIXES = {
+	"": 1024 * 1024,
+	"k": 1024,
+	"m": 1024 * 1024,
+	"g": 1024 * 1024 * 1024,
+	"t": 1024 * 1024 * 1024 * 1024,
+}
+
+
+def ParseSize( value ):
+	"""
+	Parse a memory size given on the command line, such as 512M or 16G. Plain numbers are in megabytes.
+
+	:param value: Size to parse
+	:type value: str
+
+	:return: The size, in bytes
+	:rtype: int
+
+	:raises ValueError: If the size can't be parsed
+	"""
+	match = re.match( r"^\s*(\d+(?:\.\d+)?)\s*([kmgt]?)b?\s*$", value, re.IGNORECASE )
+	if not match:
+		raise ValueError( "Invalid memory size '{}'".format( value ) )
+	return int( float( match.group( 1 ) ) * _SIZE_SUFFIXES[match.group( 2 ).lower( )] )
+
+
+def GetAvailableMemory( ):
+	"""
+	:return: Memory that can be used without the system having to swap, in bytes, or None if it can't be determined
+	:rtype: int
+	"""
+	try:
+		with open( "/proc/meminfo", "r" ) as f:
+			meminfo = f.read( )
+	except IOError:
+		return None
+
+	values = { }
+	for line in meminfo.splitlines( ):
+		match = re.match( r"^(\w+):\s+(\d+) kB", line )
+		if match:
+			values[match.group( 1 )] = int( match.group( 2 ) ) * 1024
+
+	if "MemAvailable" in values:
+		return values["MemAvailable"]
+	#Kernels before 3.14 don't estimate it for us.
+	if "MemFree" in values:
+		return values["MemFree"] + values.get( "Buffers", 0 ) + values.get( "Cached", 0 )
+	return None
+
+
+def GetLoadAverage( ):
+	"""
+	:return: The system's load average over the last minute, or None if it doesn't have one
+	:rtype: float
+	"""
+	try:
+		return os.getloadavg( )[0]
+	except (AttributeError, OSError):
+		return None
+
+
+def WaitForProcess( fd ):
+	"""
+	Wait for a process to exit, and measure the most memory it and the processes it ran used at once.
+
+	:param fd: Process to wait for
+	:type fd: subprocess.Popen
+
+	:return: Peak resident memory, in bytes, or None if it couldn't be measured
+	:rtype: int
+	"""
+	if not hasattr( os, "wait4" ):
+		fd.wait( )
+		return None
+
+	while True:
+		try:
+			_, status, usage = os.wait4( fd.pid, 0 )
+			break
+		except OSError as e:
+			if e.errno == errno.EINTR:
+				continue
+			if e.errno == errno.ECHILD:
+				#Someone else already collected it.
+				fd.wait( )
+				return None
+			raise
+
+	return RecordExit( fd, status, usage )
+
+
+def RecordExit( fd, status, usage ):
+	"""
+	Fill in the return code of a process collected with wait4().
+
+	:param fd: The process
+	:type fd: subprocess.Popen
+
+	:param status: Exit status returned by wait4()
+	:type status: int
+
+	:param usage: Resource usage returned by wait4()
+	:type usage: resource.struct_rusage
+
+	:return: Peak resident memory of the process and the processes it ran, in bytes
+	:rtype: int
+	"""
+	if os.WIFSIGNALED( status ):
+		fd.returncode = -os.WTERMSIG( status )
+	else:
+		fd.returncode = os.WEXITSTATUS( status )
+
+	#Everyone but macOS reports kilobytes.
+	if sys.platform == "darwin":
+		return usage.ru_maxrss
+	return usage.ru_maxrss * 1024
+
+
+def Communicate( fd ):
+	"""
+	Read everything a process writes to stdout and stderr, then wait for it to exit, measuring its peak memory.
+
+	:param fd: Process started with stdout and stderr piped
+	:type fd: subprocess.Popen
+
+	:return: What the process wrote to stdout and stderr, and its peak resident memory in bytes, or None if it couldn't
+		be measured
+	:rtype: tuple[bytes, bytes, int]
+	"""
+	errors = [ ]
+	errorThread = threading.Thread( target = lambda: errors.append( fd.stderr.read( ) ) )
+	errorThread.start( )
+	out = fd.stdout.read( )
+	errorThread.join( )
+	fd.stdout.close( )
+	fd.stderr.close( )
+	return out, errors[0], WaitForProcess( fd )
+
+
+class Throttle( object ):
+	"""
+	Decides whether the build graph scheduler can start a compile or link yet.
+
+	:param memoryBudget: Most memory the compiles and links running at once are expected to need, in bytes, or None
+		for no limit
+	:type memoryBudget: int
+
+	:param maxLoad: Load average above which nothing new is started, or None for no limit
+	:type maxLoad: float
+	"""
+	def __init__( self, memoryBudget, maxLoad ):
+		self.memoryBudget = memoryBudget
+		self.maxLoad = maxLoad
+
+
+	def __call__( self, node, running ):
+		"""
+		:param node: Node that's ready to start
+		:type node: csbuild._scheduler.Node
+
+		:param running: Nodes that have already been started on a worker pool
+		:type running: list[csbuild._scheduler.Node]
+
+		:return: Whether the node can start now
+		:rtype: bool
+		"""
+		if not running:
+			return True
+
+		if self.maxLoad is not None:
+			load = GetLoadAverage( )
+			if load is not None and load > self.maxLoad:
+				return False
+
+		if not node.memory:
+			return True
+
+		committed = sum( runningNode.memory for runningNode in running )
+		if self.memoryBudget is not None and committed + node.memory > self.memoryBudget:
+			return False
+
+		available = GetAvailableMemory( )
+		return available is None or node.memory <= available
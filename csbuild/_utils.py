@@ -18,6 +18,7 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import errno
 import os
 import re
 import hashlib
@@ -31,8 +32,9 @@ import glob
 import traceback
 import platform
 import collections
+import mmap
+import io
 if sys.version_info >= (3,0):
-	import io
 	StringIO = io.StringIO
 else:
 	import cStringIO
@@ -41,6 +43,19 @@ else:
 import csbuild
 from . import log
 from . import _shared_globals
+from . import _header_cache
+from . import _hash_db
+from . import _stat_cache
+from . import _include_resolver
+from . import _throttle
+from . import _watchdog
+from . import _distributed
+from . import _object_cache
+
+try:
+	from . import _process_loop
+except ImportError:
+	_process_loop = None
 
 class OrderedSet(object):
 	def __init__(self, iterable=None):
@@ -139,72 +154,241 @@ class OrderedSet(object):
 		self.map = collections.OrderedDict()
 
 
-def remove_comments( text ):
-	def replacer( match ):
-		s = match.group( 0 )
-		if s.startswith( '/' ):
-			return ""
+#Comments and string/character literals. Literals are matched so comment markers inside them aren't treated as
+#comments; everything between two matches is ordinary code. C++11 raw strings come first, since they can span lines
+#and contain anything up to their closing delimiter.
+_FINGERPRINT_TOKENS = re.compile(
+	br'(?<![A-Za-z0-9_])(?:u8|[uUL])?R"([^ ()\\\t\v\f\r\n]{0,16})\(.*?\)\1"|'
+	br'//[^\n]*|/\*.*?\*/|"(?:\\.|[^\\"\n])*"|\'(?:\\.|[^\\\'\n])*\'',
+	re.DOTALL
+)
+_NEWLINE_RUN = re.compile( br"[ \t\r\f\v]*\n[ \t\r\n\f\v]*" )
+_SPACE_RUN = re.compile( br"[ \t\r\f\v]+" )
+_WHITESPACE = b" \t\r\n\f\v"
+_MMAP_THRESHOLD = 64 * 1024
+
+
+def _fingerprintBuffer( data ):
+	"""
+	Hash the contents of a source file in a form that ignores comments and formatting.
+
+	Comments are dropped and every run of whitespace is collapsed to a single separator, which is a newline if the
+	run contained one (so preprocessor directives stay on their own lines) and a space otherwise. Leading and trailing
+	whitespace is ignored. The hash is fed as the buffer is scanned, so no canonicalized copy of the file is built.
+
+	:param data: File contents
+	:type data: bytes or mmap.mmap
+
+	:return: MD5 digest of the canonicalized contents
+	:rtype: bytes
+	"""
+	md5 = hashlib.md5( )
+	pendingSeparator = None
+	wroteAnything = False
+	last = 0
+	end = len( data )
+
+	while True:
+		match = _FINGERPRINT_TOKENS.search( data, last )
+		segmentEnd = match.start( ) if match else end
+
+		if segmentEnd > last:
+			segment = _SPACE_RUN.sub( b" ", _NEWLINE_RUN.sub( b"\n", data[last:segmentEnd] ) )
+			stripped = segment.strip( _WHITESPACE )
+			if segment[:1] in ( b" ", b"\n" ) and pendingSeparator != b"\n":
+				pendingSeparator = segment[:1]
+			if stripped:
+				if pendingSeparator and wroteAnything:
+					md5.update( pendingSeparator )
+				md5.update( stripped )
+				wroteAnything = True
+				pendingSeparator = segment[-1:] if segment[-1:] in ( b" ", b"\n" ) else None
+
+		if not match:
+			break
+
+		token = match.group( 0 )
+		if token[:1] == b"/":
+			#A comment separates the tokens on either side of it, the same as a space does.
+			if pendingSeparator is None:
+				pendingSeparator = b" "
 		else:
-			return s
+			if pendingSeparator and wroteAnything:
+				md5.update( pendingSeparator )
+			md5.update( token )
+			wroteAnything = True
+			pendingSeparator = None
 
+		last = match.end( )
 
-	pattern = re.compile(
-		r'//.*?$|/\*.*?\*/|\'(?:\\.|[^\\\'])*\'|"(?:\\.|[^\\"])*"',
-		re.DOTALL | re.MULTILINE
-	)
-	return re.sub( pattern, replacer, text )
+	return md5.digest( )
+
+
+def GetFileFingerprint( path ):
+	"""
+	Get a hash of a source file's contents that doesn't change when only comments or whitespace are edited.
+	Large files are mapped into memory rather than read.
+
+	:param path: Path to the file
+	:type path: str
+
+	:return: MD5 digest of the file's canonicalized contents
+	:rtype: bytes
+	"""
+	with open( path, "rb" ) as f:
+		size = os.fstat( f.fileno( ) ).st_size
+		if size < _MMAP_THRESHOLD:
+			return _fingerprintBuffer( f.read( ) )
+
+		data = mmap.mmap( f.fileno( ), 0, access = mmap.ACCESS_READ )
+		try:
+			return _fingerprintBuffer( data )
+		finally:
+			data.close( )
+
+
+def GetFileContentHash( path ):
+	"""
+	Get a hash of a file's exact contents, for build outputs such as object files, where every byte matters.
 
+	:param path: Path to the file
+	:type path: str
 
-def RemoveWhitespace( text ):
-	#This isn't working correctly, turning it off.
-	return text
-	#shlexer = shlex.shlex(text)
-	#out = []
-	#token = ""
-	#while True:
-	#    token = shlexer.get_token()
-	#    if token == "":
-	#        break
-	#    out.append(token)
-	#return "".join(out)
+	:return: MD5 digest of the file's contents
+	:rtype: bytes
+	"""
+	md5 = hashlib.md5( )
+	with open( path, "rb" ) as f:
+		while True:
+			data = f.read( _MMAP_THRESHOLD )
+			if not data:
+				break
+			md5.update( data )
+	return md5.digest( )
 
 
 def GetMd5( inFile ):
-	if sys.version_info >= (3, 0):
-		return hashlib.md5( RemoveWhitespace( remove_comments( inFile.read( ) ) ).encode( 'utf-8' ) ).digest( )
-	else:
-		return hashlib.md5( RemoveWhitespace( remove_comments( inFile.read( ) ) ) ).digest( )
+	data = inFile.read( )
+	if not isinstance( data, bytes ):
+		data = data.encode( "latin-1" )
+	return _fingerprintBuffer( data )
 
 
 def GetSize( chunk ):
 	size = 0
 	if type( chunk ) == list:
 		for source in chunk:
-			size += os.path.getsize( source )
+			size += _stat_cache.GetSize( source )
 		return size
 	else:
-		return os.path.getsize( chunk )
+		return _stat_cache.GetSize( chunk )
 
 
-class ThreadedBuild( threading.Thread ):
-	"""Multithreaded build system, launches a new thread to run the compiler in.
-	Uses a threading.BoundedSemaphore object to keep the number of threads equal to the number of processors on the
-	machine.
+class ThreadedBuild( object ):
+	"""Compiles a single file. run() is called on one of the threads of the compile worker pool
+	(_shared_globals.compilePool), which keeps the number of compiles running at once equal to the number of jobs
+	requested.
 	"""
 
 
 	def __init__( self, infile, inobj, proj, forPrecompiledHeader = False ):
-		"""Initialize the object. Also handles above-mentioned bug with dummy threads."""
-		threading.Thread.__init__( self )
 		self.file = os.path.normcase(infile)
 
 		self.originalIn = self.file
 		self.obj = os.path.abspath( inobj )
 		self.project = proj
 		self.forPrecompiledHeader = forPrecompiledHeader
-		#Prevent certain versions of python from choking on dummy threads.
-		if not hasattr( threading.Thread, "_Thread__block" ):
-			threading.Thread._Thread__block = _shared_globals.dummy_block( )
+
+
+	def _recordObject( self, previousStat, previousHash ):
+		"""
+		Hash a freshly compiled object. If it's identical to the one it replaced, the old modification time is put back
+		and it doesn't count as having changed, so the project isn't relinked just because it was recompiled.
+
+		:param previousStat: Stat of the object before it was recompiled, or None if there wasn't one
+		:type previousStat: os.stat_result
+
+		:param previousHash: Recorded hash of the object before it was recompiled, or None if it wasn't known
+		:type previousHash: bytes
+		"""
+		try:
+			newHash = GetFileContentHash( self.obj )
+		except (IOError, OSError):
+			newHash = None
+
+		if newHash is not None and newHash == previousHash:
+			if hasattr( previousStat, "st_mtime_ns" ):
+				os.utime( self.obj, ns = ( previousStat.st_atime_ns, previousStat.st_mtime_ns ) )
+			else:
+				os.utime( self.obj, ( previousStat.st_atime, previousStat.st_mtime ) )
+			_stat_cache.Invalidate( self.obj )
+			log.LOG_INFO( "{} did not change when recompiled.".format( self.obj ) )
+		else:
+			with self.project.mutex:
+				self.project._builtSomething = True
+
+		st = _stat_cache.Stat( self.obj )
+		if newHash is not None and st is not None:
+			_hash_db.Set( ( "object", self.obj ), ( _stat_cache.GetSignature( st ), newHash ) )
+		else:
+			_hash_db.Set( ( "object", self.obj ), None )
+
+
+	def _preprocess( self, baseCommand, project, toolchainEnv ):
+		"""
+		Preprocess the file, for the object cache or a compile worker.
+
+		:return: The preprocessed source, or None if it couldn't be preprocessed
+		:rtype: bytes
+		"""
+		preprocessCmd = self.project.activeToolchain.Compiler( ).GetPreprocessCommand( baseCommand, project,
+			os.path.abspath( self.originalIn ) )
+		if _shared_globals.show_commands:
+			print( preprocessCmd )
+		if platform.system() != "Windows":
+			preprocessCmd = shlex.split( preprocessCmd )
+
+		#Listed under a key of its own, so the watchdog doesn't take it for the compile.
+		key = self.obj + ".i"
+		if _process_loop is not None and _process_loop.IsRunning( ):
+			ret, preprocessed, _, _ = _process_loop.RunProcess( preprocessCmd, key, self.project.workingDirectory, toolchainEnv )
+		else:
+			fd = subprocess.Popen( preprocessCmd, stdout = subprocess.PIPE, stderr = subprocess.PIPE, cwd = self.project.workingDirectory, env = toolchainEnv )
+			with _shared_globals.spmutex:
+				_shared_globals.subprocesses[key] = fd
+			try:
+				preprocessed, _, _ = _throttle.Communicate( fd )
+			finally:
+				with _shared_globals.spmutex:
+					_shared_globals.subprocesses.pop( key, None )
+			ret = fd.returncode
+
+		#Errors in the source are reported by the compile.
+		return preprocessed if ret == 0 else None
+
+
+	def _compileRemotely( self, slot, preprocessed ):
+		"""
+		Compile the file on a compile worker.
+
+		:param slot: Remote slot to compile it on
+		:type slot: csbuild._distributed.Slot
+
+		:param preprocessed: The preprocessed source
+		:type preprocessed: bytes
+
+		:return: Return code, stdout and stderr; or None if it has to be compiled locally instead
+		:rtype: tuple[int, bytes, bytes]
+		"""
+		job = GetRemoteCompileJob( self.project, self.originalIn, self.obj )
+		if job is None:
+			return None
+
+		try:
+			return slot.Compile( job, preprocessed, self.obj, _watchdog.GetTimeout( self.obj ) )
+		except _distributed.WorkerError as e:
+			log.LOG_WARN( "{} Compiling {} locally.".format( e, self.originalIn ) )
+			return None
 
 
 	def run( self ):
@@ -218,46 +402,23 @@ class ThreadedBuild( threading.Thread ):
 
 			inc = ""
 			headerfile = ""
-			extension = "." + self.file.rsplit(".", 1)[1]
-			if extension in self.project.cExtensions or self.file == self.project.cHeaderFile:
-				if( (self.project.chunkedPrecompile and self.project.cHeaders) or self.project.precompileAsC )\
-					and not self.forPrecompiledHeader:
+			baseCommand, project, isPlainC, usesPrecompiledHeader = GetCompileSettings( self.project, self.originalIn,
+				self.forPrecompiledHeader )
+			if usesPrecompiledHeader:
+				if isPlainC:
 					headerfile = self.project.cHeaderFile
-
-				if self.forPrecompiledHeader:
-					if self.originalIn in self.project.ccpcOverrideCmds:
-						baseCommand = self.project.ccpcOverrideCmds[self.originalIn]
-					else:
-						baseCommand = self.project.ccpccmd
 				else:
-					if self.originalIn in self.project.ccOverrideCmds:
-						baseCommand = self.project.ccOverrideCmds[self.originalIn]
-					else:
-						baseCommand = self.project.ccCmd
-			else:
-				if (self.project.precompile or self.project.chunkedPrecompile) \
-					and not self.forPrecompiledHeader:
 					headerfile = self.project.cppHeaderFile
 
-				if self.forPrecompiledHeader:
-					if self.originalIn in self.project.cxxpcOverrideCmds:
-						baseCommand = self.project.cxxpcOverrideCmds[self.originalIn]
-					else:
-						baseCommand = self.project.cxxpccmd
-				else:
-					if self.originalIn in self.project.cxxOverrideCmds:
-						baseCommand = self.project.cxxOverrideCmds[self.originalIn]
-					else:
-						baseCommand = self.project.cxxCmd
+			#Computed before the profiler has a chance to swap the input out for a preprocessed copy.
+			if _shared_globals.profile:
+				signature = None
+			else:
+				signature = GetCommandSignature( self.project, self.originalIn, self.obj, self.forPrecompiledHeader )
 
 			indexes = {}
 			reverseIndexes = {}
 
-			if self.originalIn in self.project.fileOverrideSettings:
-				project = self.project.fileOverrideSettings[self.originalIn]
-			else:
-				project = self.project
-
 			toolchainEnv = GetToolchainEnvironment( self.project.activeToolchain.Compiler() )
 
 			if _shared_globals.profile:
@@ -361,8 +522,14 @@ class ThreadedBuild( threading.Thread ):
 			self.project.compileCommands[self.originalIn] = cmd
 			if _shared_globals.show_commands:
 				print(cmd)
-			if os.access(self.obj , os.F_OK):
+			previousStat = _stat_cache.Stat( self.obj )
+			previousHash = None
+			if previousStat is not None:
+				record = _hash_db.Get( ( "object", self.obj ) )
+				if record is not None and record[0] == _stat_cache.GetSignature( previousStat ):
+					previousHash = record[1]
 				os.remove( self.obj )
+				_stat_cache.Invalidate( self.obj )
 
 			class StringRef(object):
 				def __init__(self):
@@ -373,13 +540,6 @@ class ThreadedBuild( threading.Thread ):
 			if platform.system() != "Windows":
 				cmd = shlex.split(cmd)
 
-			fd = subprocess.Popen( cmd, stdout = subprocess.PIPE, stderr = subprocess.PIPE, cwd = self.project.workingDirectory, env = toolchainEnv )
-
-			with _shared_globals.spmutex:
-				_shared_globals.subprocesses[self.obj] = fd
-
-			running = True
-
 			times = {}
 			lastTimes = {}
 
@@ -393,6 +553,63 @@ class ThreadedBuild( threading.Thread ):
 
 			summedTimes = {}
 
+			def GatherLine(line, buffer):
+				if sys.version_info >= (3, 0):
+					line = line.decode("utf-8");
+
+				stripped = line.strip()
+				baseFile = os.path.basename(self.file)
+				if stripped == baseFile:
+					return
+				if not " " in stripped:
+					baseStripped = stripped.rsplit(".",1)[0]
+					baseFile = baseFile.rsplit(".", 1)[0]
+					if baseStripped == baseFile:
+						return
+
+				if _shared_globals.profile:
+					sanitized = False
+					for sanitationLine in sanitation_lines:
+						if stripped == sanitationLine:
+							sanitized = True
+							break
+					if sanitized:
+						return
+
+					if "CSBPF" in line:
+						sub = re.sub(ansi_escape, '', line)
+						split = sub.split("[")
+						file = reverseIndexes[int(split[1].split("]")[0])]
+						lineNo = int(split[2].split("]")[0]) - 1
+						now = timeFunc()
+						if file in lastTimes:
+							if file not in times:
+								times[file] = {}
+							if lineNo not in times[file]:
+								times[file][lineNo] = 0
+							times[file][lineNo] += now - lastTimes[file]
+						else:
+							summedTimes[file] = 0
+						lastTimes[file] = now
+						return
+
+					if "CSBPL" in line:
+						sub = re.sub(ansi_escape, '', line)
+						split = sub.split("[")
+						file = reverseIndexes[int(split[1].split("]")[0])]
+						lineNo = int(split[2].split("]")[0])
+						if file not in times:
+							times[file] = {}
+						if lineNo not in times[file]:
+							times[file][lineNo] = 0
+						now = timeFunc()
+						times[file][lineNo] += now - lastTimes[file]
+						summedTimes[file] += now - lastTimes[file]
+						lastTimes[file] = now
+						return
+
+				buffer.str += line
+
 			def GatherData(pipe, buffer):
 				while running:
 					try:
@@ -401,78 +618,97 @@ class ThreadedBuild( threading.Thread ):
 						continue
 					if not line:
 						break
+					GatherLine(line, buffer)
+
+			slot = None if self.forPrecompiledHeader else _distributed.TakeReservation( self.obj )
+			preprocessed = None
+			cacheKey = None
+			#Set when the object was restored from the object cache or compiled on a worker, rather than compiled here.
+			fetched = None
+
+			if slot is not None or ( _object_cache.IsEnabled( ) and not self.forPrecompiledHeader and not headerfile and
+					not _shared_globals.profile and self.project.activeToolchain.Compiler( ).SupportsDistributedCompile( ) ):
+				preprocessed = self._preprocess( baseCommand, project, toolchainEnv )
+
+			if preprocessed is not None and _object_cache.IsEnabled( ):
+				executable = shlex.split( baseCommand, posix = platform.system() != "Windows" )[0].strip( "\"" )
+				cacheKey = _object_cache.GetKey(
+					_object_cache.GetCompilerIdentity( executable, toolchainEnv ),
+					self.project.activeToolchain.Compiler( ).GetExtendedCommand( baseCommand, project, "", "<object>", "<source>" ),
+					self.project.workingDirectory,
+					preprocessed
+				)
+				cached = _object_cache.Fetch( cacheKey, self.obj )
+				if cached is not None:
+					fetched = ( 0, ) + cached
+					log.LOG_INFO( "Restored {} from the object cache.".format( self.obj ) )
+					cacheKey = None
+
+			attempt = 0
+			while True:
+				output.str = ""
+				errors.str = ""
+
+				#A file is only sent to a worker once; if that fails, or it has to be retried, it's compiled here.
+				if fetched is None and slot is not None and preprocessed is not None:
+					fetched = self._compileRemotely( slot, preprocessed )
+				slot = None
+
+				if fetched is not None:
+					ret, out, err = fetched
+					peakMemory = None
+					for line in io.BytesIO( out ):
+						GatherLine( line, output )
+					for line in io.BytesIO( err ):
+						GatherLine( line, errors )
+				#Profiling needs to know when each line was written, so it has to be read as it arrives.
+				elif _process_loop is not None and _process_loop.IsRunning( ) and not _shared_globals.profile:
+					ret, out, err, peakMemory = _process_loop.RunProcess( cmd, self.obj, self.project.workingDirectory, toolchainEnv )
+					for line in io.BytesIO( out ):
+						GatherLine( line, output )
+					for line in io.BytesIO( err ):
+						GatherLine( line, errors )
+				else:
+					running = True
+					fd = subprocess.Popen( cmd, stdout = subprocess.PIPE, stderr = subprocess.PIPE, cwd = self.project.workingDirectory, env = toolchainEnv )
 
-					if sys.version_info >= (3, 0):
-						line = line.decode("utf-8");
+					with _shared_globals.spmutex:
+						_shared_globals.subprocesses[self.obj] = fd
 
-					stripped = line.strip()
-					baseFile = os.path.basename(self.file)
-					if stripped == baseFile:
-						continue
-					if not " " in stripped:
-						baseStripped = stripped.rsplit(".",1)[0]
-						baseFile = baseFile.rsplit(".", 1)[0]
-						if baseStripped == baseFile:
-							continue
+					#stderr needs a thread of its own so neither pipe can fill up and stall the compiler, but stdout can be
+					#read on this one.
+					errorThread = threading.Thread(target=GatherData, args=(fd.stderr, errors))
+					errorThread.start()
 
-					if _shared_globals.profile:
-						sanitized = False
-						for sanitationLine in sanitation_lines:
-							if stripped == sanitationLine:
-								sanitized = True
-								break
-						if sanitized:
-							continue
+					GatherData(fd.stdout, output)
 
-						if "CSBPF" in line:
-							sub = re.sub(ansi_escape, '', line)
-							split = sub.split("[")
-							file = reverseIndexes[int(split[1].split("]")[0])]
-							lineNo = int(split[2].split("]")[0]) - 1
-							now = timeFunc()
-							if file in lastTimes:
-								if file not in times:
-									times[file] = {}
-								if lineNo not in times[file]:
-									times[file][lineNo] = 0
-								times[file][lineNo] += now - lastTimes[file]
-							else:
-								summedTimes[file] = 0
-							lastTimes[file] = now
-							continue
+					peakMemory = _throttle.WaitForProcess( fd )
+					running = False
 
-						if "CSBPL" in line:
-							sub = re.sub(ansi_escape, '', line)
-							split = sub.split("[")
-							file = reverseIndexes[int(split[1].split("]")[0])]
-							lineNo = int(split[2].split("]")[0])
-							if file not in times:
-								times[file] = {}
-							if lineNo not in times[file]:
-								times[file][lineNo] = 0
-							now = timeFunc()
-							times[file][lineNo] += now - lastTimes[file]
-							summedTimes[file] += now - lastTimes[file]
-							lastTimes[file] = now
-							continue
-
-					buffer.str += line
+					errorThread.join()
 
-			outputThread = threading.Thread(target=GatherData, args=(fd.stdout, output))
-			errorThread = threading.Thread(target=GatherData, args=(fd.stderr, errors))
+					with _shared_globals.spmutex:
+						del _shared_globals.subprocesses[self.obj]
 
-			outputThread.start()
-			errorThread.start()
+					ret = fd.returncode
 
-			fd.wait()
+				if not _watchdog.ShouldRetry( self.obj, attempt ):
+					break
+				attempt += 1
+				log.LOG_WARN( "Retrying {} ({}/{})...".format( os.path.basename( self.obj ), attempt, _watchdog.GetRetries( ) ) )
 
-			running = False
+			if cacheKey is not None and ret == 0:
+				if sys.version_info >= (3, 0):
+					_object_cache.Store( cacheKey, self.obj, output.str.encode( "utf-8" ), errors.str.encode( "utf-8" ) )
+				else:
+					_object_cache.Store( cacheKey, self.obj, output.str, errors.str )
 
-			outputThread.join()
-			errorThread.join()
+			_stat_cache.Invalidate( self.obj )
+			_hash_db.Set( ( "cmd", self.obj ), signature if ret == 0 else None )
+			if peakMemory is not None:
+				_hash_db.Set( ( "memory", self.obj ), peakMemory )
 
 			with _shared_globals.spmutex:
-				del _shared_globals.subprocesses[self.obj]
 				if _shared_globals.exiting:
 					#Don't bother with the rest, we're killing everything early.
 					return
@@ -485,11 +721,32 @@ class ThreadedBuild( threading.Thread ):
 					else:
 						self.project.summedTimes[file] = summedTimes[file]
 
-			ret = fd.returncode
-
 			output.str = output.str.replace("\r", "")
 			errors.str = errors.str.replace("\r", "")
 
+			if not ret:
+				if _shared_globals.profile or self.forPrecompiledHeader:
+					with self.project.mutex:
+						self.project._builtSomething = True
+				else:
+					self._recordObject( previousStat, previousHash )
+
+			dependencies, output.str = self.project.activeToolchain.Compiler().ParseDependencies( self.obj, output.str )
+			if fetched is not None:
+				#There's no dependency file for objects that weren't compiled here, but every file the source was made from
+				#is named in its preprocessed output.
+				dependencies = _distributed.GetDependencies( preprocessed )
+			if not ret and dependencies is not None and not _shared_globals.profile:
+				dependencies = [ os.path.abspath( os.path.join( self.project.workingDirectory, dep ) ) for dep in dependencies ]
+				#Compilers leave out the headers that came from the precompiled header, but they still went into the object.
+				if headerfile:
+					pchFile = os.path.abspath( self.project.activeToolchain.Compiler().GetPchFile( headerfile ) )
+					known = set( dependencies )
+					dependencies += [ dep for dep in _header_cache.GetRecordedDependencies( pchFile ) or [ ] if dep not in known ]
+				_header_cache.SetObjectDependencies( self.obj, dependencies, self.project.key, self.originalIn,
+					time.time( ) - starttime )
+				_include_resolver.TrackSearchPath( dependencies, [ self.project.workingDirectory ] + self.project.includeDirs )
+
 			sys.stdout.write( output.str )
 			sys.stderr.write( errors.str )
 			sys.stdout.flush()
@@ -548,17 +805,13 @@ class ThreadedBuild( threading.Thread ):
 				self.project.updated = True
 				self.project.compilationCompleted += 1
 				self.project.mutex.release( )
-				_shared_globals.semaphore.release( )
 				return
 		except Exception as e:
-			#If we don't do this with ALL exceptions, any unhandled exception here will cause the semaphore to never
-			# release...
-			#Meaning the build will hang. And for whatever reason ctrl+c won't fix it.
-			#ABSOLUTELY HAVE TO release the semaphore on ANY exception.
+			#If we don't do this with ALL exceptions, the file will never be counted as completed...
+			#Meaning the build will hang waiting for the project to finish. And for whatever reason ctrl+c won't fix it.
+			#ABSOLUTELY HAVE TO mark the file as completed on ANY exception.
 			#if os.path.dirname(self.originalIn) == _csbuildDir:
 			#   os.remove(self.originalIn)
-			_shared_globals.semaphore.release( )
-
 			self.project.mutex.acquire( )
 			self.project.compilationFailed = True
 			self.project.compilationCompleted += 1
@@ -566,6 +819,7 @@ class ThreadedBuild( threading.Thread ):
 			self.project.fileEnd[self.originalIn] = time.time()
 			self.project.updated = True
 			self.project.mutex.release( )
+			_shared_globals.build_success = False
 
 			traceback.print_exc()
 			raise e
@@ -578,8 +832,6 @@ class ThreadedBuild( threading.Thread ):
 			#_shared_globals.times.append( endtime - starttime )
 			#_shared_globals.sgmutex.release( )
 
-			_shared_globals.semaphore.release( )
-
 			self.project.mutex.acquire( )
 			self.project.compilationCompleted += 1
 			self.project.fileEnd[self.originalIn] = time.time()
@@ -721,7 +973,8 @@ def PreparePrecompiles( ):
 			obj = project.activeToolchain.Compiler().GetPchFile( headerfile )
 
 			precompile = False
-			if not os.access(headerfile, os.F_OK ) or project.should_recompile( headerfile, obj, True ):
+			if not _stat_cache.Exists( headerfile ) or project.should_recompile( headerfile, obj, True ) \
+					or _hash_db.Get( ( "cmd", os.path.abspath( obj ) ) ) != GetCommandSignature( project, headerfile, obj, True ):
 				precompile = True
 			else:
 				for header in allheaders:
@@ -759,6 +1012,7 @@ def PreparePrecompiles( ):
 						project.cPchContents.append( header )
 					if externed:
 						f.write( "}\n" )
+			_stat_cache.Invalidate( headerfile )
 			return True, headerfile
 
 
@@ -834,8 +1088,9 @@ def ChunkedBuild( ):
 		obj = GetSourceObjPath( owningProject, chunkname, sourceIsChunkPath=owningProject.ContainsChunk( chunkname ) )
 		for chunk in owningProject.chunks:
 			if GetChunkName( owningProject.outputName, chunk ) == chunkname:
-				if not owningProject.activeToolchain.Compiler().SupportsObjectScraping() and os.access(obj , os.F_OK):
+				if not owningProject.activeToolchain.Compiler().SupportsObjectScraping() and _stat_cache.Exists( obj ):
 					os.remove(obj)
+					_stat_cache.Invalidate( obj )
 					log.LOG_WARN_NOPUSH(
 						"Breaking chunk ({0}) into individual files to improve future iteration turnaround.".format(
 							chunk
@@ -859,23 +1114,7 @@ def ChunkedBuild( ):
 
 			chunksize = GetSize( sources_in_this_chunk )
 
-			extension = "." + chunk[0].rsplit(".", 1)[1]
-
-			if extension in project.cExtensions:
-				extension = ".c"
-			else:
-				extension = ".cpp"
-
-			if project.unity:
-				outFile = os.path.join( project.csbuildDir, "{}_unity{}".format(
-					project.outputName,
-					extension
-				))
-			else:
-				outFile = os.path.join( project.csbuildDir, "{}{}".format(
-					GetChunkName( project.outputName, chunk ),
-					extension
-				))
+			outFile = GetChunkSourcePath( project, chunk )
 
 			# We want to try and achieve ideal parallelism.
 			# ALWAYS SPLIT if we're building fewer total translation units than the number of threads available to us.
@@ -898,7 +1137,7 @@ def ChunkedBuild( ):
 					) or (
 						(
 							project.unity
-							or os.access(outFile, os.F_OK)
+							or _stat_cache.Exists( outFile )
 						) and len(sources_in_this_chunk ) > 0
 					)
 				)
@@ -909,11 +1148,13 @@ def ChunkedBuild( ):
 					for source in chunk:
 						f.write(
 							'#include "{0}" // {1} bytes\n'.format( os.path.abspath( source ),
-								os.path.getsize( source ) ) )
+								_stat_cache.GetSize( source ) ) )
 						obj = GetSourceObjPath( project, source )
-						if os.access(obj , os.F_OK):
+						if _stat_cache.Exists( obj ):
 							os.remove( obj )
+							_stat_cache.Invalidate( obj )
 					f.write( "//Total size: {0} bytes".format( chunksize ) )
+				_stat_cache.Invalidate( outFile )
 
 				project._finalChunkSet.append( outFile )
 				project.chunksByFile.update( { outFile : chunk } )
@@ -921,7 +1162,7 @@ def ChunkedBuild( ):
 				chunkname = GetChunkName( project.outputName, chunk )
 
 				obj = GetSourceObjPath( project, chunkname, sourceIsChunkPath=project.ContainsChunk( chunkname ) )
-				if os.access(obj , os.F_OK):
+				if _stat_cache.Exists( obj ):
 					#If the chunk object exists, the last build of these files was the full chunk.
 					#We're now splitting the chunk to speed things up for future incremental builds,
 					# which means the chunk
@@ -933,6 +1174,7 @@ def ChunkedBuild( ):
 						add_chunk = sources_in_this_chunk
 					else:
 						os.remove( obj )
+						_stat_cache.Invalidate( obj )
 						add_chunk = chunk
 						if project.useChunks and not _shared_globals.disable_chunks:
 							log.LOG_WARN_NOPUSH(
@@ -1001,6 +1243,140 @@ def GetUnityChunkObjPath(project):
 	))
 
 
+def GetChunkSourcePath( project, chunk ):
+	"""
+	Get the path of the generated source file a chunk is compiled from.
+
+	:param project: Project the chunk belongs to
+	:type project: csbuild.projectSettings.projectSettings
+
+	:param chunk: Source files in the chunk
+	:type chunk: list[str]
+
+	:rtype: str
+	"""
+	extension = "." + chunk[0].rsplit(".", 1)[1]
+
+	if extension in project.cExtensions:
+		extension = ".c"
+	else:
+		extension = ".cpp"
+
+	if project.unity:
+		return os.path.join( project.csbuildDir, "{}_unity{}".format(
+			project.outputName,
+			extension
+		))
+
+	return os.path.join( project.csbuildDir, "{}{}".format(
+		GetChunkName( project.outputName, chunk ),
+		extension
+	))
+
+
+def GetCompileSettings( project, sourceFile, forPrecompiledHeader ):
+	"""
+	Work out how a source file will be compiled.
+
+	:param project: Project the file belongs to
+	:type project: csbuild.projectSettings.projectSettings
+
+	:param sourceFile: File being compiled
+	:type sourceFile: str
+
+	:param forPrecompiledHeader: Whether the file is a precompiled header
+	:type forPrecompiledHeader: bool
+
+	:return: The base command, the settings to extend it with (the project's, or the file's own overrides), whether the
+	file is compiled as C, and whether it force-includes the project's precompiled header
+	:rtype: tuple[str, csbuild.projectSettings.projectSettings, bool, bool]
+	"""
+	sourceFile = os.path.normcase( sourceFile )
+	extension = "." + sourceFile.rsplit(".", 1)[1]
+	if extension in project.cExtensions or sourceFile == project.cHeaderFile:
+		isPlainC = True
+		usesPrecompiledHeader = ( ( project.chunkedPrecompile and bool( project.cHeaders ) ) or bool( project.precompileAsC ) ) \
+			and not forPrecompiledHeader
+
+		if forPrecompiledHeader:
+			baseCommand = project.ccpcOverrideCmds.get( sourceFile, project.ccpccmd )
+		else:
+			baseCommand = project.ccOverrideCmds.get( sourceFile, project.ccCmd )
+	else:
+		isPlainC = False
+		usesPrecompiledHeader = ( bool( project.precompile ) or project.chunkedPrecompile ) and not forPrecompiledHeader
+
+		if forPrecompiledHeader:
+			baseCommand = project.cxxpcOverrideCmds.get( sourceFile, project.cxxpccmd )
+		else:
+			baseCommand = project.cxxOverrideCmds.get( sourceFile, project.cxxCmd )
+
+	settings = project.fileOverrideSettings.get( sourceFile, project )
+
+	return baseCommand, settings, isPlainC, usesPrecompiledHeader
+
+
+def GetRemoteCompileJob( project, sourceFile, obj ):
+	"""
+	Describe the compile of a source file to a compile worker.
+
+	:param project: Project the file belongs to
+	:type project: csbuild.projectSettings.projectSettings
+
+	:param sourceFile: File being compiled
+	:type sourceFile: str
+
+	:param obj: Object file it's compiled to
+	:type obj: str
+
+	:return: The job to send, or None if workers would refuse to run it
+	:rtype: dict
+	"""
+	baseCommand, settings, isPlainC, _ = GetCompileSettings( project, sourceFile, False )
+	inputName = _distributed.GetPreprocessedName( sourceFile, isPlainC )
+	outputName = os.path.basename( obj )
+	cmd = project.activeToolchain.Compiler( ).GetExtendedCommand( baseCommand, settings, "", outputName, inputName )
+	return _distributed.GetJob( cmd, inputName, outputName )
+
+
+def GetCommandSignature( project, sourceFile, obj, forPrecompiledHeader ):
+	"""
+	Get a hash of the full command line a source file is compiled with, including any per-file overrides.
+	Objects are rebuilt when this changes.
+
+	:param project: Project the file belongs to
+	:type project: csbuild.projectSettings.projectSettings
+
+	:param sourceFile: File being compiled
+	:type sourceFile: str
+
+	:param obj: Object file it's compiled to
+	:type obj: str
+
+	:param forPrecompiledHeader: Whether the file is a precompiled header
+	:type forPrecompiledHeader: bool
+
+	:rtype: bytes
+	"""
+	sourceFile = os.path.normcase( sourceFile )
+	baseCommand, settings, _, usesPrecompiledHeader = GetCompileSettings( project, sourceFile, forPrecompiledHeader )
+
+	#The precompiled header's path isn't decided until PreparePrecompiles(), which runs after most files have already
+	#been checked, so only whether one is used goes into the signature. The precompile command is deliberately not
+	#used either: some toolchains write files while building it.
+	if usesPrecompiledHeader:
+		forceInclude = "<precompiled header>"
+	else:
+		forceInclude = ""
+
+	cmd = project.activeToolchain.Compiler().GetExtendedCommand( baseCommand, settings, forceInclude,
+		os.path.abspath( obj ), os.path.abspath( sourceFile ) )
+
+	if sys.version_info >= (3, 0):
+		cmd = cmd.encode( "utf-8" )
+	return hashlib.md5( cmd ).digest( )
+
+
 def GetFuncName(func):
 	if sys.version_info >= (3,0,0):
 		return "{}() ({}:{})".format(func.__qualname__, os.path.basename(func.__code__.co_filename), func.__code__.co_firstlineno)
@@ -1010,11 +1386,23 @@ def GetFuncName(func):
 		except:
 			return "{}() ({}:{})".format(func.__name__, os.path.basename(func.__code__.co_filename), func.__code__.co_firstlineno)
 
+def _emptyFunc():
+	pass
+
+def _emptyFuncWithDocstring():
+	"""Docstrings change which constant "pass" returns on some Python versions."""
+	pass
+
+#The bytecode for "pass" differs between Python versions, so compare against what this interpreter produces for it.
+_emptyFuncCode = frozenset( ( _emptyFunc.__code__.co_code, _emptyFuncWithDocstring.__code__.co_code ) )
+
 def FuncIsEmpty(func):
 	#Checks the bytecode to see whether it equates to "pass"
-	if sys.version_info >= (3,0,0):
-		return func.__code__.co_code == b'd\x00\x00S'
-	return func.__code__.co_code == 'd\x00\x00S'
+	code = func.__code__
+	if code.co_code not in _emptyFuncCode:
+		return False
+	#"return <constant>" only differs from "pass" in which constant it returns.
+	return all( const is None or ( i == 0 and const == func.__doc__ ) for i, const in enumerate( code.co_consts ) )
 
 _buildEventMutex = threading.Lock()
 
@@ -1023,6 +1411,9 @@ def CheckRunBuildStep(project, step, name):
 		with _buildEventMutex:
 			wd = os.getcwd( )
 			os.chdir( project.scriptPath )
+			#Projects are prepared on several threads at once, so whichever one was set up last isn't necessarily the
+			#one this step belongs to.
+			csbuild.projectSettings.currentProject = project
 
 			log.LOG_BUILD( "Running {} step {} for {} ({} {}/{})".format( name, GetFuncName(step), project.outputName, project.targetName, project.outputArchitecture, project.activeToolchainName ) )
 			try:
@@ -1030,9 +1421,26 @@ def CheckRunBuildStep(project, step, name):
 			except Exception:
 				traceback.print_exc()
 
+			#Build steps can do anything, so nothing cached about the filesystem can be trusted afterward.
+			_stat_cache.Clear( )
 			os.chdir(wd)
 
 
+def EnsureDirectory( path ):
+	"""
+	Create a directory and any of its parents that are missing, unless it already exists. Another thread creating the
+	same directory at the same time isn't an error.
+
+	:param path: Directory to create
+	:type path: str
+	"""
+	try:
+		os.makedirs( path )
+	except OSError as e:
+		if e.errno != errno.EEXIST or not os.path.isdir( path ):
+			raise
+
+
 def ResolveProjectMacros(_path, _project):
 	"""
 	This will iteratively resolve each project macro in a string until there are none left.  However, If either the '{' or '}' characters are desired in the path,
@@ -1106,6 +1514,31 @@ def DeleteTree( pathToDelete ):
 		os.remove( pathToDelete )
 
 
+def WriteFileAtomic( path, data ):
+	"""
+	Write a file such that readers (and later builds, if we're interrupted) never see a partially-written version of it.
+	The data is written to a temporary file next to the destination, which is then renamed over the top of it.
+
+	:param path: Destination path
+	:type path: str
+
+	:param data: Contents to write
+	:type data: bytes
+
+	:return: None
+	"""
+	tempPath = "{}.{}.tmp".format( path, os.getpid( ) )
+	with open( tempPath, "wb" ) as f:
+		f.write( data )
+	try:
+		os.rename( tempPath, path )
+	except OSError:
+		#Windows won't rename over an existing file.
+		if os.access( path, os.F_OK ):
+			os.remove( path )
+		os.rename( tempPath, path )
+
+
 def GetToolchainEnvironment( tool ):
 	envCopy = os.environ.copy()
 	envCopy.update( tool.GetEnv() )
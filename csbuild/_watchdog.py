@@ -0,0 +1,266 @@
+# Copyright (C) 2013 Jaedyn K. Draper
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Hung process watchdog.
+
+While a build is running, a thread checks every process in _shared_globals.subprocesses once a second. A process that
+has been running for longer than its timeout has its command dumped to the log and is killed, along with everything it
+started (the compiler driver's cc1plus, for instance), so the compile or link fails rather than holding up the build
+forever. Compiles and links that were killed this way can be retried a set number of times.
+
+The timeout can be set for every process at once. Otherwise, it's a multiple of how long the same compile or link took
+the last time it ran, with a generous minimum, and processes that have never run before aren't timed out at all.
+
+Whenever something has been running for a while, the processes still going are listed periodically, so it's clear
+from the log what the build is waiting on.
+"""
+
+import os
+import signal
+import threading
+import time
+
+from . import log
+from . import _shared_globals
+from . import _hash_db
+
+#Without a timeout set, processes get this many times as long as they took last time...
+_ADAPTIVE_TIMEOUT_FACTOR = 10
+#...but never less than this, in seconds.
+_MIN_ADAPTIVE_TIMEOUT = 300
+#How often to list the processes that have been running longer than this, in seconds.
+_HEARTBEAT_SECONDS = 60
+_CHECK_INTERVAL_SECONDS = 1.0
+
+_lock = threading.Lock( )
+_thread = None
+_stopEvent = None
+_timeout = None
+_retries = 0
+_timeouts = { }
+_started = { }
+_timedOut = { }
+_lastHeartbeat = 0
+
+
+def GetTimeout( key ):
+	"""
+	:param key: Key the process is listed under in _shared_globals.subprocesses
+	:type key: str
+
+	:return: How long the process can run for before it's considered to have hung, in seconds, or None if it can run
+		for as long as it likes
+	:rtype: float
+	"""
+	if _timeout is not None:
+		return _timeout or None
+
+	if key not in _timeouts:
+		duration = _hash_db.Get( ( "duration", key ) )
+		if duration is None:
+			_timeouts[key] = None
+		else:
+			_timeouts[key] = max( _MIN_ADAPTIVE_TIMEOUT, duration * _ADAPTIVE_TIMEOUT_FACTOR )
+	return _timeouts[key]
+
+
+def _getCommand( fd ):
+	args = getattr( fd, "args", None )
+	if args is None:
+		try:
+			with open( "/proc/{}/cmdline".format( fd.pid ), "rb" ) as f:
+				args = [ arg.decode( "utf-8", "replace" ) for arg in f.read( ).split( b"\0" ) if arg ]
+		except IOError:
+			return "<unknown command>"
+	if isinstance( args, ( list, tuple ) ):
+		return " ".join( args )
+	return args
+
+
+def _getDescendants( pid ):
+	"""
+	:return: Every process started by the given one, directly or not. Only known on platforms with /proc.
+	:rtype: list[int]
+	"""
+	children = { }
+	try:
+		pids = [ int( entry ) for entry in os.listdir( "/proc" ) if entry.isdigit( ) ]
+	except OSError:
+		return [ ]
+	for child in pids:
+		try:
+			with open( "/proc/{}/stat".format( child ), "r" ) as f:
+				stat = f.read( )
+		except IOError:
+			continue
+		#The process name is in brackets and can contain anything, the parent pid is the second field after it.
+		fields = stat.rsplit( ")", 1 )[-1].split( )
+		if len( fields ) > 1:
+			children.setdefault( int( fields[1] ), [ ] ).append( child )
+
+	descendants = [ ]
+	toVisit = [ pid ]
+	while toVisit:
+		for child in children.get( toVisit.pop( ), [ ] ):
+			descendants.append( child )
+			toVisit.append( child )
+	return descendants
+
+
+def _kill( fd ):
+	descendants = _getDescendants( fd.pid )
+	try:
+		fd.kill( )
+	except OSError:
+		pass
+	for pid in descendants:
+		try:
+			os.kill( pid, signal.SIGKILL )
+		except OSError:
+			pass
+
+
+def _formatDuration( seconds ):
+	return "{}:{:02}".format( int( seconds // 60 ), int( seconds % 60 ) )
+
+
+def _check( ):
+	global _lastHeartbeat
+
+	now = time.time( )
+	with _shared_globals.spmutex:
+		running = list( _shared_globals.subprocesses.items( ) )
+
+	current = set( )
+	for key, fd in running:
+		ident = ( key, fd.pid )
+		current.add( ident )
+		start = _started.setdefault( ident, now )
+		timeout = GetTimeout( key )
+		if timeout is None or now - start < timeout or fd.returncode is not None:
+			continue
+
+		with _lock:
+			if _timedOut.get( key ) == fd.pid:
+				continue
+			_timedOut[key] = fd.pid
+		log.LOG_ERROR( "Killing {} after {}: it was expected to finish within {}.\n    {}".format(
+			os.path.basename( key ), _formatDuration( now - start ), _formatDuration( timeout ), _getCommand( fd ) ) )
+		_kill( fd )
+
+	for ident in list( _started ):
+		if ident not in current:
+			del _started[ident]
+
+	if now - _lastHeartbeat >= _HEARTBEAT_SECONDS:
+		longRunning = sorted( ( start, key ) for ( key, _ ), start in _started.items( ) if now - start >= _HEARTBEAT_SECONDS )
+		if longRunning:
+			_lastHeartbeat = now
+			log.LOG_BUILD( "Still waiting on {} process{}: {}".format(
+				len( longRunning ),
+				"" if len( longRunning ) == 1 else "es",
+				", ".join(
+					"{} ({})".format( os.path.basename( key ), _formatDuration( now - start ) ) for start, key in longRunning
+				)
+			) )
+
+
+def _watch( stopEvent ):
+	while not stopEvent.wait( _CHECK_INTERVAL_SECONDS ):
+		_check( )
+
+
+def Start( timeout, retries ):
+	"""
+	Start watching the processes the build runs.
+
+	:param timeout: Seconds every process is allowed to run for, 0 to never time out, or None to time out processes
+		based on how long they took the last time they ran
+	:type timeout: float
+
+	:param retries: Number of times to rerun a compile or link that was killed for taking too long
+	:type retries: int
+	"""
+	global _thread
+	global _stopEvent
+	global _timeout
+	global _retries
+	global _lastHeartbeat
+
+	if _thread is not None:
+		return
+
+	_timeout = timeout
+	_retries = retries
+	_timeouts.clear( )
+	_started.clear( )
+	_lastHeartbeat = time.time( )
+	with _lock:
+		_timedOut.clear( )
+
+	_stopEvent = threading.Event( )
+	_thread = threading.Thread( target = _watch, args = ( _stopEvent, ), name = "csbuild-watchdog" )
+	_thread.daemon = True
+	_thread.start( )
+
+
+def Stop( ):
+	"""
+	Stop watching.
+	"""
+	global _thread
+	global _stopEvent
+
+	if _thread is None:
+		return
+	_stopEvent.set( )
+	#csbuild.Exit() stops it too, and could be called from the watchdog itself.
+	if _thread is not threading.current_thread( ):
+		_thread.join( )
+	_thread = None
+	_stopEvent = None
+
+
+def GetRetries( ):
+	"""
+	:return: Number of times a compile or link killed for taking too long is retried
+	:rtype: int
+	"""
+	return _retries
+
+
+def ShouldRetry( key, attempt ):
+	"""
+	Check whether a process that has just exited was killed for taking too long, and should be run again.
+
+	:param key: Key the process was listed under in _shared_globals.subprocesses
+	:type key: str
+
+	:param attempt: Number of times the process has already been retried
+	:type attempt: int
+
+	:return: True if it should be run again
+	:rtype: bool
+	"""
+	with _lock:
+		if _timedOut.pop( key, None ) is None:
+			return False
+	return attempt < _retries
@@ -0,0 +1,373 @@
+# Copyright (C) 2013 Jaedyn K. Draper
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""
+Watch mode.
+
+Running a makefile with --watch evaluates it once, the same way the build server does, then builds and keeps
+rebuilding whenever a source, header or makefile script changes. Like the build server, each build is carried out by a
+forked child, so every build starts from the same evaluated graph.
+
+Changes are picked up through inotify on Linux, and by periodically rescanning the watched directories elsewhere.
+Every change reported in a watched directory, including the ones the build makes itself, is passed on to the stat cache,
+which is otherwise kept between builds. So each build only has to stat the files that actually changed, rather than
+every source and header in the tree. A burst of changes (an editor saving several files, or a version control
+checkout) is collected into a single build.
+
+If a makefile script changes, the whole process restarts so the makefile is evaluated again.
+
+Only available on platforms with fork().
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import time
+
+from . import log
+from . import _shared_globals
+from . import _stat_cache
+
+#Changes are collected until nothing has changed for this long.
+_DEBOUNCE_SECONDS = 0.2
+#How often the polling watcher rescans the watched directories.
+_POLL_INTERVAL_SECONDS = 1.0
+
+_IN_MODIFY = 0x00000002
+_IN_ATTRIB = 0x00000004
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_DELETE_SELF = 0x00000400
+_IN_MOVE_SELF = 0x00000800
+_IN_Q_OVERFLOW = 0x00004000
+_IN_IGNORED = 0x00008000
+_IN_ONLYDIR = 0x01000000
+_IN_ISDIR = 0x40000000
+
+_IN_CLOEXEC = 0x00080000
+_IN_NONBLOCK = 0x00000800
+
+_WATCH_MASK = _IN_MODIFY | _IN_ATTRIB | _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE | \
+	_IN_DELETE_SELF | _IN_MOVE_SELF | _IN_ONLYDIR
+
+_EVENT_HEADER = struct.Struct( "iIII" )
+
+
+def IsSupported( ):
+	"""
+	:return: Whether watch mode can be used on this platform
+	:rtype: bool
+	"""
+	return hasattr( os, "fork" )
+
+
+def _loadInotify( ):
+	if not sys.platform.startswith( "linux" ):
+		return None
+	try:
+		libc = ctypes.CDLL( ctypes.util.find_library( "c" ) or "libc.so.6", use_errno = True )
+		libc.inotify_init1.argtypes = [ ctypes.c_int ]
+		libc.inotify_add_watch.argtypes = [ ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32 ]
+	except (OSError, AttributeError):
+		return None
+	return libc
+
+
+class _InotifyWatcher( object ):
+	def __init__( self, libc, isIgnored ):
+		self._libc = libc
+		self._isIgnored = isIgnored
+		self._fd = libc.inotify_init1( _IN_CLOEXEC | _IN_NONBLOCK )
+		if self._fd < 0:
+			err = ctypes.get_errno( )
+			raise OSError( err, os.strerror( err ) )
+		self._directories = { }
+		self._recursive = { }
+
+	def GetDirectories( self ):
+		return list( self._directories.values( ) )
+
+	def AddDirectory( self, directory, recursive, found = None ):
+		#When a directory is created while we're watching, anything created inside it before the watch was added would
+		#otherwise be missed, so everything found in it is reported as changed.
+		directory = os.path.abspath( directory )
+		if not os.path.isdir( directory ) or directory in self._directories.values( ):
+			return
+
+		for root, dirnames, filenames in os.walk( directory ):
+			#Only the subdirectories that aren't ignored get watched, but changes to the ignored ones themselves are
+			#still reported by the directory containing them.
+			dirnames[:] = [ dirname for dirname in dirnames if not self._isIgnored( os.path.join( root, dirname ) ) ]
+			if found is not None:
+				found.update( os.path.join( root, name ) for name in dirnames + filenames )
+
+			wd = self._libc.inotify_add_watch( self._fd, root.encode( sys.getfilesystemencoding( ) ), _WATCH_MASK )
+			if wd < 0:
+				err = ctypes.get_errno( )
+				if err == errno.ENOSPC:
+					log.LOG_WARN( "Ran out of inotify watches, changes under {} won't be noticed. Raise fs.inotify.max_user_watches to fix this.".format( root ) )
+				continue
+			self._directories[wd] = root
+			self._recursive[wd] = recursive
+
+			if not recursive:
+				break
+
+	def ReadChanges( self, timeout ):
+		"""
+		Wait for changes.
+
+		:param timeout: Longest time to wait, in seconds, or None to wait until something changes
+		:type timeout: float or None
+
+		:return: Paths that have changed, or None if too many changes happened to keep track of
+		:rtype: set[str] or None
+		"""
+		changed = set( )
+		while True:
+			try:
+				readable, _, _ = select.select( [ self._fd ], [ ], [ ], timeout )
+			except select.error as e:
+				if e.args[0] == errno.EINTR:
+					continue
+				raise
+			if not readable:
+				return changed
+
+			try:
+				data = os.read( self._fd, 65536 )
+			except OSError as e:
+				if e.errno == errno.EAGAIN:
+					continue
+				raise
+
+			offset = 0
+			overflowed = False
+			while offset < len( data ):
+				wd, mask, _, length = _EVENT_HEADER.unpack_from( data, offset )
+				offset += _EVENT_HEADER.size
+				name = data[offset:offset + length].rstrip( b"\0" )
+				offset += length
+
+				if mask & _IN_Q_OVERFLOW:
+					overflowed = True
+					continue
+
+				directory = self._directories.get( wd )
+				if directory is None:
+					continue
+
+				if mask & _IN_IGNORED:
+					del self._directories[wd]
+					del self._recursive[wd]
+					continue
+
+				if not name:
+					#The watched directory itself was removed or moved.
+					changed.add( directory )
+					continue
+
+				path = os.path.join( directory, name.decode( sys.getfilesystemencoding( ) ) )
+				changed.add( path )
+
+				if mask & _IN_ISDIR and mask & ( _IN_CREATE | _IN_MOVED_TO ) and self._recursive[wd] and \
+						not self._isIgnored( path ):
+					self.AddDirectory( path, True, changed )
+
+			if overflowed:
+				return None
+			#Whatever else is already queued belongs to the same batch.
+			timeout = 0
+
+	def Close( self ):
+		os.close( self._fd )
+
+
+class _PollingWatcher( object ):
+	def __init__( self, isIgnored ):
+		self._isIgnored = isIgnored
+		self._roots = { }
+		self._snapshot = { }
+		self._scannedDirectories = set( )
+
+	def GetDirectories( self ):
+		return list( self._scannedDirectories )
+
+	def AddDirectory( self, directory, recursive ):
+		directory = os.path.abspath( directory )
+		if not self._roots.get( directory, False ):
+			self._roots[directory] = recursive
+			self._snapshot = self._scan( )
+
+	def _scan( self ):
+		snapshot = { }
+		self._scannedDirectories = set( )
+		#Recursive roots go first, so a directory that's also a non-recursive root doesn't stop them descending into it.
+		pending = sorted( self._roots.items( ), key = lambda item: item[1] )
+		while pending:
+			directory, recursive = pending.pop( )
+			if directory in self._scannedDirectories:
+				continue
+			try:
+				names = os.listdir( directory )
+			except OSError:
+				continue
+			self._scannedDirectories.add( directory )
+			snapshot[directory] = None
+			for name in names:
+				path = os.path.join( directory, name )
+				try:
+					st = os.stat( path )
+				except OSError:
+					continue
+				snapshot[path] = ( st.st_mtime, st.st_size, st.st_ino )
+				if recursive and os.path.isdir( path ) and not self._isIgnored( path ):
+					pending.append( ( path, True ) )
+		return snapshot
+
+	def ReadChanges( self, timeout ):
+		deadline = None if timeout is None else time.time( ) + timeout
+		while True:
+			snapshot = self._scan( )
+			changed = set( path for path in set( snapshot ) | set( self._snapshot ) if snapshot.get( path ) != self._snapshot.get( path ) )
+			self._snapshot = snapshot
+			if changed:
+				return changed
+
+			if deadline is None:
+				time.sleep( _POLL_INTERVAL_SECONDS )
+			else:
+				remaining = deadline - time.time( )
+				if remaining <= 0:
+					return changed
+				time.sleep( min( remaining, _POLL_INTERVAL_SECONDS ) )
+
+	def Close( self ):
+		pass
+
+
+def _createWatcher( isIgnored ):
+	libc = _loadInotify( )
+	if libc is not None:
+		try:
+			return _InotifyWatcher( libc, isIgnored )
+		except OSError as e:
+			log.LOG_WARN( "Could not initialize inotify ({}), watching for changes by polling instead.".format( e ) )
+	else:
+		log.LOG_INFO( "inotify is not available, watching for changes by polling." )
+	return _PollingWatcher( isIgnored )
+
+
+def Watch( directories, scripts, isIgnored, isRelevant, restartCommand, refresh ):
+	"""
+	Build, then wait for changes and build again, forever. Each build is carried out by a forked child, and this only
+	returns in those children, which should go on to carry out the build.
+
+	:param directories: Directories to watch, along with everything under them
+	:type directories: iterable[str]
+
+	:param scripts: Every script that was run while evaluating the makefile
+	:type scripts: iterable[str]
+
+	:param isIgnored: Called with the path of a directory. Returns True if changes inside it should be ignored, such as
+	for directories the build writes its intermediate files to.
+	:type isIgnored: function
+
+	:param isRelevant: Called with the path of a changed file. Returns True if the change should trigger a build.
+	:type isRelevant: function
+
+	:param restartCommand: Command line that starts watch mode again, used when the scripts change
+	:type restartCommand: list[str]
+
+	:param refresh: Called before each build, after the stat cache has been updated with the latest changes, to bring
+	any state the previous build changed on disk back up to date.
+	:type refresh: function
+	"""
+	scripts = set( os.path.normcase( os.path.abspath( script ) ) for script in scripts )
+
+	watcher = _createWatcher( isIgnored )
+	for directory in directories:
+		watcher.AddDirectory( directory, True )
+	for script in scripts:
+		watcher.AddDirectory( os.path.dirname( script ), False )
+
+	def _absorb( changes ):
+		"""
+		Pass changes on to the stat cache, and return which of them matter.
+		"""
+		if changes is None:
+			log.LOG_WARN_NOPUSH( "Lost track of changes, rechecking everything." )
+			_stat_cache.Clear( )
+			return True, False
+		for path in changes:
+			_stat_cache.Invalidate( path )
+		changes = set( os.path.normcase( path ) for path in changes )
+		return any( isRelevant( path ) for path in changes ), not scripts.isdisjoint( changes )
+
+	while True:
+		_stat_cache.Retain( watcher.GetDirectories( ) )
+		refresh( )
+
+		sys.stdout.flush( )
+		sys.stderr.flush( )
+		_shared_globals.logFile.flush( )
+
+		pid = os.fork( )
+		if pid == 0:
+			watcher.Close( )
+			return
+
+		_, status = os.waitpid( pid, 0 )
+		if os.WIFEXITED( status ):
+			code = os.WEXITSTATUS( status )
+		else:
+			code = 1
+
+		#Everything the build itself wrote is already queued, so pick that up straight away.
+		rebuild, restart = _absorb( watcher.ReadChanges( 0 ) )
+		log.LOG_BUILD( "Build finished with exit code {}. Watching for changes...".format( code ) )
+
+		while not rebuild and not restart:
+			rebuild, restart = _absorb( watcher.ReadChanges( None ) )
+
+		while True:
+			changes = watcher.ReadChanges( _DEBOUNCE_SECONDS )
+			if changes is not None and not changes:
+				break
+			_, moreRestart = _absorb( changes )
+			restart = restart or moreRestart
+
+		if restart:
+			log.LOG_BUILD( "Makefile scripts have changed, restarting." )
+			watcher.Close( )
+			sys.stdout.flush( )
+			sys.stderr.flush( )
+			_shared_globals.logFile.flush( )
+			os.execv( restartCommand[0], restartCommand )
+
+		log.LOG_BUILD( "Changes detected, rebuilding." )
@@ -0,0 +1,245 @@
+# Copyright (C) 2013 Jaedyn K. Draper
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Worker pool.
+
+A fixed number of long-lived threads that take jobs from a shared priority queue, so running a job costs a queue
+operation rather than a thread. Jobs with a lower priority value run first, and jobs with the same priority run in the
+order they were submitted.
+
+Whoever is scheduling the work finds out about finished jobs by reading them off the pool's completion queue, which
+blocks until there is something to read. Jobs whose submitter waits on them directly can skip the completion queue.
+"""
+
+import heapq
+import itertools
+import sys
+import threading
+import traceback
+
+if sys.version_info >= (3,0):
+	import queue
+else:
+	import Queue as queue
+
+
+class Job( object ):
+	"""
+	A unit of work submitted to a WorkerPool.
+
+	:ivar func: Function run by the job, called with no arguments
+	:type func: callable
+
+	:ivar priority: Lower values are run first
+	:type priority: int or float
+
+	:ivar result: Value returned by func, once the job has finished
+	:ivar exception: Exception raised by func, if any
+	:type exception: Exception
+	"""
+	def __init__( self, func, priority, sequence, notify ):
+		self.func = func
+		self.priority = priority
+		self.result = None
+		self.exception = None
+		self.cancelled = False
+		self._sequence = sequence
+		self._notify = notify
+		self._finished = threading.Event( )
+
+
+	def __lt__( self, other ):
+		return ( self.priority, self._sequence ) < ( other.priority, other._sequence )
+
+
+	@property
+	def done( self ):
+		"""Whether the job has finished running or was cancelled"""
+		return self._finished.is_set( )
+
+
+	def Wait( self, timeout = None ):
+		"""
+		Block until the job has finished.
+
+		:param timeout: Longest time to wait, in seconds, or None to wait indefinitely
+		:type timeout: float
+
+		:return: True if the job finished, False if the wait timed out
+		:rtype: bool
+		"""
+		#Waiting without a timeout can't be interrupted by ctrl+c on python 2.
+		while not self._finished.is_set( ):
+			if timeout is not None:
+				return self._finished.wait( timeout )
+			self._finished.wait( 0.5 )
+		return True
+
+
+class WorkerPool( object ):
+	"""
+	A set of worker threads running jobs from a priority queue.
+
+	:param numWorkers: Number of worker threads, i.e., the most jobs that can run at once
+	:type numWorkers: int
+
+	:param name: Name given to the worker threads
+	:type name: str
+
+	:param completionQueue: Queue to put finished jobs on, so that several pools can share one. If None, the pool
+		makes its own.
+	:type completionQueue: queue.Queue
+	"""
+	def __init__( self, numWorkers, name = "csbuild-worker", completionQueue = None ):
+		self._lock = threading.Lock( )
+		self._cond = threading.Condition( self._lock )
+		self._heap = [ ]
+		self._sequence = itertools.count( )
+		self._completed = completionQueue if completionQueue is not None else queue.Queue( )
+		self._running = 0
+		self._stopping = False
+		self._workers = [ ]
+
+		for i in range( max( 1, numWorkers ) ):
+			worker = threading.Thread( target = self._workerLoop, name = "{}-{}".format( name, i ) )
+			worker.daemon = True
+			worker.start( )
+			self._workers.append( worker )
+
+
+	@property
+	def numWorkers( self ):
+		"""Number of worker threads in the pool"""
+		return len( self._workers )
+
+
+	@property
+	def pending( self ):
+		"""Number of jobs waiting for a worker"""
+		with self._lock:
+			return len( self._heap )
+
+
+	@property
+	def running( self ):
+		"""Number of jobs currently being run"""
+		with self._lock:
+			return self._running
+
+
+	def Submit( self, func, priority = 0, notify = True ):
+		"""
+		Queue a job to be run by the next free worker.
+
+		:param func: Function to run, called with no arguments
+		:type func: callable
+
+		:param priority: Lower values are run first
+		:type priority: int or float
+
+		:param notify: Whether to put the job on the completion queue when it's finished
+		:type notify: bool
+
+		:return: The queued job
+		:rtype: Job
+		"""
+		with self._lock:
+			if self._stopping:
+				raise RuntimeError( "Cannot submit work to a worker pool that has been stopped." )
+			job = Job( func, priority, next( self._sequence ), notify )
+			heapq.heappush( self._heap, job )
+			self._cond.notify( )
+		return job
+
+
+	def CancelPending( self ):
+		"""
+		Remove every job that hasn't started running yet from the queue. Cancelled jobs are marked as done, but aren't
+		put on the completion queue.
+
+		:return: The cancelled jobs, in the order they would have run
+		:rtype: list[Job]
+		"""
+		with self._lock:
+			cancelled = sorted( self._heap )
+			self._heap = [ ]
+		for job in cancelled:
+			job.cancelled = True
+			job._finished.set( )
+		return cancelled
+
+
+	def GetCompleted( self, timeout = None ):
+		"""
+		Get the next job to finish, in the order they finished.
+
+		:param timeout: Longest time to wait for one, in seconds, or None to wait indefinitely
+		:type timeout: float
+
+		:return: The finished job, or None if none finished before the timeout
+		:rtype: Job
+		"""
+		if timeout is None:
+			#Waiting without a timeout can't be interrupted by ctrl+c on python 2.
+			while True:
+				try:
+					return self._completed.get( True, 0.5 )
+				except queue.Empty:
+					pass
+		try:
+			return self._completed.get( True, timeout )
+		except queue.Empty:
+			return None
+
+
+	def Stop( self ):
+		"""
+		Let the workers exit once the queue is empty, and wait for them to do so.
+		"""
+		with self._lock:
+			self._stopping = True
+			self._cond.notify_all( )
+		for worker in self._workers:
+			if worker is not threading.current_thread( ):
+				worker.join( )
+
+
+	def _workerLoop( self ):
+		while True:
+			with self._lock:
+				while not self._heap and not self._stopping:
+					self._cond.wait( )
+				if not self._heap:
+					return
+				job = heapq.heappop( self._heap )
+				self._running += 1
+
+			try:
+				job.result = job.func( )
+			except Exception as e:
+				job.exception = e
+				traceback.print_exc( )
+
+			with self._lock:
+				self._running -= 1
+			job._finished.set( )
+			if job._notify:
+				self._completed.put( job )
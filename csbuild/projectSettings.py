@@ -40,7 +40,6 @@ import csbuild
 import fnmatch
 import os
 import re
-import hashlib
 import time
 import sys
 import math
@@ -54,9 +53,17 @@ import copy
 from . import log
 from . import _shared_globals
 from . import _utils
+from . import _header_cache
+from . import _hash_db
+from . import _stat_cache
+from . import _include_resolver
+from . import _preprocessor
 from . import toolchain
 from . import plugin_plist_generator
 
+#Projects are prepared on several threads at once. This guards what they share.
+_prepareLock = threading.Lock( )
+
 
 class projectSettings( object ):
 	"""
@@ -218,6 +225,10 @@ class projectSettings( object ):
 	:ivar ignoreExternalHeaders: Whether or not to ignore external headers when building header information
 	:type ignoreExternalHeaders: bool
 
+	:ivar preprocessorHeaderScanning: Whether or not to evaluate preprocessor conditionals when building header
+	information
+	:type preprocessorHeaderScanning: bool
+
 	:ivar defaultTarget: The target to be built when none is specified
 	:type defaultTarget: str
 
@@ -304,7 +315,7 @@ class projectSettings( object ):
 	:ivar warningsAsErrors: Whether all warnings should be treated as errors
 	:type warningsAsErrors: bool
 
-	:ivar _builtSomething: Whether or not ANY file has been compiled in this build
+	:ivar _builtSomething: Whether or not ANY object has changed in this build, meaning the project has to be relinked
 	:type _builtSomething: bool
 
 	:ivar outputArchitecture: The architecture to build against
@@ -497,6 +508,7 @@ class projectSettings( object ):
 
 		self.headerRecursionDepth = 0
 		self.ignoreExternalHeaders = False
+		self.preprocessorHeaderScanning = False
 
 		self.defaultTarget = "release"
 
@@ -660,16 +672,12 @@ class projectSettings( object ):
 
 
 	def prepareBuild( self ):
-		wd = os.getcwd( )
-		os.chdir( self.workingDirectory )
-
+		#This can run on any thread, alongside other projects being prepared, so it mustn't depend on the current
+		#working directory or on currentProject. Build steps are run one at a time, with both set up for them.
 		self.activeToolchain.SetActiveTool("linker")
 
 		log.LOG_BUILD( "Preparing tasks for {} ({} {}/{})...".format( self.outputName, self.targetName, self.outputArchitecture, self.activeToolchainName ) )
 
-		global currentProject
-		currentProject = self
-
 		pluginClasses = self.plugins
 		self.plugins = []
 		for pluginClass in pluginClasses:
@@ -703,27 +711,22 @@ class projectSettings( object ):
 		self.ccpccmd = self.activeToolchain.Compiler().GetBaseCcPrecompileCommand( self )
 		self.cxxpccmd = self.activeToolchain.Compiler().GetBaseCxxPrecompileCommand( self )
 
-		cmdfile = os.path.join( self.csbuildDir, "{}.csbuild".format( self.targetName ) )
-		cmd = ""
-		if os.access(cmdfile , os.F_OK):
-			with open( cmdfile, "r" ) as f:
-				cmd = f.read( )
-
-		if self.cxxCmd + self.ccCmd != cmd or _shared_globals.rebuild:
+		#Changes to the compile commands are tracked per object file (see should_recompile()), so only a forced
+		#rebuild recompiles everything.
+		if _shared_globals.rebuild:
 			self.recompileAll = True
-			with open( cmdfile, "w" ) as f:
-				f.write( self.cxxCmd + self.ccCmd )
 
-		if self.name not in self.parentGroup.projects:
-			self.parentGroup.projects[self.name] = {}
+		with _prepareLock:
+			if self.name not in self.parentGroup.projects:
+				self.parentGroup.projects[self.name] = {}
 
-		if self.activeToolchainName not in self.parentGroup.projects[self.name]:
-			self.parentGroup.projects[self.name][self.activeToolchainName] = {}
+			if self.activeToolchainName not in self.parentGroup.projects[self.name]:
+				self.parentGroup.projects[self.name][self.activeToolchainName] = {}
 
-		if self.targetName not in self.parentGroup.projects[self.name][self.activeToolchainName]:
-			self.parentGroup.projects[self.name][self.activeToolchainName][self.targetName] = {}
+			if self.targetName not in self.parentGroup.projects[self.name][self.activeToolchainName]:
+				self.parentGroup.projects[self.name][self.activeToolchainName][self.targetName] = {}
 
-		self.parentGroup.projects[self.name][self.activeToolchainName][self.targetName][self.outputArchitecture] = self
+			self.parentGroup.projects[self.name][self.activeToolchainName][self.targetName][self.outputArchitecture] = self
 
 		# Run the stand-alone file discovery.
 		self.RunFileDiscovery()
@@ -742,18 +745,13 @@ class projectSettings( object ):
 			# Exclude the intermediate and output paths in case they're in the working directory.
 			objFilePath = os.path.dirname(_utils.GetSourceObjPath(self, source))
 			if not os.access(objFilePath, os.F_OK):
-				os.makedirs(objFilePath)
-
-		os.chdir( wd )
+				_utils.EnsureDirectory(objFilePath)
 
 
 	def minimalPrepareBuild( self ):
 
 		self.activeToolchain.SetActiveTool("linker")
 
-		global currentProject
-		currentProject = self
-
 		pluginClasses = self.plugins
 		self.plugins = []
 		for pluginClass in pluginClasses:
@@ -805,7 +803,7 @@ class projectSettings( object ):
 
 		# Create the executable/library output directory if it doesn't exist.
 		if not os.access(self.outputDir, os.F_OK):
-			os.makedirs(self.outputDir)
+			_utils.EnsureDirectory(self.outputDir)
 
 		alteredLibraryDirs = []
 		for directory in self.libraryDirsTemp:
@@ -838,7 +836,7 @@ class projectSettings( object ):
 		self.csbuildDir = os.path.join( self.objDir, ".csbuild" )
 
 		if not os.access(self.csbuildDir , os.F_OK):
-			os.makedirs( self.csbuildDir )
+			_utils.EnsureDirectory( self.csbuildDir )
 
 		alteredIncludeDirs = []
 		for directory in self.includeDirsTemp:
@@ -895,11 +893,6 @@ class projectSettings( object ):
 		self.excludeDirs = sorted( realExcludeDirs )
 
 	def RunFileDiscovery( self ):
-		#Have to chdir in case this gets called from a build step.
-		#We'll chdir back when we're done.
-		wd = os.getcwd()
-		os.chdir( self.workingDirectory )
-
 		self.sources = []
 		if not self.forceChunks:
 			self.allsources = []
@@ -924,7 +917,6 @@ class projectSettings( object ):
 						break
 
 			if not self.allsources:
-				os.chdir(wd)
 				return
 
 			#We'll do this even if _use_chunks is false, because it simplifies the linker logic.
@@ -934,14 +926,24 @@ class projectSettings( object ):
 
 		if not _shared_globals.CleanBuild and not _shared_globals.do_install and csbuild.GetOption(
 				"generate_solution" ) is None:
+			#Read and hash every source and header up front, across all threads, so the checks below are only
+			#looking things up rather than each reading files one at a time.
+			prefetch = set( self.allsources )
+			prefetch.update( self.allheaders )
+			for source in self.allsources:
+				dependencies = _header_cache.GetRecordedDependencies( _utils.GetSourceObjPath( self, source ) )
+				if dependencies:
+					prefetch.update( dependencies )
+			_hash_db.PrefetchFileHashes( prefetch )
+
 			for source in self.allsources:
 				if self.should_recompile( source ):
 					self.sources.append( source )
 		else:
 			self.sources = list( self.allsources )
 
-		_shared_globals.allfiles |= set(self.sources)
-		os.chdir(wd)
+		with _prepareLock:
+			_shared_globals.allfiles |= set(self.sources)
 
 
 	def RediscoverFiles(self):
@@ -1262,6 +1264,7 @@ class projectSettings( object ):
 			"chunkSizeTolerance": self.chunkSizeTolerance,
 			"headerRecursionDepth": self.headerRecursionDepth,
 			"ignoreExternalHeaders": self.ignoreExternalHeaders,
+			"preprocessorHeaderScanning": self.preprocessorHeaderScanning,
 			"defaultTarget": self.defaultTarget,
 			"chunkedPrecompile": self.chunkedPrecompile,
 			"precompile": list( self.precompile ),
@@ -1421,7 +1424,7 @@ class projectSettings( object ):
 
 	def get_files( self, sources = None, headers = None, cHeaders = None ):
 		"""
-		Steps through the current directory tree and finds all of the source and header files, and returns them as a list.
+		Steps through the project's working directory tree and finds all of the source and header files, and returns them as a list.
 		Accepts two lists as arguments, which it populates. If sources or headers are excluded from the parameters, it will
 		ignore files of the relevant types.
 		"""
@@ -1431,8 +1434,11 @@ class projectSettings( object ):
 		ambiguousHeaders = set()
 
 		for sourceDir in [ '.' ] + self.extraDirs:
-			for root, dirnames, filenames in os.walk( sourceDir ):
-				absroot = os.path.abspath( root )
+			#Walk from the working directory without changing into it, projects are prepared on several threads at once.
+			walkDir = os.path.join( self.workingDirectory, sourceDir )
+			for walkRoot, dirnames, filenames in os.walk( walkDir ):
+				root = sourceDir + walkRoot[len( walkDir ):]
+				absroot = os.path.normpath( walkRoot )
 				if absroot in excludeDirs:
 					if absroot != self.csbuildDir:
 						log.LOG_INFO( "Skipping dir {0}".format( root ) )
@@ -1494,34 +1500,14 @@ class projectSettings( object ):
 
 
 	def get_full_path( self, headerFile, relativeDir ):
-		if relativeDir in _shared_globals.headerPaths:
-			if headerFile in _shared_globals.headerPaths[relativeDir]:
-				return _shared_globals.headerPaths[relativeDir][headerFile]
-		else:
-			_shared_globals.headerPaths[relativeDir] = {}
-
-		if os.access(headerFile, os.F_OK):
-			_shared_globals.headerPaths[relativeDir][headerFile] = headerFile
-			path = os.path.join(os.getcwd(), headerFile)
-			_shared_globals.headerPaths[relativeDir][headerFile] = path
-			return path
-		else:
-			if relativeDir is not None:
-				path = os.path.join( relativeDir, headerFile )
-				if os.access(path, os.F_OK):
-					return path
+		return _include_resolver.Resolve( headerFile, relativeDir, self.includeDirs, self.workingDirectory )
 
-			for incDir in self.includeDirs:
-				path = os.path.join( incDir, headerFile )
-				if os.access(path, os.F_OK):
-					_shared_globals.headerPaths[relativeDir][headerFile] = path
-					return path
 
-			_shared_globals.headerPaths[relativeDir][headerFile] = ""
-			return ""
+	def get_included_files( self, headerFile ):
+		return _header_cache.GetIncludedFiles( headerFile, self._scan_included_files )
 
 
-	def get_included_files( self, headerFile ):
+	def _scan_included_files( self, headerFile ):
 		headers = []
 		if sys.version_info >= (3, 0):
 			f = open( headerFile, encoding = "latin-1" )
@@ -1657,6 +1643,8 @@ class projectSettings( object ):
 		if not ofile:
 			ofile = _utils.GetSourceObjPath( self, srcFile )
 
+		compiledFile = srcFile
+		chunkSources = ()
 		if self.useChunks and not _shared_globals.disable_chunks:
 			chunk = self.get_chunk( srcFile )
 			if chunk:
@@ -1666,18 +1654,39 @@ class projectSettings( object ):
 
 				log.LOG_INFO("Checking for chunk file {}...".format(chunkfile))
 				#First check: If the object file doesn't exist, we obviously have to create it.
-				if not os.access(ofile , os.F_OK):
+				if not _stat_cache.Exists( ofile ):
 					ofile = chunkfile
+					for chunkList in self.chunks:
+						if srcFile in chunkList:
+							chunkSources = chunkList
+							compiledFile = _utils.GetChunkSourcePath( self, chunkList )
+							break
 
-		if not os.access(ofile , os.F_OK):
+		if not _stat_cache.Exists( ofile ):
 			log.LOG_INFO(
 				"Going to recompile {0} because the associated object file does not exist.".format( srcFile ) )
 			return True
 
+		#Second check: command line.
+		#If the command this file would be compiled with now doesn't match the one its object was built with (because
+		#of a changed flag, define or per-file override), it has to be rebuilt. Precompiled headers are checked in
+		#PreparePrecompiles(), since this is also called for each of the headers that go into them.
+		if not for_precompiled_header:
+			if compiledFile == srcFile:
+				signatureObj = ofile
+			else:
+				signatureObj = _utils.GetSourceObjPath( self, compiledFile, sourceIsChunkPath=self.ContainsChunk( compiledFile ) )
+
+			if _hash_db.Get( ( "cmd", os.path.abspath( signatureObj ) ) ) != \
+					_utils.GetCommandSignature( self, compiledFile, signatureObj, False ):
+				log.LOG_INFO(
+					"Going to recompile {0} because the command used to compile it has changed.".format( srcFile ) )
+				return True
+
 		#Third check: modified time.
 		#If the source file is newer than the object file, we assume it's been changed and needs to recompile.
-		mtime = os.path.getmtime( srcFile )
-		omtime = os.path.getmtime( ofile )
+		mtime = _stat_cache.GetModificationTime( srcFile )
+		omtime = _stat_cache.GetModificationTime( ofile )
 
 		if mtime > omtime:
 			if for_precompiled_header:
@@ -1686,36 +1695,8 @@ class projectSettings( object ):
 						srcFile ) )
 				return True
 
-			oldmd5 = 1
-			newmd5 = 9
-
-			try:
-				newmd5 = _shared_globals.newmd5s[srcFile]
-			except KeyError:
-				with open( srcFile, "r" ) as f:
-					newmd5 = _utils.GetMd5( f )
-				_shared_globals.newmd5s.update( { srcFile: newmd5 } )
-
-			if platform.system( ) == "Windows":
-				src = srcFile[2:]
-			else:
-				src = srcFile
-
-			if sys.version_info >= (3,0):
-				src = src.encode("utf-8")
-				baseName = os.path.basename( src ).decode("utf-8")
-			else:
-				baseName = os.path.basename( src )
-
-			md5file = "{}.md5".format( os.path.join( self.csbuildDir, "md5s", hashlib.md5( src ).hexdigest(), baseName ) )
-
-			if os.access(md5file , os.F_OK):
-				try:
-					oldmd5 = _shared_globals.oldmd5s[md5file]
-				except KeyError:
-					with open( md5file, "rb" ) as f:
-						oldmd5 = f.read( )
-					_shared_globals.oldmd5s.update( { md5file: oldmd5 } )
+			newmd5 = _hash_db.GetFileHash( srcFile )
+			oldmd5 = _hash_db.Get( ( "md5", self.csbuildDir, srcFile ) )
 
 			if oldmd5 != newmd5:
 				log.LOG_INFO(
@@ -1725,10 +1706,43 @@ class projectSettings( object ):
 		#Fourth check: Header files
 		#If any included header file (recursive, to include headers included by headers) has been changed,
 		#then we need to recompile every source that includes that header.
-		#Follow the headers for this source file and find out if any have been changed o necessitate a recompile.
-		headers = set()
-
-		self.follow_headers( srcFile, headers )
+		#Use the dependencies the compiler reported the last time this object was built if we have them. Files
+		#csbuild generates itself (chunks and precompiled headers) and other sources in the same chunk are tracked
+		#separately. Only the ones that have changed since the object was last built or checked need looking at.
+		#If this object has never been built, follow the headers for this source file instead, evaluating
+		#preprocessor conditionals if the project has asked for that.
+		headers = _header_cache.GetObjectDependencies( ofile )
+		knownDependencies = headers is not None
+
+		if knownDependencies:
+			headers = [
+				header for header in _header_cache.GetChangedDependencies( ofile )
+				if header != srcFile and header not in chunkSources and not header.startswith( self.csbuildDir )
+			]
+		else:
+			if self.preprocessorHeaderScanning:
+				headers = _preprocessor.GetIncludedHeaders( self, srcFile, for_precompiled_header )
+				if headers is None:
+					log.LOG_INFO(
+						"Going to recompile {0} because the headers it includes can't be determined.".format( srcFile ) )
+					return True
+			else:
+				headers = set()
+				self.follow_headers( srcFile, headers )
+
+			#If a file has been added somewhere the includes are searched, they may resolve to different headers than
+			#the ones the object was actually built with.
+			if not for_precompiled_header:
+				recordedHeaders = _header_cache.GetRecordedDependencies( ofile )
+				if recordedHeaders is not None:
+					recordedHeaders = set( recordedHeaders )
+					for header in headers:
+						if header and os.path.abspath( header ) not in recordedHeaders:
+							log.LOG_INFO(
+								"Going to recompile {0} because it now includes {1}, which it was not built with.".format(
+									srcFile, header ) )
+							return True
+					_header_cache.ConfirmObjectDependencies( ofile )
 
 		updatedheaders = []
 
@@ -1746,7 +1760,13 @@ class projectSettings( object ):
 					continue
 
 
-			header_mtime = os.path.getmtime( path )
+			try:
+				header_mtime = _stat_cache.GetModificationTime( path )
+			except OSError:
+				#The header has been deleted since this object was built.
+				updatedheaders.append( [header, path] )
+				_shared_globals.headerCheck[header] = True
+				continue
 
 			if header_mtime > omtime:
 				if for_precompiled_header:
@@ -1754,41 +1774,10 @@ class projectSettings( object ):
 					_shared_globals.headerCheck[header] = True
 					continue
 
-				#newmd5 is 0, oldmd5 is 1, so that they won't report equal if we ignore them.
-				newmd5 = 0
-				oldmd5 = 1
+				#Headers we don't have a record for are considered modified.
+				oldmd5 = _hash_db.Get( ( "md5", self.csbuildDir, path ) )
 
-				if platform.system( ) == "Windows":
-					header = header[2:]
-
-				if sys.version_info >= (3,0):
-					header = header.encode("utf-8")
-					baseName = os.path.basename( header ).decode("utf-8")
-				else:
-					baseName = os.path.basename( header )
-
-				md5file = "{}.md5".format( os.path.join( self.csbuildDir, "md5s", hashlib.md5( header ).hexdigest(), baseName ) )
-
-				if os.access(md5file , os.F_OK):
-					try:
-						newmd5 = _shared_globals.newmd5s[path]
-					except KeyError:
-						if sys.version_info >= (3, 0):
-							f = open( path, encoding = "latin-1" )
-						else:
-							f = open( path )
-						with f:
-							newmd5 = _utils.GetMd5( f )
-						_shared_globals.newmd5s.update( { path: newmd5 } )
-					if os.access(md5file , os.F_OK):
-						try:
-							oldmd5 = _shared_globals.oldmd5s[md5file]
-						except KeyError:
-							with open( md5file, "rb" ) as f:
-								oldmd5 = f.read( )
-							_shared_globals.oldmd5s.update( { md5file: oldmd5 } )
-
-				if oldmd5 != newmd5:
+				if oldmd5 is None or oldmd5 != _hash_db.GetFileHash( path ):
 					updatedheaders.append( [header, path] )
 					_shared_globals.headerCheck[header] = True
 					continue
@@ -1808,6 +1797,9 @@ class projectSettings( object ):
 					srcFile, files ) )
 			return True
 
+		if knownDependencies and headers:
+			_header_cache.MarkObjectUpToDate( ofile )
+
 		#If we got here, we assume the object file's already up to date.
 		log.LOG_INFO( "Skipping {0}: Already up to date".format( srcFile ) )
 		return False
@@ -1902,19 +1894,19 @@ class projectSettings( object ):
 			return [l]
 		chunks = []
 		if self.chunkFilesize > 0:
-			sorted_list = sorted( l, key = os.path.getsize, reverse=True )
+			sorted_list = sorted( l, key = _stat_cache.GetSize, reverse=True )
 			while sorted_list:
 				remaining = []
 				chunksize = 0
 				chunk = [sorted_list[0]]
-				chunksize += os.path.getsize( sorted_list[0] )
+				chunksize += _stat_cache.GetSize( sorted_list[0] )
 				sorted_list.pop( 0 )
 				for i in reversed(range(len(sorted_list))):
 					srcFile = sorted_list[i]
 					if not self.CanJoinChunk(chunk, srcFile):
 						remaining.append(srcFile)
 						continue
-					filesize = os.path.getsize( srcFile )
+					filesize = _stat_cache.GetSize( srcFile )
 					if chunksize + filesize > self.chunkFilesize:
 						chunks.append( chunk )
 						remaining += sorted_list[i::-1]
@@ -1926,7 +1918,7 @@ class projectSettings( object ):
 						chunk.append( srcFile )
 						chunksize += filesize
 				if remaining:
-					sorted_list = sorted( remaining, key = os.path.getsize, reverse=True )
+					sorted_list = sorted( remaining, key = _stat_cache.GetSize, reverse=True )
 				else:
 					sorted_list = None
 
@@ -1981,34 +1973,11 @@ class projectSettings( object ):
 
 
 	def save_md5( self, inFile ):
-		# If we're running on Windows, we need to remove the drive letter from the input file path.
-		#if platform.system( ) == "Windows":
-		#	inFile = inFile[2:]
-
-		if sys.version_info >= (3,0):
-			inFile = inFile.encode("utf-8")
-			baseName = os.path.basename( inFile ).decode("utf-8")
-		else:
-			baseName = os.path.basename( inFile )
-
-		md5file = "{}.md5".format( os.path.join( self.csbuildDir, "md5s", hashlib.md5( inFile ).hexdigest(), baseName ) )
-
-		md5dir = os.path.dirname( md5file )
-		if not os.access(md5dir , os.F_OK):
-			os.makedirs( md5dir )
-		newmd5 = ""
 		try:
-			newmd5 = _shared_globals.newmd5s[inFile]
-		except KeyError:
-			if sys.version_info >= (3, 0):
-				f = open( inFile, encoding = "latin-1" )
-			else:
-				f = open( inFile )
-			with f:
-				newmd5 = _utils.GetMd5( f )
-		finally:
-			with open( md5file, "wb" ) as f:
-				f.write( newmd5 )
+			newmd5 = _hash_db.GetFileHash( inFile )
+		except (IOError, OSError):
+			newmd5 = None
+		_hash_db.Set( ( "md5", self.csbuildDir, inFile ), newmd5 )
 
 
 	def save_md5s( self, sources, headers ):
@@ -2022,82 +1991,59 @@ class projectSettings( object ):
 			self.save_md5( path )
 
 
-	def precompile_headers( self ):
-		if not self.needsPrecompileC and not self.needsPrecompileCpp:
-			return True
-
-		starttime = time.time( )
-		log.LOG_BUILD( "Precompiling headers..." )
-
-		self._builtSomething = True
-
-		if not os.access(self.objDir , os.F_OK):
-			os.makedirs( self.objDir )
+	def precompile_header( self, isPlainC ):
+		"""
+		Compile one of the project's precompiled headers. Called from the compile worker pool.
 
-		thread = None
-		cthread = None
-		cppobj = ""
-		cobj = ""
-		if self.needsPrecompileCpp:
-			if not _shared_globals.semaphore.acquire( False ):
-				if _shared_globals.max_threads != 1:
-					log.LOG_INFO( "Waiting for a build thread to become available..." )
-				_shared_globals.semaphore.acquire( True )
-			if _shared_globals.interrupted:
-				csbuild.Exit( 2 )
+		:param isPlainC: Whether to compile the C header rather than the C++ one
+		:type isPlainC: bool
 
-			log.LOG_BUILD(
-				"Precompiling {0} ({1}/{2})...".format(
-					self.cppHeaderFile,
-					_shared_globals.current_compile,
-					_shared_globals.total_compiles ) )
-
-			_shared_globals.current_compile += 1
+		:return: Whether the header compiled successfully
+		:rtype: bool
+		"""
+		if isPlainC:
+			headerFile = self.cHeaderFile
+		else:
+			headerFile = self.cppHeaderFile
 
-			cppobj = self.activeToolchain.Compiler().GetPchFile( self.cppHeaderFile )
+		starttime = time.time( )
 
-			#precompiled headers block on current thread - run runs on current thread rather than starting a new one
-			thread = _utils.ThreadedBuild( self.cppHeaderFile, cppobj, self, True )
-			thread.start( )
+		with self.mutex:
+			self._builtSomething = True
 
-		if self.needsPrecompileC:
-			if not _shared_globals.semaphore.acquire( False ):
-				if _shared_globals.max_threads != 1:
-					log.LOG_INFO( "Waiting for a build thread to become available..." )
-				_shared_globals.semaphore.acquire( True )
-			if _shared_globals.interrupted:
-				csbuild.Exit( 2 )
+			if not os.access(self.objDir , os.F_OK):
+				os.makedirs( self.objDir )
 
+		with _shared_globals.sgmutex:
 			log.LOG_BUILD(
 				"Precompiling {0} ({1}/{2})...".format(
-					self.cHeaderFile,
+					headerFile,
 					_shared_globals.current_compile,
 					_shared_globals.total_compiles ) )
 
 			_shared_globals.current_compile += 1
 
-			cobj = self.activeToolchain.Compiler().GetPchFile( self.cHeaderFile )
-
-			#precompiled headers block on current thread - run runs on current thread rather than starting a new one
-			cthread = _utils.ThreadedBuild( self.cHeaderFile, cobj, self, True )
-			cthread.start( )
-
-		if thread:
-			thread.join( )
-			_shared_globals.precompiles_done += 1
-		if cthread:
-			cthread.join( )
-			_shared_globals.precompiles_done += 1
+		obj = self.activeToolchain.Compiler().GetPchFile( headerFile )
+		_utils.ThreadedBuild( headerFile, obj, self, True ).run( )
 
 		totaltime = time.time( ) - starttime
 		totalmin = math.floor( totaltime / 60 )
 		totalsec = math.floor( totaltime % 60 )
-		log.LOG_BUILD( "Precompile took {0}:{1:02}".format( int( totalmin ), int( totalsec ) ) )
+		log.LOG_BUILD( "Precompile of {0} took {1}:{2:02}".format( os.path.basename( headerFile ), int( totalmin ), int( totalsec ) ) )
+
+		succeeded = self.fileStatus.get( os.path.normcase( headerFile ) ) != _shared_globals.ProjectState.FAILED
+		with _shared_globals.sgmutex:
+			_shared_globals.precompiles_done += 1
+
+		with self.mutex:
+			if not succeeded:
+				self.precompileFailed = True
 
-		self.precompileDone = True
-		self.precompileFailed = self.compilationFailed
+			finished = ( _shared_globals.ProjectState.FINISHED, _shared_globals.ProjectState.FAILED )
+			self.precompileDone = ( not self.needsPrecompileCpp or self.fileStatus.get( os.path.normcase( self.cppHeaderFile ) ) in finished ) \
+				and ( not self.needsPrecompileC or self.fileStatus.get( os.path.normcase( self.cHeaderFile ) ) in finished )
 
-		return not self.compilationFailed
+		return succeeded
 
 
 
@@ -758,6 +758,20 @@ class SettingsOverrider( object ):
 		self._settingsOverrides["ignoreExternalHeaders"] = True
 
 
+	def EnablePreprocessorHeaderScanning( self ):
+		"""
+		If this option is set, #if, #ifdef, #ifndef, #elif and #else blocks are evaluated when working out which headers
+		a file includes, using the project's defines and undefines and (with toolchains that can report them) the macros
+		the compiler predefines for the target and architecture. Headers that are only included in inactive blocks, such
+		as the ones for other platforms, are then no longer treated as dependencies. #pragma once, include guards and
+		computed includes (#include MACRO) are honored as well.
+
+		This is only used for files that haven't been built yet, or when the dependencies reported by the compiler for
+		the last build of a file can't be used.
+		"""
+		self._settingsOverrides["preprocessorHeaderScanning"] = True
+
+
 	def DisableWarnings( self ):
 		"""
 		Disables all warnings.
@@ -1450,6 +1464,18 @@ class compilerBase( toolBase ):
 	def GetPostPreprocessorSanitationLines(self):
 		return []
 
+
+	def SupportsDistributedCompile( self ):
+		"""
+		Whether files can be compiled on another machine, by running GetPreprocessCommand() locally and compiling its
+		output there with the command from GetExtendedCommand(). The output must have line markers naming the headers
+		it was made from.
+
+		:return: True if compiles can be sent to csbuild-worker processes
+		:rtype: bool
+		"""
+		return False
+
 	@abstractmethod
 	def GetObjExt(self):
 		"""
@@ -1457,6 +1483,57 @@ class compilerBase( toolBase ):
 		"""
 		pass
 
+	def GetDependencyFile( self, outObj ):
+		"""
+		Get the path of the dependency file the compiler will write alongside a given object file, if any.
+
+		:param outObj: The object file being generated
+		:type outObj: str
+
+		:return: Path to the dependency file, or None if this compiler doesn't write one
+		:rtype: str or None
+		"""
+		return None
+
+
+	def ParseDependencies( self, outObj, output ):
+		"""
+		Collect the list of files a successfully compiled object depends on, as reported by the compiler.
+		Compilers that report dependencies on their standard output should strip that information out of the
+		returned output so it isn't shown to the user.
+
+		:param outObj: The object file that was generated
+		:type outObj: str
+
+		:param output: The compiler's standard output
+		:type output: str
+
+		:return: A tuple of (list of dependency paths, or None if unavailable; the output to show the user)
+		:rtype: tuple[list[str] or None, str]
+		"""
+		return None, output
+
+	def GetPredefinedMacros( self, baseCmd, project, isCpp ):
+		"""
+		Get every macro the compiler predefines for a given command line, including the ones defined and undefined on
+		the command line itself. Used by the conditional include scanner (see
+		:func:`csbuild.EnablePreprocessorHeaderScanning`).
+
+		:param baseCmd: The base command a file is compiled with
+		:type baseCmd: str
+
+		:param project: The project currently being compiled
+		:type project: :class:`csbuild.projectSettings.projectSettings`
+
+		:param isCpp: Whether the file is compiled as C++
+		:type isCpp: bool
+
+		:return: Dictionary of macro name to ( parameter list, or None for object-like macros; replacement text ), or
+		None if the compiler can't report them, in which case only the project's defines and undefines are known
+		:rtype: dict or None
+		"""
+		return None
+
 	def SupportsObjectScraping(self):
 		return False
 
@@ -34,6 +34,7 @@ from . import _shared_globals
 from . import toolchain
 from . import log
 from . import _utils
+from . import _preprocessor
 from .scrapers import ELF
 
 class gccBase( object ):
@@ -343,9 +344,9 @@ class GccCompiler( gccBase, toolchain.compilerBase ):
 		inc = ""
 		if forceIncludeFile:
 			inc = "-include {0}".format( forceIncludeFile )
-		return "{} {}{}{} -o\"{}\" \"{}\"".format( baseCmd,
+		return "{} {}{}{} -MMD -MF\"{}\" -o\"{}\" \"{}\"".format( baseCmd,
 			self._getWarnings( self.warnFlags, project.noWarnings ),
-			self._getIncludeDirs( project.includeDirs ), inc, outObj,
+			self._getIncludeDirs( project.includeDirs ), inc, self.GetDependencyFile( outObj ), outObj,
 			inFile )
 
 
@@ -366,7 +367,11 @@ class GccCompiler( gccBase, toolchain.compilerBase ):
 
 
 	def GetPreprocessCommand(self, baseCmd, project, inFile ):
-		return "\"{}\" -E {} \"{}\"".format(baseCmd, self._getIncludeDirs( project.includeDirs ), inFile)
+		return "{} -E {} \"{}\"".format(baseCmd, self._getIncludeDirs( project.includeDirs ), inFile)
+
+
+	def SupportsDistributedCompile( self ):
+		return True
 
 
 	def PragmaMessage(self, message):
@@ -384,6 +389,35 @@ class GccCompiler( gccBase, toolchain.compilerBase ):
 		return ".o"
 
 
+	def GetDependencyFile( self, outObj ):
+		return "{}.d".format( outObj )
+
+
+	def ParseDependencies( self, outObj, output ):
+		try:
+			with open( self.GetDependencyFile( outObj ), "r" ) as f:
+				text = f.read( )
+		except IOError:
+			return None, output
+
+		#The file is a makefile rule ("target: dep1 dep2 ..."), with long lines continued by a trailing backslash.
+		text = text.replace( "\\\r\n", " " ).replace( "\\\n", " " )
+		match = re.search( r":(?:\s|$)", text )
+		if match is None:
+			return None, output
+
+		deps = []
+		for dep in re.findall( r"(?:\\.|[^\s\\])+", text[match.end( ):] ):
+			deps.append( re.sub( r"\\([ #])", r"\1", dep ).replace( "$$", "$" ) )
+		return deps, output
+
+
+	def GetPredefinedMacros( self, baseCmd, project, isCpp ):
+		return _preprocessor.RunPredefinedMacroCommand(
+			"{} -dM -E -x {} -".format( baseCmd.replace( " -c ", " " ), "c++" if isCpp else "c" )
+		)
+
+
 	def GetPchFile( self, fileName ):
 		return fileName + ".gch"
 
@@ -50,6 +50,8 @@ class VcVarsCache:
 VC_VARS_CACHE_MAP = {} # Dictionary mapping output architecture to cached data from vcvarsall.bat.
 DEFAULT_MSVC_VERSION = 0
 
+_SHOW_INCLUDES_PREFIX = "Note: including file:" # Prefix for each line of /showIncludes output.
+
 MSVC_VERSION = OrderedDict([
 	("2010", 100),
 	("2012", 110),
@@ -244,7 +246,8 @@ class MsvcBase( object ):
 
 
 	def GetEnv( self ):
-		return { "PATH": self.shared.environPath }
+		#/showIncludes output is translated on localized installs, and only the English prefix is recognized.
+		return { "PATH": self.shared.environPath, "VSLANG": "1033" }
 
 
 	def InterruptExitCode( self ):
@@ -493,6 +496,7 @@ class MsvcCompiler( MsvcBase, toolchain.compilerBase ):
 			self._getDefaultExtendedCompilerArgs(),
 			self._getPdbArg(),
 			'/Fo"{}"'.format( output_obj ),
+			"/showIncludes",
 			'/FI"{}"'.format( force_include_file ) if force_include_file else "",
 			'/Yu"{}"'.format( force_include_file ) if force_include_file else "",
 			"/FS" if self.shared.msvc_version >= MSVC_VERSION["2013"] else "",
@@ -530,6 +534,7 @@ class MsvcCompiler( MsvcBase, toolchain.compilerBase ):
 			'/Fp"{}"'.format( output_obj ),
 			'/FI"{}"'.format( input_file ),
 			'/Fo"{}"'.format( objFile ),
+			"/showIncludes",
 			'"{}"'.format( srcFile ),
 		]
 		return self._convertArgListToString( argList )
@@ -600,6 +605,29 @@ class MsvcCompiler( MsvcBase, toolchain.compilerBase ):
 		return ".obj"
 
 
+	def ParseDependencies( self, outObj, output ):
+		#/showIncludes writes one line per included file to stdout. System headers are skipped, the same way
+		#gcc's -MMD skips them.
+		systemDirs = [ os.path.normcase( os.path.normpath( path ) ) for path in self.shared._include_path ]
+		deps = []
+		lines = []
+		found = False
+		for line in output.split( "\n" ):
+			if line.startswith( _SHOW_INCLUDES_PREFIX ):
+				found = True
+				path = os.path.normcase( os.path.normpath( line[len( _SHOW_INCLUDES_PREFIX ):].strip( ) ) )
+				if not any( path.startswith( systemDir ) for systemDir in systemDirs ):
+					deps.append( path )
+			else:
+				lines.append( line )
+		#If the compiler ignored VSLANG and wrote the prefix in another language, recording no dependencies would stop
+		#header changes from ever recompiling the file, so the headers are left to be found by scanning instead. The
+		#same happens, harmlessly, for a file that includes nothing at all.
+		if not found:
+			return None, output
+		return deps, "\n".join( lines )
+
+
 	def GetPchFile( self, fileName ):
 		return fileName.rsplit( ".", 1 )[0] + ".pch"
 
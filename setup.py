@@ -10,6 +10,7 @@ setup(name='csbuild',
       #py_modules=['csbuild'],
       packages=["csbuild"],
       package_data={"csbuild":["version", "*.py", "*/*.py", "*/*/*.py"]},
+      scripts=["csbuild-worker"],
       author="Jaedyn K. Draper",
       author_email="jaedyn.pypi@jaedyn.co",
       url="https://github.com/ShadauxCat/csbuild",